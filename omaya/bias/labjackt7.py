@@ -8,6 +8,10 @@ import numpy as np
 import datetime
 import os
 import logging
+from omaya.bias.lua_sweep import make_sweep_script, adc_command, REGISTER_NAMES
+from omaya.bias.stream import StreamAcquisition
+from omaya.bias.stream_file import StreamWriter
+from omaya.utils.decimate import RunningMean, BoxcarDecimator
 
 SPI_DEVICES = {
     'MixerDAC0' : [0,0,0],
@@ -34,6 +38,10 @@ ADC_READ = {
 DAC_SOFTWARE_LDAC_MODE = 0x02
 DAC_UPDATE_ONE_CHANNEL_MODE = 0x01
 DAC_WRITE_ONE_CHANNEL_MODE = 0x00
+DAC_LDAC_REGISTER = 0x06
+
+# largest SPI transfer the T7 does in one SPI_GO
+SPI_MAX_BYTES = 56
 
 
 SPI_DIONUM_CONF = {
@@ -67,13 +75,33 @@ SPI_DIONUM_CONF_OLD = {
     }
 
 
+def adc_counts_to_voltage(raw):
+    """
+    Converts the raw 16 bit MAX1168 result (bytes 1 and 2 of
+    the SPI frame) into volts, the same way adc_read does.
+    Works on scalars and numpy arrays.
+    """
+    ## ignore last 2 bits and shift up by 3
+    counts = (raw & 0xffffc) << 3
+    return (counts/float(2**16)) * 4.05
 
 
 class LabJackT7(object):
-    def __init__(self, debug=True, oldBoard=True):
+    def __init__(self, debug=True, oldBoard=True, shadow=True):
         self.debug = debug
         self.handle = ljm.openS("ANY", "ANY", "ANY")
         self.device = [0,0,0]
+        # shadow copy of the bias card state so that redundant
+        # selects and register writes can be skipped
+        self.shadow = shadow
+        self.invalidate_state()
+        # DAC values staged with stage_dac, keyed by (card, channel)
+        self._staged = {}
+        # commit_dac(latch='syncload') is not verified on hardware,
+        # set this to True to use it anyway
+        self.experimental_syncload = False
+        # last load commanded with select_Load, None when not known
+        self._load = None
         info = ljm.getHandleInfo(self.handle)
         if debug:
             print("Opened a LabJack with Device type: %i, Connection type: %i,\n"
@@ -86,9 +114,35 @@ class LabJackT7(object):
             self.reset()
         self.setup_SPI()
         self.scanRate = 1200 # for AIN0/AIN1 sampling
+        self.stream = None
         
     def reset(self):
         ljm.eWriteName(self.handle, 'DIO'+ str(self.spi_dionums['reset']), 1)
+        self.invalidate_state()
+
+    def invalidate_state(self, pca=True):
+        """
+        Forgets the shadow copy of the select lines, SPI_NUM_BYTES
+        and PCA9502 registers, so that the next access rewrites
+        everything. Call this after a reset of the bias card or
+        when something else has driven the SPI bus. With pca=False
+        the PCA9502 registers (and so the mux channel) are kept.
+        """
+        self._dio_state = {}
+        self._spi_numbytes = None
+        if pca:
+            self._pca_iodir = {}
+            self._pca_output = {}
+        self.spi_device = None
+        self.spi_card = None
+
+    def resync(self, card=0):
+        """
+        Invalidates the shadow state and puts the MuxSPI PCA9502
+        of card back into a known state (all outputs, mux channel 0)
+        """
+        self.invalidate_state()
+        self.set_mux(0, card=card)
             
 
     def _print(self, msg, loglevel=logging.INFO, ):
@@ -100,26 +154,60 @@ class LabJackT7(object):
         ljm.eWriteName(self.handle, "FIO5", 1) # Enable
         print("Enabling the motor")
         ljm.eWriteName(self.handle, "FIO6", 0) # Input A
+        self._load = None
         print("Motor on Home")
         HLFBstate = ljm.eReadName(self.handle, "FIO7") # HLFB
         print("Reading HLFB: %0.0f" %(HLFBstate))
 
-    def select_Load(self, load):
+    def _wait_hlfb(self, moving, timeout, poll_interval):
+        """
+        Polls HLFB (FIO7, high while the motor moves) every
+        poll_interval seconds until it reads moving. Returns whether
+        it did within timeout.
+        """
+        t0 = time.time()
+        while True:
+            if bool(ljm.eReadName(self.handle, "FIO7")) == moving:
+                return True
+            if time.time() - t0 >= timeout:
+                return False
+            time.sleep(poll_interval)
+
+    def select_Load(self, load, timeout=5.0, poll_interval=0.005, start_timeout=0.05):
+        """
+        Moves the load motor to the hot (home) or cold position and
+        waits for HLFB to report it in position, polling every
+        poll_interval seconds. When load differs from the last
+        commanded one HLFB has to show the move starting within
+        start_timeout; when it is the same no start is waited for.
+        If the last load is not known (after a failed move) a missing
+        start is taken as the motor being there already.
+        Returns the move time in seconds and raises TimeoutError if
+        the move does not start or the motor is not in position after
+        timeout seconds.
+        """
         if load == "hot":
-            ljm.eWriteName(self.handle, "FIO6", 0) # Input A
-            HLFBstate = ljm.eReadName(self.handle, "FIO7")
-            while(HLFBstate):
-                  HLFBstate = ljm.eReadName(self.handle, "FIO7")
-            print("Hot load on")
-            #return 'Hot'                 
+            inputA = 0
         elif load == "cold":
-            ljm.eWriteName(self.handle, "FIO6", 1) # Input A
-            print("Cold load ON")
+            inputA = 1
         else:
-            print("wrong command: choose either 'cold' or 'hot'")
+            raise ValueError("Unknown load %s, choose either 'cold' or 'hot'" % load)
+        last, self._load = self._load, None
+        t0 = time.time()
+        ljm.eWriteName(self.handle, "FIO6", inputA) # Input A
+        if last != load:
+            if not self._wait_hlfb(True, start_timeout, poll_interval) and last is not None:
+                raise TimeoutError("%s load move did not start within %s s" % (load.capitalize(), start_timeout))
+        if not self._wait_hlfb(False, timeout, poll_interval):
+            raise TimeoutError("%s load not in position within %s s" % (load.capitalize(), timeout))
+        self._load = load
+        elapsed = time.time() - t0
+        self._print("%s load on after %.3f s" % (load.capitalize(), elapsed))
+        return elapsed
 
     def shutdown_motor(self):
         ljm.eWriteName(self.handle, "FIO6", 0) # Input A
+        self._load = None
         print("Hot load on(Safe position)")
         time.sleep(1.500)
         ljm.eWriteName(self.handle, "FIO5", 0) # Enable
@@ -174,8 +262,90 @@ class LabJackT7(object):
 
     def spi_numbytes(self, numBytes):
         """Sets the size of SPI Tx/Rx registers on labjack"""
+        if self.shadow and self._spi_numbytes == numBytes:
+            return
         ljm.eWriteName(self.handle, "SPI_NUM_BYTES", numBytes)
-        
+        self._spi_numbytes = numBytes
+
+    def _select_frames(self, device=None, card=None):
+        """
+        Returns the (names, values) of the DIO writes needed to
+        select SPI device and card. Either can be None to leave
+        the corresponding lines alone. Lines that already hold
+        the requested level are left out, and the shadow state
+        is updated.
+        """
+        lines = []
+        if device is not None:
+            addr = SPI_DEVICES[device]
+            for bit in range(3):
+                lines.append(('DIO' + str(self.spi_dionums['spi_sel_%i' % bit]), addr[bit]))
+            self.spi_device = device
+        if card is not None:
+            # select card (low) and deselect the others (high)
+            for other in range(4):
+                dionum = self.spi_dionums['spi_card_%i' % other]
+                if dionum == 'NA':
+                    continue
+                lines.append(('DIO' + str(dionum), 0 if other == card else 1))
+            self.spi_card = card
+        aNames = []
+        aValues = []
+        for name, value in lines:
+            if self.shadow and self._dio_state.get(name) == value:
+                continue
+            aNames.append(name)
+            aValues.append(value)
+            self._dio_state[name] = value
+        return aNames, aValues
+
+    def _spi_frame(self, data, device=None, card=None, read=False):
+        """
+        Builds the eNames frames for one SPI transfer: select lines,
+        SPI_NUM_BYTES, SPI_DATA_TX, SPI_GO and optionally the
+        SPI_DATA_RX readback. Returns (aNames, aWrites, aNumValues,
+        aValues) lists ready to be concatenated with other frames.
+        """
+        numBytes = len(data)
+        aNames, aValues = self._select_frames(device=device, card=card)
+        aWrites = [ljm.constants.WRITE] * len(aNames)
+        aNumValues = [1] * len(aNames)
+        if not self.shadow or self._spi_numbytes != numBytes:
+            aNames.append("SPI_NUM_BYTES")
+            aWrites.append(ljm.constants.WRITE)
+            aNumValues.append(1)
+            aValues.append(numBytes)
+            self._spi_numbytes = numBytes
+        aNames += ["SPI_DATA_TX", "SPI_GO"]
+        aWrites += [ljm.constants.WRITE] * 2
+        aNumValues += [numBytes, 1]
+        aValues += list(data) + [1]
+        if read:
+            aNames.append("SPI_DATA_RX")
+            aWrites.append(ljm.constants.READ)
+            aNumValues.append(numBytes)
+            aValues += [0] * numBytes
+        return aNames, aWrites, aNumValues, aValues
+
+    def spi_transaction(self, data, device=None, card=None, read=False):
+        """
+        Performs a complete SPI frame in a single LJM round trip.
+        The device and card select lines (if given), byte count,
+        TX data, SPI_GO and RX readback are all packed into one
+        eNames packet. Returns the received bytes if read is True.
+        """
+        aNames, aWrites, aNumValues, aValues = self._spi_frame(data, device=device,
+                                                               card=card, read=read)
+        try:
+            results = ljm.eNames(self.handle, len(aNames), aNames, aWrites,
+                                 aNumValues, aValues)
+        except ljm.LJMError:
+            # we no longer know what made it to the device
+            self.invalidate_state()
+            raise
+        if read:
+            return [int(byte) for byte in results[-len(data):]]
+
     def device_select(self, device):
         """Selects SPI controlled device on Mixer Bias Board
         # 'Device' : character string
@@ -191,18 +361,30 @@ class LabJackT7(object):
         """
         addr = SPI_DEVICES.get(device, None)
         if addr is not None:
-            for bit in range(3):
-                # dio_name = 'CIO%i'%bit
-                dio_name = 'DIO'+ str(self.spi_dionums['spi_sel_%i'%bit])
-                ljm.eWriteName(self.handle, dio_name, addr[bit])
+            aNames, aValues = self._select_frames(device=device)
+            if aNames:
+                self._write_select(aNames, aValues)
             print("Selecting SPI device %s: [%i, %i, %i]" %(device, addr[0], addr[1], addr[2]))
 
     def card_select(self, card=0): 
-        """Selects which Mixer Bias Board (set low)
-        TODO: Need to also deselect other cards in this process
+        """Selects which Mixer Bias Board (set low) and
+        deselects the other ones (set high)
+        """
+        aNames, aValues = self._select_frames(card=card)
+        if aNames:
+            self._write_select(aNames, aValues)
+
+    def _write_select(self, aNames, aValues):
+        """
+        Writes select lines whose shadow state _select_frames has
+        already updated, dropping the shadow state if the write fails
         """
-        card_name = 'DIO'+str(self.spi_dionums['spi_card_%i'%card])
-        ljm.eWriteName(self.handle, card_name, 0)
+        try:
+            ljm.eWriteNames(self.handle, len(aNames), aNames, aValues)
+        except ljm.LJMError:
+            # we no longer know what made it to the device
+            self.invalidate_state()
+            raise
 
 
     def _spi_go(self):
@@ -221,67 +403,58 @@ class LabJackT7(object):
         self._spi_go()
         return dataRead
 
-    def _set_pca_in(self):
-        """
-        Set PCA9502 to all inputs
-        """
-        self.spi_numbytes(2)
+    def _pca_key(self, device, card):
+        if device is None:
+            device = self.spi_device
+        if card is None:
+            card = self.spi_card
+        return (device, card)
+
+    def _set_pca_iodir(self, iodir, device=None, card=None):
+        key = self._pca_key(device, card)
+        if self.shadow and self._pca_iodir.get(key) == iodir:
+            return
         #
-        # Configure all GPIO pins on PCA to INPUT (0)
         # 'IODir' (address: 0xA)
         # Number becomes 0x5 because 4 address bits are split into 2 nibbles (annoying)
         #
-        dataWrite = []
-        dataWrite.append(0x50)
-        dataWrite.append(0x00)
-        self._spi_write_array(dataWrite)
+        self.spi_transaction([0x50, iodir], device=device, card=card)
+        self._pca_iodir[key] = iodir
 
-    def _set_pca_out(self):
+    def _set_pca_in(self, device=None, card=None):
         """
-        Set PCA9502 to all outputs
+        Set PCA9502 to all inputs
         """
-        self.spi_numbytes(2)
-        #
         # Configure all GPIO pins on PCA to INPUT (0)
-        # 'IODir' (address: 0xA)
-        # Number becomes 0x5 because 4 address bits are split into 2 nibbles (annoying)
-        #
-        dataWrite = []
-        dataWrite.append(0x50)
-        dataWrite.append(0xFF)
-        self._spi_write_array(dataWrite)
+        self._set_pca_iodir(0x00, device=device, card=card)
 
-    def _get_pca_iodir(self):
+    def _set_pca_out(self, device=None, card=None):
+        """
+        Set PCA9502 to all outputs
+        """
+        # Configure all GPIO pins on PCA to OUTPUT (1)
+        self._set_pca_iodir(0xFF, device=device, card=card)
+
+    def _get_pca_iodir(self, device=None, card=None):
         """
         Get PCA9502 IODdir
         """
-        self.spi_numbytes(2)
-        dataWrite = []
-        dataWrite.append(0xD0)
-        dataWrite.append(0x00)
-        self._spi_write_array(dataWrite)
-        return self._spi_read_array(2)
-
-    def _load_pca_output(self, byte):
-        self.spi_numbytes(2)
-        dataWrite = []
-        dataWrite.append(0x58)
-        dataWrite.append(byte)
-        self._spi_write_array(dataWrite)
+        dataRead = self.spi_transaction([0xD0, 0x00], device=device, card=card,
+                                        read=True)
+        self._pca_iodir[self._pca_key(device, card)] = dataRead[1]
+        return dataRead
+
+    def _load_pca_output(self, byte, device=None, card=None):
+        self.spi_transaction([0x58, byte], device=device, card=card)
+        self._pca_output[self._pca_key(device, card)] = byte
         
-    def _read_pca(self):
-        self.spi_numbytes(2)
-        dataWrite = []
-        dataWrite.append(0xD8)
-        dataWrite.append(0x00)
-        self._spi_write_array(dataWrite)
-        return self._spi_read_array(2)
+    def _read_pca(self, device=None, card=None):
+        return self.spi_transaction([0xD8, 0x00], device=device, card=card,
+                                    read=True)
     
     def get_boardID(self, card=0):
-        self.device_select('BoardID')
-        self.card_select(card)
-        self._set_pca_in()
-        dataRead = self._read_pca()
+        self._set_pca_in(device='BoardID', card=card)
+        dataRead = self._read_pca(device='BoardID', card=card)
         print("BoardID: 0x%0x" % dataRead[1])
         return dataRead[1]
         
@@ -289,24 +462,20 @@ class LabJackT7(object):
         """
         deprecated. Do not use
         """
-        self.device_select('LoopControl')
-        self.card_select(card)
-        self._set_pca_out()
+        self._set_pca_out(device='LoopControl', card=card)
         if loop_control == 'Open':
             byte = 0x00
         else:
             byte = 0xff
-        self._load_pca_output(byte)
+        self._load_pca_output(byte, device='LoopControl', card=card)
         #self.device_select('LoopControl')
         #self.card_select()        
         #print(self._read_pca())
         # Pull Sync Load 2 low and then High leaving other
         # channels of Mux_SPI PCA9502 alone
-        self.device_select('MuxSPI')
-        self.card_select(card)
-        self._set_pca_out()
+        self._set_pca_out(device='MuxSPI', card=card)
         byte = 0x7f & channel
-        self._load_pca_output(byte)
+        self._load_pca_output(byte, device='MuxSPI', card=card)
         #time.sleep(0.010)
         #byte = 0xff & channel
         byte = 0x80
@@ -323,14 +492,11 @@ class LabJackT7(object):
         Sets Max1168 ADC to wake up with
         references on
         """
-        self.device_select('ADC')
-        self.card_select(card)
-        self.spi_numbytes(3)
         # 0x41 - selects channel 2 (0x4)
         # and selects internal clock and internal reference
         # and single channel mode
-        self._spi_write_array([0x41, 0x00, 0x00])
-        dataRead = self._spi_read_array(3)
+        dataRead = self.spi_transaction([0x41, 0x00, 0x00], device='ADC',
+                                        card=card, read=True)
         return dataRead
 
     def adc_read(self, channel=0, read_in=0, timeout=0.010, card=0, debug=False):
@@ -346,20 +512,20 @@ class LabJackT7(object):
         MAG_I:  read_in=5
         2V_ref: read_in=6
         ADC_IN: read_in=7
+
+        timeout is the settling time allowed after switching
+        the mux channel and before the conversion. It is skipped
+        when the mux is already on channel.
         """
         #select channel
-        self.set_mux(channel, card=card)
-	#select ADC
-        self.device_select('ADC')
-        self.card_select(card)
-        self.spi_numbytes(3)
-        # 0x41 - selects channel 2 (0x4)
-        # and selects internal clock and internal reference
-        # and single channel mode
-        first_byte = ((read_in << 5) & 0xE0) | (0x01)
-        self._spi_write_array([first_byte, 0x00, 0x00])
-        time.sleep(timeout)
-        dataRead = self._spi_read_array(3)
+        if self.set_mux(channel, card=card):
+            time.sleep(timeout)
+        # select ADC and convert in a single round trip. The
+        # conversion result is clocked out in the same frame
+        # as the command byte.
+        first_byte = adc_command(read_in)
+        dataRead = self.spi_transaction([first_byte, 0x00, 0x00], device='ADC',
+                                        card=card, read=True)
         print(dataRead)
         ## construct as 16 bit number, ignore last 2 bits
         ## and shift up by 3
@@ -373,6 +539,65 @@ class LabJackT7(object):
         else:
             return voltage
     
+    def adc_read_burst(self, channel=0, read_in=(0, 1), nsamples=16, card=0,
+                       transfers_per_packet=4, settle=0.010):
+        """
+        Oversampled read of the MAX1168. The mux and ADC are selected
+        once and nsamples conversions of every input in read_in
+        (see adc_read) are clocked back to back, up to SPI_MAX_BYTES
+        per SPI transfer and transfers_per_packet transfers per eNames
+        packet. After a mux switch the inputs are given settle seconds
+        (the same default as adc_read) and one extra conversion per
+        input is made and dropped. No wait is made when the mux is
+        already on channel.
+        Returns the mean and standard deviation in volts (one per
+        read_in) and the counts as an (nsamples, len(read_in)) array.
+        """
+        read_in = list(read_in)
+        nread = len(read_in)
+        dummy = 0
+        if self.set_mux(channel, card=card):
+            dummy = 1
+            if settle:
+                time.sleep(settle)
+        commands = [adc_command(ri) for ri in read_in] * (nsamples + dummy)
+        per_transfer = SPI_MAX_BYTES // 3
+        transfers = [commands[i:i+per_transfer]
+                     for i in range(0, len(commands), per_transfer)]
+        rx = []
+        for p in range(0, len(transfers), transfers_per_packet):
+            aNames, aWrites, aNumValues, aValues = [], [], [], []
+            sizes = []
+            for transfer in transfers[p:p+transfers_per_packet]:
+                data = []
+                for command in transfer:
+                    data += [command, 0x00, 0x00]
+                names, writes, numValues, values = self._spi_frame(data, device='ADC',
+                                                                   card=card, read=True)
+                aNames += names
+                aWrites += writes
+                aNumValues += numValues
+                aValues += values
+                sizes.append(len(data))
+            try:
+                results = ljm.eNames(self.handle, len(aNames), aNames, aWrites,
+                                     aNumValues, aValues)
+            except ljm.LJMError:
+                self.invalidate_state()
+                raise
+            for offset, size in zip(self._rx_positions(aNames, aNumValues), sizes):
+                rx += list(results[offset:offset+size])
+        rx = np.array(rx, dtype=int).reshape(-1, 3)[dummy*nread:]
+        raw = (rx[:, 1] << 8) + rx[:, 2]
+        counts = ((raw & 0xffffc) << 3).reshape(nsamples, nread)
+        volts = adc_counts_to_voltage(raw).reshape(nsamples, nread)
+        return volts.mean(axis=0), volts.std(axis=0), counts
+
+    def _rx_positions(self, aNames, aNumValues):
+        """Offsets of the SPI_DATA_RX values in an eNames result"""
+        offsets = np.cumsum([0] + list(aNumValues[:-1]))
+        return [offset for name, offset in zip(aNames, offsets) if name == 'SPI_DATA_RX']
+
     def set_mux(self, channel=0, card=0):
         """
         Uses MUX_SPI to select the PCA9502 (U79)
@@ -382,66 +607,70 @@ class LabJackT7(object):
         first 3 of which is used to select MUX_A0, MUX_A1, and MUX_A2.
         GPIO7 is used to address Sync LOAD 2 which is used 
         to latch the Mixer Loop Control. 
+
+        Returns True if the mux had to be switched, False if the
+        shadow state shows it is already on channel.
         """
-        self.device_select('MuxSPI')
-        self.card_select(card)
-        self._set_pca_out()
-        self._load_pca_output(channel & 0x07)
+        byte = channel & 0x07
+        if (self.shadow and self._pca_iodir.get(('MuxSPI', card)) == 0xFF
+            and self._pca_output.get(('MuxSPI', card)) == byte):
+            return False
+        self._set_pca_out(device='MuxSPI', card=card)
+        self._load_pca_output(byte, device='MuxSPI', card=card)
+        return True
 
     def dac_reset_and_ldac(self, card=0):
-        self.device_select('MixerDAC0')
-        self.card_select(card)
-        self.spi_numbytes(4)
-        # clear to mid-scale
-        self._spi_write_array([0x05, 0x00, 0x00, 0x01])
-        # set to S/w LDAC register (ignore LDAC pin) for all channels
-        self._spi_write_array([0x06, 0x00, 0x00, 0x0F])
-
-        self.device_select('MixerDAC1')
-        self.card_select(card)
-        self.spi_numbytes(4)
-        # clear to mid-scale
-        self._spi_write_array([0x05, 0x00, 0x00, 0x01])
-        # set to LDAC register for all channels
-        self._spi_write_array([0x06, 0x00, 0x00, 0x0F])        
-        
+        for device in ('MixerDAC0', 'MixerDAC1'):
+            # clear to mid-scale
+            self.spi_transaction([0x05, 0x00, 0x00, 0x01], device=device, card=card)
+            # hold input register writes until a software LDAC for all channels
+            self.spi_transaction([DAC_LDAC_REGISTER, 0x00, 0x00, 0x00], device=device, card=card)
+
+    def set_ldac_mode(self, mode='held', card=0):
+        """
+        mode='held': a write to a channel's input register only
+        reaches the output on a software LDAC write (set_dac and
+        commit_dac send one) or an LDAC pin pulse. This is the
+        dac_reset_and_ldac default.
+        mode='immediate': every channel ignores LDAC and updates on
+        its own input register write.
+        """
+        if mode == 'held':
+            mask = 0x00
+        elif mode == 'immediate':
+            mask = 0x0F
+        else:
+            raise ValueError("Unknown LDAC mode %s" % mode)
+        for device in ('MixerDAC0', 'MixerDAC1'):
+            self.spi_transaction([DAC_LDAC_REGISTER, 0x00, 0x00, mask], device=device, card=card)
+
+    def _dac_frame(self, channel, voltage_bytes, command=DAC_SOFTWARE_LDAC_MODE):
+        """
+        Returns the MixerDAC device name and the 4 byte SPI
+        frame that writes voltage_bytes to mixer channel
+        """
+        if channel < 4:
+            device = 'MixerDAC0'
+        else:
+            device = 'MixerDAC1'
+        channel_address = channel % 4
+        first_byte = command
+        second_byte = (channel_address << 4) | (0x0f & ((voltage_bytes[0] & 0xF0) >> 4))
+        third_byte = ((voltage_bytes[0] & 0x0f) << 4) | (0x0f & ((voltage_bytes[1] & 0xf0) >> 4))
+        fourth_byte = ((voltage_bytes[1] & 0x0f) << 4) & 0xf0
+        return device, [first_byte, second_byte, third_byte, fourth_byte]
+
     def set_dac(self, channel, voltage_bytes=[0x80, 0x00], card=0):
         """ Sets mixer DAC
         """
         #voltage_bytes = self.dac_DIN(voltage)
-        if type(channel)==int: 
-            if channel < 4:
-                self.device_select('MixerDAC0')
-                channel_address = channel
-            else:
-                self.device_select('MixerDAC1')
-                channel_address = channel % 4
-            self.card_select(card)
+        if type(channel)==int:
+            channel = [channel]
+        for chan in channel:
             #first_byte = DAC_WRITE_ONE_CHANNEL_MODE
-            first_byte = DAC_SOFTWARE_LDAC_MODE
-            second_byte = (channel_address << 4) | (0x0f & ((voltage_bytes[0] & 0xF0) >> 4))
-            third_byte = ((voltage_bytes[0] & 0x0f) << 4) | (0x0f & ((voltage_bytes[1] & 0xf0) >> 4))
-            fourth_byte = ((voltage_bytes[1] & 0x0f) << 4) & 0xf0
-            self.spi_numbytes(4)
-            self._spi_write_array([first_byte, second_byte, third_byte, fourth_byte])
-            print("Wrote %s" % (["0x%02x" % byte for byte in [first_byte, second_byte, third_byte, fourth_byte]]))
-        elif type(channel)==list:
-            for chan in channel:
-                if chan < 4:
-                    self.device_select('MixerDAC0')
-                    channel_address = chan
-                else:
-                    self.device_select('MixerDAC1')
-                    channel_address = chan % 4
-                self.card_select(card)
-                #first_byte = DAC_WRITE_ONE_CHANNEL_MODE
-                first_byte = DAC_SOFTWARE_LDAC_MODE
-                second_byte = (channel_address << 4) | (0x0f & ((voltage_bytes[0] & 0xF0) >> 4))
-                third_byte = ((voltage_bytes[0] & 0x0f) << 4) | (0x0f & ((voltage_bytes[1] & 0xf0) >> 4))
-                fourth_byte = ((voltage_bytes[1] & 0x0f) << 4) & 0xf0
-                self.spi_numbytes(4)
-                self._spi_write_array([first_byte, second_byte, third_byte, fourth_byte])
-                print("Wrote %s" % (["0x%02x" % byte for byte in [first_byte, second_byte, third_byte, fourth_byte]]))
+            device, frame = self._dac_frame(chan, voltage_bytes)
+            self.spi_transaction(frame, device=device, card=card)
+            print("Wrote %s" % (["0x%02x" % byte for byte in frame]))
 
         # first_byte = DAC_UPDATE_ONE_CHANNEL_MODE
         # second_byte = (channel_address << 4) | (0x0f & ((voltage_bytes[0] & 0xF0) >> 4))
@@ -452,6 +681,85 @@ class LabJackT7(object):
         # print("Wrote %s" % (["0x%02x" % byte for byte in [first_byte, second_byte, third_byte, fourth_byte]]))        
 
     
+    def stage_dac(self, channel, voltage_bytes, card=0):
+        """
+        Stages voltage_bytes for mixer channel on card. Nothing is
+        sent until commit_dac.
+        """
+        self._staged[(card, channel)] = list(voltage_bytes)
+
+    def clear_staged_dacs(self):
+        self._staged = {}
+
+    def commit_dac(self, latch='software'):
+        """
+        Sends all staged DAC values, across MixerDAC0/1 and cards, in
+        one eNames packet. Every DAC chip involved is first put in
+        held LDAC mode (see set_ldac_mode) so that its input register
+        writes wait for the latch.
+        latch='software': on every DAC chip all channels but the last
+        are only written to their input registers and the last write
+        updates the whole chip (software LDAC). The channels of a chip
+        change together, but the chips change one after the other,
+        about one SPI frame (plus the select change) apart.
+        latch='syncload' (EXPERIMENTAL, not verified on hardware):
+        all channels are written to their input registers and then
+        the SyncLoad select of each card is pulsed to latch them. The
+        card has to route SyncLoad to LDAC. It raises RuntimeError
+        unless experimental_syncload is set to True.
+        The staged values are kept if the write fails.
+        """
+        if latch not in ('software', 'syncload'):
+            raise ValueError("Unknown latch %s" % latch)
+        if latch == 'syncload' and not self.experimental_syncload:
+            raise RuntimeError("latch='syncload' is experimental and not verified on "
+                               "hardware; set experimental_syncload = True to use it")
+        chips = {}
+        for card, chan in sorted(self._staged):
+            device = 'MixerDAC0' if chan < 4 else 'MixerDAC1'
+            chips.setdefault((card, device), []).append(chan)
+        if not chips:
+            return
+        aNames, aWrites, aNumValues, aValues = [], [], [], []
+        def add(frame, device, card):
+            names, writes, numValues, values = self._spi_frame(frame, device=device,
+                                                               card=card)
+            aNames.extend(names)
+            aWrites.extend(writes)
+            aNumValues.extend(numValues)
+            aValues.extend(values)
+        for (card, device), chans in sorted(chips.items()):
+            # hold the input registers of all channels until LDAC
+            add([DAC_LDAC_REGISTER, 0x00, 0x00, 0x00], device, card)
+            for i, chan in enumerate(chans):
+                if latch == 'software' and i == len(chans) - 1:
+                    command = DAC_SOFTWARE_LDAC_MODE
+                else:
+                    command = DAC_WRITE_ONE_CHANNEL_MODE
+                device, frame = self._dac_frame(chan, self._staged[(card, chan)],
+                                                command=command)
+                add(frame, device, card)
+                print("Wrote %s" % (["0x%02x" % byte for byte in frame]))
+        if latch == 'syncload':
+            for card in sorted(set(card for card, device in chips)):
+                # one dummy byte pulses the SyncLoad chip select
+                add([0x00], 'SyncLoad', card)
+        try:
+            ljm.eNames(self.handle, len(aNames), aNames, aWrites, aNumValues, aValues)
+        except ljm.LJMError:
+            self.invalidate_state()
+            raise
+        self._staged = {}
+
+    def set_dacs(self, voltages, card=0, latch='software'):
+        """
+        Sets several mixer channels of card at once. voltages is a
+        dict of channel to voltage_bytes. See commit_dac.
+        """
+        for chan in voltages:
+            self.stage_dac(chan, voltages[chan], card=card)
+        self.commit_dac(latch=latch)
+
     def sweep_dac(self, channel, vmax=[0xff, 0xff], vmin=[0x00,0x00], timeout = 0.010, npoints=100, card=0):
         sweepV = np.linspace((vmin[0]<<8|vmin[1]), (vmax[0]<<8|vmax[1]), npoints, dtype=int)
         v_list = []
@@ -480,6 +788,80 @@ class LabJackT7(object):
         v_list[:,0] = (v_list[:,0]/2**16)*4.05
         return v_list
     
+    def stop_lua_script(self, timeout=1.0):
+        """Stops any Lua script running on the T7"""
+        start = time.time()
+        while ljm.eReadName(self.handle, "LUA_RUN"):
+            ljm.eWriteName(self.handle, "LUA_RUN", 0)
+            if time.time() - start > timeout:
+                raise TimeoutError("Lua script did not stop within %s s" % timeout)
+            time.sleep(0.010)
+
+    def load_lua_script(self, script, debug=False):
+        """
+        Uploads script to the T7 and starts it
+        """
+        self.stop_lua_script()
+        scriptBytes = list(bytearray(script, 'ascii')) + [0]
+        ljm.eWriteName(self.handle, "LUA_SOURCE_SIZE", len(scriptBytes))
+        ljm.eWriteNameByteArray(self.handle, "LUA_SOURCE_WRITE",
+                                len(scriptBytes), scriptBytes)
+        ljm.eWriteName(self.handle, "LUA_DEBUG_ENABLE", int(debug))
+        ljm.eWriteName(self.handle, "LUA_RUN", 1)
+
+    def _select_lines(self, device, card):
+        """(dionum, value) pairs that select device on card"""
+        addr = SPI_DEVICES[device]
+        lines = [(self.spi_dionums['spi_sel_%i' % bit], addr[bit]) for bit in range(3)]
+        for other in range(4):
+            dionum = self.spi_dionums['spi_card_%i' % other]
+            if dionum != 'NA':
+                lines.append((dionum, 0 if other == card else 1))
+        return lines
+
+    def lua_sweep(self, channel, voltage_bytes_list, settle=0.010, card=0,
+                  timeout=None, poll=0.050):
+        """
+        Runs a whole DAC sweep on the T7 with a Lua script.
+        For every entry of voltage_bytes_list the mixer DAC of
+        channel is written (same framing as set_dac), the script
+        waits settle seconds and reads Vsense and Isense (same
+        framing as adc_read). The raw results are buffered in
+        USER_RAM_FIFO0 and fetched in bulk at the end.
+
+        Returns numpy arrays of the Vsense and Isense ADC voltages,
+        scaled like adc_read.
+        """
+        npoints = len(voltage_bytes_list)
+        # the mux is left alone by the script
+        self.set_mux(channel, card=card)
+        device = self._dac_frame(channel, [0x80, 0x00])[0]
+        frames = [self._dac_frame(channel, vb)[1] for vb in voltage_bytes_list]
+        # resolve the registers the script uses from the LJM constants
+        addresses = dict((key, ljm.nameToAddress(name)[0])
+                         for key, name in REGISTER_NAMES.items())
+        script = make_sweep_script(frames, self._select_lines(device, card),
+                                   self._select_lines('ADC', card),
+                                   settle=settle, addresses=addresses)
+        ljm.eWriteName(self.handle, "USER_RAM_FIFO0_ALLOCATE_NUM_BYTES", 0)
+        ljm.eWriteName(self.handle, "USER_RAM_FIFO0_ALLOCATE_NUM_BYTES", 4*npoints)
+        ljm.eWriteName(self.handle, "USER_RAM0_I32", 0)
+        if timeout is None:
+            timeout = 5.0 + npoints * (settle + 0.010)
+        # the script drives the select lines and SPI_NUM_BYTES
+        self.invalidate_state(pca=False)
+        self.load_lua_script(script)
+        start = time.time()
+        while ljm.eReadName(self.handle, "USER_RAM0_I32") < npoints:
+            if time.time() - start > timeout:
+                self.stop_lua_script()
+                raise TimeoutError("Lua sweep did not finish within %s s" % timeout)
+            time.sleep(poll)
+        self._print("Lua sweep of %d points took %.3f s" % (npoints, time.time() - start))
+        raw = np.array(ljm.eReadNameArray(self.handle, "USER_RAM_FIFO0_DATA_U16",
+                                          2*npoints), dtype=int)
+        return adc_counts_to_voltage(raw[0::2]), adc_counts_to_voltage(raw[1::2])
+
     def start_up(self, channel=0, loop_control='Close', card=0):
         self.get_boardID(card)
         self.set_mux(card=card)
@@ -562,7 +944,14 @@ class LabJackT7(object):
         return b_read
 
     def start_stream_diff_volts(self, AIN_list=[0], scanRate=100,
-                                MAX_REQUESTS=25, directory=None):
+                                MAX_REQUESTS=25, directory=None,
+                                binary=False, compress=False):
+        """
+        Streams AIN_list for MAX_REQUESTS reads of one second into
+        directory. With binary=True the scans are saved with
+        StreamWriter in a .bin file (read it back with
+        omaya.bias.stream_file.StreamReader), otherwise as text.
+        """
         numAddresses = len(AIN_list)
         aScanListNames = []
         for i in AIN_list:
@@ -571,7 +960,10 @@ class LabJackT7(object):
         # scanRate = 100
         scansPerRead = int(scanRate)
         
+        if binary:
+            resolution_index = int(ljm.eReadName(self.handle, "STREAM_RESOLUTION_INDEX"))
         scanRate = ljm.eStreamStart(self.handle, scansPerRead, numAddresses, aScanList, scanRate)
+        start_time = time.time()
         print('Stream started with scan rate of {:0f} Hz'.format(scanRate))
 
         # MAX_REQUESTS = 10
@@ -589,9 +981,17 @@ class LabJackT7(object):
             self._print("making directory %s" % directory)
             os.makedirs(directory)
         
-        filename = '{}/stream_AIN_{}.txt'.format(directory,
-                                                 start.strftime('%Y%b%d_%H%M'))
-        data_file = open(filename,'w')
+        if binary:
+            filename = '{}/stream_AIN_{}.bin'.format(directory,
+                                                     start.strftime('%Y%b%d_%H%M'))
+            data_file = StreamWriter(filename, aScanListNames, scanRate,
+                                     start_time=start_time,
+                                     resolution_index=resolution_index,
+                                     compress=compress, chunk_scans=scansPerRead)
+        else:
+            filename = '{}/stream_AIN_{}.txt'.format(directory,
+                                                     start.strftime('%Y%b%d_%H%M'))
+            data_file = open(filename,'w')
         
         while i <= MAX_REQUESTS:
             # TODO: add a timestamp to each measurement
@@ -608,7 +1008,10 @@ class LabJackT7(object):
             totSkip += curSkip
 
             #write data into file
-            data_file.write(str(aData)[1:-1]+', ')
+            if binary:
+                data_file.write(aData)
+            else:
+                data_file.write(str(aData)[1:-1]+', ')
             
             print("\neStreamRead %i" % i)
             ainStr = ''
@@ -662,7 +1065,15 @@ class LabJackT7(object):
         print("\n%s reading : %f V" % (name, result))
         return result
 
-    def stream_adcs(self, max_requests=1):
+    def stream_adcs(self, max_requests=1, decimate=40, return_series=False):
+        """
+        Streams AIN0 and AIN1 for max_requests reads of half a second
+        and returns their means over the whole acquisition (skipped
+        samples left out). Each block is reduced as it is read; with
+        return_series=True the averages of every decimate scans are
+        returned too, as (ain0, ain1, t, series) with t in seconds
+        from the start of the stream and series scans x 2.
+        """
         aScanListNames = ["AIN0", "AIN1"]  # Scan list names to stream
         numAddresses = len(aScanListNames)
         aScanList = ljm.namesToAddresses(numAddresses, aScanListNames)[0]
@@ -695,12 +1106,20 @@ class LabJackT7(object):
         start = datetime.datetime.now()
         totScans = 0
         totSkip = 0  # Total skipped samples
+        running = RunningMean()
+        boxcar = BoxcarDecimator(decimate)
+        series = []
 
         i = 1
         while i <= max_requests:
             ret = ljm.eStreamRead(self.handle)
             
             aData = ret[0]
+            block = np.array(aData, dtype=float).reshape(-1, numAddresses)
+            block[block == -9999.0] = np.nan
+            running.update(block)
+            if return_series:
+                series.append(boxcar.process(block))
             #json.dump(aData, open('jnk.dat', 'w'))
             #print(len(aData), aData)
             scans = len(aData) / numAddresses
@@ -730,40 +1149,67 @@ class LabJackT7(object):
         print("Timed Scan Rate = %f scans/second" % (totScans / tt))
         print("Timed Sample Rate = %f samples/second" % (totScans * numAddresses / tt))
         print("Skipped scans = %0.0f" % (totSkip / numAddresses))
-        ain0 = np.array(aData[0::2])
-        ain1 = np.array(aData[1::2])
-        kernel_size = 40
-        kernel = np.ones(kernel_size) / kernel_size
-        ain0_con = np.convolve(ain0, kernel, mode='valid')
-        ain1_con = np.convolve(ain1, kernel, mode='valid')
         ljm.eStreamStop(self.handle)
-        return ain0_con.mean(), ain1_con.mean()
+        ain0, ain1 = running.mean
+        if not return_series:
+            return ain0, ain1
+        series = np.concatenate(series)
+        t = (np.arange(len(series)) * decimate + (decimate - 1) / 2.0) / scanRate
+        return ain0, ain1, t, series
+
+    def start_stream(self, names=["AIN0", "AIN1"], scanRate=None, scansPerRead=None,
+                     capacity=None, configure=True):
+        """
+        Starts a continuous background stream of names into a ring
+        buffer and returns the StreamAcquisition (also kept in
+        self.stream). With configure=True the inputs are set up like
+        stream_adcs does: single ended, +/-10 V, default settling
+        and resolution.
+        """
+        if self.stream is not None and self.stream.running:
+            self.stop_stream()
+        if scanRate is None:
+            scanRate = self.scanRate
+        ljm.eWriteName(self.handle, "STREAM_TRIGGER_INDEX", 0)
+        ljm.eWriteName(self.handle, "STREAM_CLOCK_SOURCE", 0)
+        if configure:
+            aNames = ["AIN_ALL_NEGATIVE_CH", "STREAM_SETTLING_US", "STREAM_RESOLUTION_INDEX"]
+            aValues = [ljm.constants.GND, 0, 0]
+            for name in names:
+                aNames.append("%s_RANGE" % name)
+                aValues.append(10.0)
+            ljm.eWriteNames(self.handle, len(aNames), aNames, aValues)
+        self.stream = StreamAcquisition(self.handle, names, scan_rate=scanRate,
+                                        scans_per_read=scansPerRead, capacity=capacity)
+        self.stream.start()
+        self._print("Stream of %s started at %.1f Hz" % (names, self.stream.scan_rate))
+        return self.stream
+
+    def stop_stream(self):
+        if self.stream is not None:
+            self.stream.stop()
 
     def power_up_lna(self,card=0, channel=[0,1]):
         '''Setup for lna dac
         '''
         LNA_DAC_POWER_CTRL = 0x08
-        self.device_select('LNADAC')
-        self.card_select(card)
-        self.spi_numbytes(4)
         if type(channel)==list:
             fourth_byte = sum([2**chan for chan in channel])
         elif type(channel) == int:
             fourth_byte = 2**channel
-        self._spi_write_array([LNA_DAC_POWER_CTRL, 0x00, 0x00, fourth_byte])
+        self.spi_transaction([LNA_DAC_POWER_CTRL, 0x00, 0x00, fourth_byte],
+                             device='LNADAC', card=card)
 
     def power_down_lna(self,card=0, channel=[0,1]):
         '''Setup for lna dac
         '''
         LNA_DAC_POWER_CTRL = 0x08
-        self.device_select('LNADAC')
-        self.card_select(card)
-        self.spi_numbytes(4)
         if type(channel)==list:
             fourth_byte = sum([2**chan for chan in channel])
         elif type(channel) == int:
             fourth_byte = 2**channel
-        self._spi_write_array([LNA_DAC_POWER_CTRL, 0x00, 0x03, fourth_byte])
+        self.spi_transaction([LNA_DAC_POWER_CTRL, 0x00, 0x03, fourth_byte],
+                             device='LNADAC', card=card)
 
         
     def set_lna_drain_voltage(self, channel, voltage=0.0, card=0):
@@ -776,26 +1222,13 @@ class LabJackT7(object):
         
         voltage_bytes = self.dac_DIN(voltage, ref=2.5, nbits=16)
         
-        if type(channel)==int: 
-            self.device_select('LNADAC')
-            channel_address = channel
-            self.card_select(card)
+        if type(channel)==int:
+            channel = [channel]
+        for channel_address in channel:
             first_byte = LNA_DAC_WRITE_ONE_UPDATE_ONE
             second_byte = ( (channel_address << 4) | (voltage_bytes[0] >> 4) )
             third_byte = (((voltage_bytes[0] & 0x0f) << 4) | (voltage_bytes[1] >> 4))
             fourth_byte = ((voltage_bytes[1] & 0x0f) << 4)
-            self.spi_numbytes(4)
-            self._spi_write_array([first_byte, second_byte, third_byte, fourth_byte])
+            self.spi_transaction([first_byte, second_byte, third_byte, fourth_byte],
+                                 device='LNADAC', card=card)
             print("Wrote %s" % (["0x%02x" % byte for byte in [first_byte, second_byte, third_byte, fourth_byte]]))
-        elif type(channel)==list:
-            for chan in channel:
-                self.device_select('LNADAC')
-                channel_address = chan
-                self.card_select(card)
-                first_byte = LNA_DAC_WRITE_ONE_UPDATE_ONE
-                second_byte = ( (channel_address << 4) | (voltage_bytes[0] >> 4) )
-                third_byte = (((voltage_bytes[0] & 0x0f) << 4) | (voltage_bytes[1] >> 4))
-                fourth_byte = ((voltage_bytes[1] & 0x0f) << 4)
-                self.spi_numbytes(4)
-                self._spi_write_array([first_byte, second_byte, third_byte, fourth_byte])
-                print("Wrote %s" % (["0x%02x" % byte for byte in [first_byte, second_byte, third_byte, fourth_byte]]))
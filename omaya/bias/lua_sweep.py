@@ -0,0 +1,134 @@
+"""
+Lua script generator for running bias sweeps on
+the Labjack T7 itself.
+
+The script steps a mixer DAC through a precomputed list
+of SPI frames, waits for the bias to settle, reads Vsense
+and Isense from the MAX1168 and pushes the raw 16 bit
+results into USER_RAM_FIFO0. The host only has to upload
+the script, wait for USER_RAM0_I32 to reach the number of
+points and read the FIFO back in one go.
+"""
+
+# Modbus addresses and data types used from within Lua. These are
+# the documented defaults; LabJackT7.lua_sweep resolves the names with
+# ljm.nameToAddress and passes them to make_sweep_script instead.
+DIO_ADDRESS = 2000          # DIO0, UINT16
+SPI_GO_ADDRESS = 5007       # UINT16
+SPI_NUM_BYTES_ADDRESS = 5009  # UINT16
+SPI_DATA_TX_ADDRESS = 5010  # BYTE
+SPI_DATA_RX_ADDRESS = 5050  # BYTE
+LUA_RUN_ADDRESS = 6000      # UINT32
+USER_RAM0_I32_ADDRESS = 46080  # INT32 (46100 is USER_RAM0_U32)
+USER_RAM_FIFO0_DATA_U16_ADDRESS = 47000  # UINT16
+
+# register name of every address the script uses
+REGISTER_NAMES = {
+    'dio': 'DIO0',
+    'spi_go': 'SPI_GO',
+    'spi_num_bytes': 'SPI_NUM_BYTES',
+    'spi_data_tx': 'SPI_DATA_TX',
+    'spi_data_rx': 'SPI_DATA_RX',
+    'lua_run': 'LUA_RUN',
+    'user_ram': 'USER_RAM0_I32',
+    'fifo': 'USER_RAM_FIFO0_DATA_U16',
+}
+
+DEFAULT_ADDRESSES = {
+    'dio': DIO_ADDRESS,
+    'spi_go': SPI_GO_ADDRESS,
+    'spi_num_bytes': SPI_NUM_BYTES_ADDRESS,
+    'spi_data_tx': SPI_DATA_TX_ADDRESS,
+    'spi_data_rx': SPI_DATA_RX_ADDRESS,
+    'lua_run': LUA_RUN_ADDRESS,
+    'user_ram': USER_RAM0_I32_ADDRESS,
+    'fifo': USER_RAM_FIFO0_DATA_U16_ADDRESS,
+}
+
+SWEEP_SCRIPT = """\
+-- OMAyA bias card DAC step / settle / MAX1168 read sweep.
+-- Generated by omaya.bias.lua_sweep, do not edit.
+local dac_select = {%(dac_select)s}
+local adc_select = {%(adc_select)s}
+local frames = {
+%(frames)s
+}
+local vs_cmd = {%(vs_cmd)d, 0, 0}
+local is_cmd = {%(is_cmd)d, 0, 0}
+local settle_ms = %(settle_ms)d
+
+local function select(lines)
+  for i = 1, #lines, 2 do
+    MB.W(lines[i], 0, lines[i+1])
+  end
+end
+
+local function spi(tx)
+  MB.W(%(spi_num_bytes)d, 0, #tx)
+  MB.WA(%(spi_data_tx)d, 99, #tx, tx)
+  MB.W(%(spi_go)d, 0, 1)
+  return MB.RA(%(spi_data_rx)d, 99, #tx)
+end
+
+MB.W(%(user_ram)d, 2, 0)
+for i = 1, #frames do
+  select(dac_select)
+  spi(frames[i])
+  if settle_ms > 0 then
+    LJ.IntervalConfig(0, settle_ms)
+    while not LJ.CheckInterval(0) do end
+  end
+  select(adc_select)
+  local rx = spi(vs_cmd)
+  MB.W(%(fifo)d, 0, rx[2]*256 + rx[3])
+  rx = spi(is_cmd)
+  MB.W(%(fifo)d, 0, rx[2]*256 + rx[3])
+  MB.W(%(user_ram)d, 2, i)
+end
+MB.W(%(lua_run)d, 1, 0)
+"""
+
+
+def _lua_lines(lines, dio_address=DIO_ADDRESS):
+    """Flattens [(dionum, value), ...] into a Lua address/value list"""
+    return ', '.join('%d, %d' % (dio_address + dionum, value)
+                     for dionum, value in lines)
+
+
+def adc_command(read_in):
+    """MAX1168 command byte used by LabJackT7.adc_read"""
+    return ((read_in << 5) & 0xE0) | (0x01)
+
+
+def make_sweep_script(frames, dac_select, adc_select, settle=0.010,
+                      vs_read_in=0, is_read_in=1, addresses=None):
+    """
+    Returns the Lua source of a DAC/ADC sweep.
+
+    frames: list of 4 byte MixerDAC SPI frames, one per point
+    dac_select, adc_select: lists of (dionum, value) pairs that
+        select the MixerDAC and the ADC on the card
+    settle: wait between the DAC write and the ADC reads in seconds
+    addresses: Modbus addresses keyed like REGISTER_NAMES, overriding
+        DEFAULT_ADDRESSES
+    """
+    settle_ms = int(round(settle * 1000))
+    address = dict(DEFAULT_ADDRESSES)
+    if addresses is not None:
+        address.update(addresses)
+    return SWEEP_SCRIPT % {
+        'dac_select': _lua_lines(dac_select, address['dio']),
+        'adc_select': _lua_lines(adc_select, address['dio']),
+        'frames': ',\n'.join('  {%s}' % ', '.join('%d' % byte for byte in frame)
+                             for frame in frames),
+        'vs_cmd': adc_command(vs_read_in),
+        'is_cmd': adc_command(is_read_in),
+        'settle_ms': settle_ms,
+        'spi_num_bytes': address['spi_num_bytes'],
+        'spi_data_tx': address['spi_data_tx'],
+        'spi_go': address['spi_go'],
+        'spi_data_rx': address['spi_data_rx'],
+        'user_ram': address['user_ram'],
+        'fifo': address['fifo'],
+        'lua_run': address['lua_run'],
+    }
@@ -0,0 +1,78 @@
+"""
+Tracks the 2V reference offsets used by the Vsense and Isense
+conversions, so that sweeps do not have to read the reference
+at every bias point.
+"""
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_READ_IN = 6
+
+
+class OffsetTracker(object):
+    """
+    Keeps a filtered offset estimate per mixer channel in the dict
+    offsets (updated in place, so it can be shared with the code that
+    converts Vsense and Isense).
+
+    offset(channel) only reads the reference when the channel is due:
+    the interval between reads doubles up to max_interval while the
+    readings agree with the estimate within drift, and drops back to
+    min_interval when they do not. Agreeing readings are averaged in
+    with weight alpha, a drift resets the estimate to the new reading.
+    """
+    def __init__(self, t7, card=0, offsets=None, scale=2.0, nsamples=8,
+                 alpha=0.3, drift=0.002, min_interval=5.0, max_interval=300.0):
+        self.t7 = t7
+        self.card = card
+        self.offsets = offsets if offsets is not None else {}
+        self.scale = scale
+        self.nsamples = nsamples
+        self.alpha = alpha
+        self.drift = drift
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._last = {}
+        self._interval = {}
+
+    def read(self, channel):
+        """One averaged reading of the reference of channel"""
+        mean, std, counts = self.t7.adc_read_burst(channel, (REFERENCE_READ_IN,),
+                                                   nsamples=self.nsamples,
+                                                   card=self.card)
+        return mean[0] * self.scale
+
+    def refresh(self, channels=range(8)):
+        """Reads channels now and restarts their filters"""
+        for channel in channels:
+            self.offsets[channel] = self.read(channel)
+            self._last[channel] = time.time()
+            self._interval[channel] = self.min_interval
+        return self.offsets
+
+    def update(self, channel):
+        """Reads the reference of channel and updates its estimate"""
+        reading = self.read(channel)
+        now = time.time()
+        estimate = self.offsets.get(channel)
+        if estimate is None or abs(reading - estimate) > self.drift:
+            if estimate is not None:
+                logger.info("Offset of channel %d drifted from %.5f to %.5f" %
+                            (channel, estimate, reading))
+            self.offsets[channel] = reading
+            self._interval[channel] = self.min_interval
+        else:
+            self.offsets[channel] = self.alpha*reading + (1 - self.alpha)*estimate
+            self._interval[channel] = min(2*self._interval.get(channel, self.min_interval),
+                                          self.max_interval)
+        self._last[channel] = now
+        return self.offsets[channel]
+
+    def offset(self, channel):
+        """Current offset of channel, reading the reference if it is due"""
+        last = self._last.get(channel)
+        if last is None or time.time() - last >= self._interval[channel]:
+            return self.update(channel)
+        return self.offsets[channel]
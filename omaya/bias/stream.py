@@ -0,0 +1,188 @@
+"""
+Continuous LabJack T7 stream acquisition into a ring buffer,
+read by a background thread so that consumers can look at the
+data at any time without stopping the stream.
+"""
+from labjack import ljm
+import threading
+import time
+import logging
+import warnings
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SKIPPED_SAMPLE = -9999.0
+
+
+class StreamAcquisition(object):
+    """
+    Streams the channels in names at scan_rate on a dedicated thread
+    into a ring buffer holding the last capacity scans.
+
+    Scan n was taken at t0 + n/scan_rate, with t0 the host time the
+    stream started and scan_rate the rate the device reported.
+    Samples the device skipped (-9999) are stored as NaN, so the
+    scan index stays aligned with time; skipped counts them.
+
+    The reader thread is the only writer. It fills the buffer first
+    and then advances count, and readers check count again after
+    copying, so no lock is needed.
+    """
+    def __init__(self, handle, names, scan_rate=1200, scans_per_read=None,
+                 capacity=None):
+        self.handle = handle
+        self.names = list(names)
+        self.nchannels = len(self.names)
+        self.requested_rate = scan_rate
+        self.scan_rate = scan_rate
+        if scans_per_read is None:
+            scans_per_read = max(int(scan_rate / 10), 1)
+        self.scans_per_read = scans_per_read
+        if capacity is None:
+            # ten minutes of data
+            capacity = int(scan_rate * 600)
+        self.capacity = capacity
+        self.data = np.full((capacity, self.nchannels), np.nan)
+        self.count = 0  # total scans received
+        self.skipped = 0  # total scans with skipped samples
+        self.device_backlog = 0
+        self.ljm_backlog = 0
+        self.reads = 0
+        self.t0 = None
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        addresses = ljm.namesToAddresses(self.nchannels, self.names)[0]
+        self.count = 0
+        self.skipped = 0
+        self.error = None
+        self.scan_rate = ljm.eStreamStart(self.handle, self.scans_per_read, self.nchannels,
+                                          addresses, self.requested_rate)
+        self.t0 = time.time()
+        logger.info("Stream of %s started at %.1f Hz" % (self.names, self.scan_rate))
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='T7Stream')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0 * self.scans_per_read / self.scan_rate + 1.0)
+            self._thread = None
+        try:
+            ljm.eStreamStop(self.handle)
+        except ljm.LJMError as e:
+            logger.warning("eStreamStop: %s" % e)
+        logger.info("Stream stopped after %d scans, %d skipped" % (self.count, self.skipped))
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                aData, self.device_backlog, self.ljm_backlog = ljm.eStreamRead(self.handle)
+            except ljm.LJMError as e:
+                if not self._stop.is_set():
+                    self.error = e
+                    logger.error("eStreamRead failed: %s" % e)
+                    # leave the device ready for the next start
+                    try:
+                        ljm.eStreamStop(self.handle)
+                    except ljm.LJMError as e:
+                        logger.warning("eStreamStop: %s" % e)
+                return
+            self._write(np.array(aData, dtype=float).reshape(-1, self.nchannels))
+            self.reads += 1
+
+    def _write(self, block):
+        skipped = block == SKIPPED_SAMPLE
+        if skipped.any():
+            block[skipped] = np.nan
+            self.skipped += int(skipped.any(axis=1).sum())
+        n = len(block)
+        if n > self.capacity:
+            block = block[-self.capacity:]
+            self.count += n - self.capacity
+            n = self.capacity
+        start = self.count % self.capacity
+        first = min(n, self.capacity - start)
+        self.data[start:start+first] = block[:first]
+        self.data[:n-first] = block[first:]
+        self.count += n
+
+    def times(self, index):
+        """Host times of scan indices"""
+        return self.t0 + np.asarray(index) / self.scan_rate
+
+    def _copy(self, start, stop):
+        """
+        Copies scans start..stop-1 (absolute indices) out of the ring.
+        Scans that are no longer in the buffer, or that the block
+        being written may overwrite, are dropped.
+        Returns the scan indices and the data.
+        """
+        while True:
+            count = self.count
+            start = max(start, count + self.scans_per_read - self.capacity, 0)
+            stop = min(stop, count)
+            if stop <= start:
+                return np.arange(0), np.empty((0, self.nchannels))
+            index = np.arange(start, stop)
+            data = self.data[index % self.capacity]
+            # the writer may have moved on into our scans while copying
+            if self.count + self.scans_per_read - self.capacity <= start:
+                return index, data
+
+    def latest(self, nscans=None):
+        """
+        The last nscans scans (default one read block) as
+        (times, data), data being nscans x channels
+        """
+        if nscans is None:
+            nscans = self.scans_per_read
+        count = self.count
+        index, data = self._copy(count - nscans, count)
+        return self.times(index), data
+
+    def window(self, tstart, tstop=None):
+        """Scans taken between host times tstart and tstop"""
+        start = int(np.ceil((tstart - self.t0) * self.scan_rate))
+        if tstop is None:
+            stop = self.count
+        else:
+            stop = int(np.floor((tstop - self.t0) * self.scan_rate)) + 1
+        index, data = self._copy(start, stop)
+        return self.times(index), data
+
+    def decimated(self, factor, nscans=None):
+        """
+        Block averages of factor scans over the last nscans scans
+        (default the whole buffer), ignoring skipped samples.
+        Returns the mid block times and the averaged data.
+        """
+        if nscans is None:
+            nscans = self.capacity
+        count = self.count
+        start = count - nscans
+        # align blocks to absolute scan indices
+        start = max(start, count + self.scans_per_read - self.capacity, 0)
+        start += (-start) % factor
+        nblocks = (count - start) // factor
+        index, data = self._copy(start, start + nblocks * factor)
+        nblocks = len(index) // factor
+        if nblocks == 0:
+            return np.empty(0), np.empty((0, self.nchannels))
+        index = index[:nblocks*factor].reshape(nblocks, factor)
+        data = data[:nblocks*factor].reshape(nblocks, factor, self.nchannels)
+        with warnings.catch_warnings():
+            # blocks that are all skipped samples average to NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return self.times(index.mean(axis=1)), np.nanmean(data, axis=1)
@@ -0,0 +1,221 @@
+"""
+Binary files for streamed AIN data: a fixed size JSON header
+followed by float32 scans, so that recordings can be opened with
+numpy.memmap and sliced by time without parsing text.
+"""
+import json
+import os
+import struct
+import time
+import zlib
+import numpy as np
+
+MAGIC = b'OMAYASTREAM1'
+HEADER_SIZE = 4096
+DTYPE = np.dtype('<f4')
+SKIPPED_SAMPLE = -9999.0
+# per compressed chunk: number of scans, number of bytes
+CHUNK_PREFIX = struct.Struct('<II')
+
+
+class StreamWriter(object):
+    """
+    Appends scans of len(channels) samples to filename.
+
+    Scans are buffered and written chunk_scans at a time. Without
+    compression the file is the header followed by one float32 array
+    of scans x channels; with compress=True each chunk is stored
+    zlib compressed behind its scan and byte counts. Skipped samples
+    (-9999) are stored as NaN. The header is rewritten with the scan
+    count on close.
+    """
+    def __init__(self, filename, channels, scan_rate, start_time=None,
+                 resolution_index=0, compress=False, level=1,
+                 chunk_scans=None, **metadata):
+        self.filename = filename
+        self.channels = list(channels)
+        self.nchannels = len(self.channels)
+        if chunk_scans is None:
+            # about a second of data
+            chunk_scans = max(int(scan_rate), 1)
+        self.header = {
+            'channels': self.channels,
+            'scan_rate': float(scan_rate),
+            'start_time': time.time() if start_time is None else float(start_time),
+            'resolution_index': int(resolution_index),
+            'dtype': DTYPE.str,
+            'compression': 'zlib' if compress else None,
+            'chunk_scans': int(chunk_scans),
+            'nscans': 0,
+        }
+        self.header.update(metadata)
+        self.level = level
+        self.nscans = 0
+        self._buffer = []
+        self._buffered = 0
+        self.fp = open(filename, 'wb')
+        self._write_header()
+
+    def _write_header(self):
+        self.header['nscans'] = self.nscans
+        text = MAGIC + json.dumps(self.header).encode('ascii') + b'\n'
+        if len(text) > HEADER_SIZE:
+            raise ValueError("Stream file header longer than %d bytes" % HEADER_SIZE)
+        self.fp.seek(0)
+        self.fp.write(text.ljust(HEADER_SIZE, b' '))
+        self.fp.seek(0, os.SEEK_END)
+
+    def write(self, data):
+        """
+        Adds scans, either the flat list eStreamRead returns or an
+        array of scans x channels
+        """
+        data = np.array(data, dtype=DTYPE).reshape(-1, self.nchannels)
+        data[data == SKIPPED_SAMPLE] = np.nan
+        self._buffer.append(data)
+        self._buffered += len(data)
+        chunk = self.header['chunk_scans']
+        if self._buffered >= chunk:
+            data = np.concatenate(self._buffer)
+            nfull = len(data) // chunk * chunk
+            for i in range(0, nfull, chunk):
+                self._write_chunk(data[i:i+chunk])
+            self._buffer = [data[nfull:]]
+            self._buffered = len(data) - nfull
+
+    def _write_chunk(self, data):
+        raw = np.ascontiguousarray(data).tobytes()
+        if self.header['compression']:
+            raw = zlib.compress(raw, self.level)
+            self.fp.write(CHUNK_PREFIX.pack(len(data), len(raw)))
+        self.fp.write(raw)
+        self.nscans += len(data)
+
+    def flush(self):
+        """Writes the buffered scans as a (short) chunk"""
+        if self._buffered:
+            self._write_chunk(np.concatenate(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+        self.fp.flush()
+
+    def close(self):
+        if self.fp.closed:
+            return
+        self.flush()
+        self._write_header()
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_header(filename):
+    with open(filename, 'rb') as fp:
+        text = fp.read(HEADER_SIZE)
+    if not text.startswith(MAGIC):
+        raise ValueError("%s is not an omaya stream file" % filename)
+    return json.loads(text[len(MAGIC):].decode('ascii'))
+
+
+class StreamReader(object):
+    """
+    Reads a file written by StreamWriter. Uncompressed files are
+    memory mapped, so data, read and window return views without
+    copying. Compressed files are indexed on open and only the chunks
+    that are needed are decompressed.
+
+    The scan count is taken from the file size (or the chunk index),
+    so files left open by an interrupted recording can be read too.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.header = read_header(filename)
+        self.channels = self.header['channels']
+        self.nchannels = len(self.channels)
+        self.scan_rate = self.header['scan_rate']
+        self.start_time = self.header['start_time']
+        self.dtype = np.dtype(self.header['dtype'])
+        self.compressed = bool(self.header['compression'])
+        scan_bytes = self.dtype.itemsize * self.nchannels
+        if self.compressed:
+            self._index_chunks()
+            self.data = None
+        else:
+            self.nscans = (os.path.getsize(filename) - HEADER_SIZE) // scan_bytes
+            if self.nscans > 0:
+                self.data = np.memmap(filename, dtype=self.dtype, mode='r',
+                                      offset=HEADER_SIZE,
+                                      shape=(self.nscans, self.nchannels))
+            else:
+                self.data = np.empty((0, self.nchannels), dtype=self.dtype)
+
+    def _index_chunks(self):
+        """First scans, file offsets and byte counts of the chunks"""
+        first, offsets, sizes = [], [], []
+        nscans = 0
+        size = os.path.getsize(self.filename)
+        with open(self.filename, 'rb') as fp:
+            offset = HEADER_SIZE
+            while offset + CHUNK_PREFIX.size <= size:
+                fp.seek(offset)
+                n, nbytes = CHUNK_PREFIX.unpack(fp.read(CHUNK_PREFIX.size))
+                offset += CHUNK_PREFIX.size
+                if offset + nbytes > size:
+                    # truncated last chunk
+                    break
+                first.append(nscans)
+                offsets.append(offset)
+                sizes.append(nbytes)
+                nscans += n
+                offset += nbytes
+        self._first = np.array(first + [nscans], dtype=np.int64)
+        self._offsets = offsets
+        self._sizes = sizes
+        self.nscans = nscans
+
+    def __len__(self):
+        return self.nscans
+
+    def times(self, index):
+        """Host times of scan indices"""
+        return self.start_time + np.asarray(index) / self.scan_rate
+
+    def read(self, start=0, stop=None):
+        """Scans start..stop-1 as an array of scans x channels"""
+        start, stop, _ = slice(start, stop).indices(self.nscans)
+        if not self.compressed:
+            return self.data[start:stop]
+        if stop <= start:
+            return np.empty((0, self.nchannels), dtype=self.dtype)
+        i0 = np.searchsorted(self._first, start, side='right') - 1
+        i1 = np.searchsorted(self._first, stop, side='left')
+        blocks = []
+        with open(self.filename, 'rb') as fp:
+            for i in range(i0, i1):
+                fp.seek(self._offsets[i])
+                raw = zlib.decompress(fp.read(self._sizes[i]))
+                blocks.append(np.frombuffer(raw, dtype=self.dtype).reshape(-1, self.nchannels))
+        data = np.concatenate(blocks)
+        offset = self._first[i0]
+        return data[start-offset:stop-offset]
+
+    def window(self, tstart=None, tstop=None):
+        """(times, data) of the scans taken between host times tstart and tstop"""
+        start = 0 if tstart is None else \
+            max(int(np.ceil((tstart - self.start_time) * self.scan_rate)), 0)
+        stop = self.nscans if tstop is None else \
+            min(int(np.floor((tstop - self.start_time) * self.scan_rate)) + 1, self.nscans)
+        start = min(start, self.nscans)
+        stop = max(stop, start)
+        return self.times(np.arange(start, stop)), self.read(start, stop)
+
+    def to_dataframe(self, tstart=None, tstop=None):
+        import pandas as pd
+        t, data = self.window(tstart, tstop)
+        df = pd.DataFrame(np.asarray(data), columns=self.channels)
+        df.insert(0, 't', t)
+        return df
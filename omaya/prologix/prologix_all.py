@@ -1,4 +1,5 @@
 import socket
+import threading
 import time
 import numpy
 import logging
@@ -11,18 +12,35 @@ units_text = {
     1: 'CRDG?',
     }
 
+#DEFAULT_HOST = '172.30.51.89'
+DEFAULT_HOST = '172.24.44.80'
+DEFAULT_PORT = 1234
+
 class Prologix:
-    #def __init__(self, host='172.30.51.89', port=1234,
-    def __init__(self, host='172.24.44.80', port=1234,                 
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT,
                  pmeter_address=[13, 15], lake_address=12,
                  synth_address=19, lopmeter_address=14,
                  e3631a_address=5,
                  hp83650_address=18,
                  #second_pmeter_address=13,
-                 asksleep=0.01,):
+                 asksleep=0.01, timeout=3.0, auto_read=False):
+        """
+        auto_read=True puts the controller in ++auto 1 mode for
+        queries, so replies are read back without an explicit
+        ++read eoi. Plain writes always use ++auto 0.
+        """
         self.asksleep = asksleep
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.connect((host, port))
+        self.auto_read = auto_read
+        # the session can be shared with background threads (see
+        # TemperatureSampler): socket traffic is serialized by lock
+        # and the pending GPIB address is kept per thread
+        self.lock = threading.RLock()
+        self._local = threading.local()
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+        self.connect()
         self.lopmeter_address = lopmeter_address
         #self.n_pmeter = n_pmeter
         self.pmeter_address = pmeter_address
@@ -37,37 +55,242 @@ class Prologix:
         #self.idstr = self.idstring()
     
 
+    @property
+    def address(self):
+        """GPIB address wanted by the next write/ask of this thread"""
+        return getattr(self._local, 'address', None)
+
+    @address.setter
+    def address(self, address):
+        self._local.address = address
+
+    def connect(self):
+        """Opens the TCP connection to the GPIB-Ethernet adapter"""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect((self.host, self.port))
+        self.last_used = time.time()
+        # address and auto mode last sent to the controller
+        self._addr = None
+        self._auto = None
+        # received bytes not yet returned as a reply
+        self._rxbuf = b''
+        # set when a query timed out and its reply may still arrive
+        self._stale = False
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def reconnect(self):
+        logger.info("Reconnecting to Prologix at %s:%s" % (self.host, self.port))
+        with self.lock:
+            self.close()
+            self.connect()
+
+    def is_alive(self):
+        """
+        Health check: asks the adapter for its version string.
+        Returns False if the connection is broken.
+        """
+        if self.sock is None:
+            return False
+        with self.lock:
+            try:
+                self._drain()
+                self.sock.send(self.byteify('++ver\r\n'))
+                return len(self._readline(timeout=1.0)) > 0
+            except OSError:
+                return False
+
+    def _send(self, compose):
+        """
+        Sends the text returned by compose, reconnecting once if
+        the socket has gone away since the last use. compose builds
+        the controller prefix, so it is called again after the
+        reconnect, which forgets the controller state.
+        """
+        try:
+            self.sock.send(self.byteify(compose()))
+        except (OSError, AttributeError):
+            self.reconnect()
+            self.sock.send(self.byteify(compose()))
+        self.last_used = time.time()
+
     def byteify(self, s):
         return s.encode()
 
+    def _controller_prefix(self, auto=0):
+        """
+        Returns the ++addr/++auto controller commands needed before
+        the next instrument message, skipping those that would not
+        change the controller state
+        """
+        cmds = ''
+        if self.address is not None and self.address != self._addr:
+            cmds += '++addr %d\r\n' % self.address
+            self._addr = self.address
+        if auto != self._auto:
+            cmds += '++auto %d\r\n' % auto
+            self._auto = auto
+        return cmds
+
     def write(self, msg):
         """Send something"""
-        self.sock.send(self.byteify('%s\r\n' % msg))
+        with self.lock:
+            self._send(lambda: self._controller_prefix(auto=0) + '%s\r\n' % msg)
 
     def reset(self):
         "Instrument Reset"
         self.write("*RST")
         
     def set_gpib_address(self, address):
-        self.sock.send(self.byteify('++addr %d\r\n' % address))
-        # put in auto 0 mode
-        self.sock.send(self.byteify('++auto 0\r\n'))
+        """
+        Addresses the instrument for the following write/ask.
+        The ++addr command is only sent along with the next message,
+        and only if the controller is not already on address.
+        """
+        self.address = address
 
     def idstring(self):
         return "%s" % self.ask("*IDN?")
     
-    def ask(self, msg, readlen=128):
-        """Send and receive something"""
-        self.sock.send(self.byteify('%s\r\n' % msg))
-        #self.sock.send(self.byteify('++read eoi\r\n'))
-        return self.read(readlen=readlen)
-        #ret = self.sock.recv(readlen)
-        #return ret.decode().strip()
-
-    def read(self, readlen=128):
-        self.sock.send(self.byteify('++read eoi\r\n'))
-        ret = self.sock.recv(readlen)
-        return ret.decode().strip()
+    def ask(self, msg, readlen=128, timeout=None):
+        """
+        Send and receive something. Returns as soon as the reply
+        terminator arrives; raises socket.timeout if it has not
+        arrived within timeout seconds (default self.timeout).
+        readlen is kept for compatibility, replies of any length
+        are read.
+        """
+        with self.lock:
+            self._drain()
+            # in auto_read mode the controller reads the reply back by itself
+            self._send(lambda: self._query_text(msg))
+            return self._readline(timeout=timeout)
+
+    def read(self, readlen=128, timeout=None):
+        """Reads a reply from the instrument at self.address"""
+        with self.lock:
+            self._send(lambda: self._controller_prefix(auto=0) + '++read eoi\r\n')
+            return self._readline(timeout=timeout)
+
+    def _query_text(self, msg):
+        """Controller prefix, message and read command for one query"""
+        if self.auto_read:
+            return self._controller_prefix(auto=1) + '%s\r\n' % msg
+        return self._controller_prefix(auto=0) + '%s\r\n++read eoi\r\n' % msg
+
+    def query_batch(self, queries, trigger=False, timeout=None):
+        """
+        Pipelines several instrument queries. queries is a list
+        of (address, command) tuples. All the commands, with the
+        controller addressing between them, go out in a single
+        socket write and the replies are collected in order.
+        Returns a dict mapping each (address, command) to its reply.
+
+        trigger=True first sends a group execute trigger (++trg)
+        to all the addressed instruments, so that those set up for
+        bus triggering sample at the same instant. trigger can also
+        be a list of the addresses to trigger.
+        """
+        prefix = ''
+        if trigger:
+            if trigger is True:
+                addresses = []
+                for address, command in queries:
+                    if address not in addresses:
+                        addresses.append(address)
+            else:
+                addresses = trigger
+            prefix += '++trg %s\r\n' % ' '.join('%d' % address for address in addresses)
+        def compose():
+            msg = prefix
+            for address, command in queries:
+                self.address = address
+                msg += self._query_text(command)
+            return msg
+        replies = {}
+        with self.lock:
+            self._drain()
+            self._send(compose)
+            for query in queries:
+                replies[query] = self._readline(timeout=timeout)
+        return replies
+
+    def read_powers_and_temperature(self, IF=(0, 1), mode='LN', units=0,
+                                    temperature=True, trigger=False):
+        """
+        Reads the IF power meters listed in IF and (optionally) all
+        Lakeshore channels in one pipelined batch. With trigger=True
+        the power meters get a group trigger first. Returns a dict
+        of IF channel to power, and a copy of self.temperature taken
+        under the lock (the temperature sampler thread updates it).
+        """
+        queries = []
+        if temperature:
+            queries.append((self.lake_address, units_text[units]))
+        for ifchannel in IF:
+            queries.append((self.pmeter_address[ifchannel], mode))
+        if trigger:
+            trigger = [self.pmeter_address[ifchannel] for ifchannel in IF]
+        with self.lock:
+            replies = self.query_batch(queries, trigger=trigger)
+            if temperature:
+                self._parse_temperature(replies[queries[0]])
+            tempdic = dict(self.temperature)
+        powers = {}
+        for ifchannel in IF:
+            powers[ifchannel] = float(replies[(self.pmeter_address[ifchannel], mode)])
+        return powers, tempdic
+
+    def _readline(self, timeout=None):
+        """
+        Returns the next line-terminated reply from the receive
+        buffer, reading from the socket until the terminator has
+        arrived or timeout seconds have passed
+        """
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.time() + timeout
+        try:
+            while b'\n' not in self._rxbuf:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise socket.timeout("No reply from Prologix within %s s" % timeout)
+                self.sock.settimeout(remaining)
+                chunk = self.sock.recv(4096)
+                if not chunk:
+                    raise ConnectionError("Prologix closed the connection")
+                self._rxbuf += chunk
+        except socket.timeout:
+            # a late reply must not be taken for the next one
+            self._rxbuf = b''
+            self._stale = True
+            raise
+        finally:
+            self.sock.settimeout(self.timeout)
+        line, _, self._rxbuf = self._rxbuf.partition(b'\n')
+        return line.decode().strip()
+
+    def _drain(self):
+        """Throws away replies left over from a timed out query"""
+        if not self._stale:
+            return
+        self._rxbuf = b''
+        self.sock.setblocking(False)
+        try:
+            while self.sock.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        finally:
+            self.sock.settimeout(self.timeout)
+        self._stale = False
 
     def get_power(self, mode='LN', IF=0):
         address = self.pmeter_address[IF]
@@ -101,19 +324,22 @@ class Prologix:
     def get_lo_db_power(self):
         return self.get_lo_power(mode='LG')
 
+    def _parse_temperature(self, reading):
+        for i, val in enumerate(map(float, reading.split(','))):
+            self.temperature[i+1] = val
+
     def _read_temperature(self, chan=0, text=None):
         self.set_gpib_address(self.lake_address)
         if chan == 0:
             reading = self.ask(text)
-            for i, val in enumerate(map(float, reading.split(','))):
-                self.temperature[i+1] = val
+            self._parse_temperature(reading)
         else:
             reading = self.ask(text+"%1d" % chan)
             self.temperature[chan] = float(reading)
 
     def read_temperature(self, chan=0, units=0):
         """Read temperature for given channel and store it in
-        self.temperature.
+        self.temperature. Returns a copy of self.temperature.
         chan=0 implies all channels, otherwise specify the chan in
         a number between 1 through 8.
         units = 0 - Kelvin (default)
@@ -122,8 +348,9 @@ class Prologix:
             if chan not in range(1,9):
                 print("Not valid channel")
                 return None
-        self._read_temperature(chan=chan, text=units_text[units])
-        return self.temperature
+        with self.lock:
+            self._read_temperature(chan=chan, text=units_text[units])
+            return dict(self.temperature)
     
     def synth_output_on(self):
         self.set_gpib_address(self.synth_address)
@@ -237,3 +464,35 @@ class Prologix:
     #         voltage = 1.0
     #     self.P6V_set_voltage(voltage)
     
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_prologix(host=DEFAULT_HOST, port=DEFAULT_PORT, check_interval=30.0,
+                 **kwargs):
+    """
+    Returns the process wide Prologix session for host:port,
+    creating it on first use. A session that has been idle for
+    more than check_interval seconds is health checked and
+    reconnected if needed. kwargs are passed to Prologix when
+    the session is created.
+    """
+    key = (host, port)
+    with _sessions_lock:
+        pro = _sessions.get(key)
+        if pro is None:
+            pro = Prologix(host=host, port=port, **kwargs)
+            _sessions[key] = pro
+        elif time.time() - pro.last_used > check_interval:
+            if not pro.is_alive():
+                pro.reconnect()
+            pro.last_used = time.time()
+        return pro
+
+def close_sessions():
+    """Closes all the shared Prologix sessions"""
+    with _sessions_lock:
+        for pro in _sessions.values():
+            pro.close()
+        _sessions.clear()
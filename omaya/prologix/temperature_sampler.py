@@ -0,0 +1,123 @@
+"""
+Background sampler of the Lakeshore temperatures,
+so that sweeps do not have to query the temperature
+controller at every bias point.
+"""
+import threading
+import time
+import logging
+import numpy
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+NUM_CHANNELS = 8
+
+class TemperatureSampler(object):
+    """
+    Polls all Lakeshore channels through a Prologix session
+    every interval seconds into a timestamped ring buffer of
+    capacity samples. Sweeps look up the temperature at the
+    time of each point with nearest() or interpolate().
+    """
+    def __init__(self, pro, interval=10.0, capacity=8640, units=0):
+        self.pro = pro
+        self.interval = interval
+        self.units = units
+        self.capacity = capacity
+        self.times = numpy.full(capacity, numpy.nan)
+        self.temperatures = numpy.full((capacity, NUM_CHANNELS), numpy.nan)
+        self.count = 0  # total samples taken
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Takes a first sample right away and starts polling"""
+        if self.running:
+            return
+        self.sample()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='TemperatureSampler',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except (OSError, ValueError) as e:
+                logger.warning("Temperature sample failed: %s" % e)
+
+    def sample(self):
+        """Reads all channels once and stores them"""
+        tempdic = self.pro.read_temperature(units=self.units)
+        now = time.time()
+        with self._lock:
+            i = self.count % self.capacity
+            self.times[i] = now
+            for chan in range(1, NUM_CHANNELS+1):
+                self.temperatures[i, chan-1] = tempdic.get(chan, numpy.nan)
+            self.count += 1
+
+    def history(self):
+        """
+        Returns copies of the sample times and temperatures
+        (nsamples x 8) in chronological order
+        """
+        with self._lock:
+            n = min(self.count, self.capacity)
+            start = self.count % self.capacity if self.count > self.capacity else 0
+            order = (numpy.arange(n) + start) % self.capacity
+            return self.times[order], self.temperatures[order]
+
+    def latest(self):
+        """Time and dict of channel temperatures of the last sample"""
+        with self._lock:
+            if self.count == 0:
+                return None, {}
+            i = (self.count - 1) % self.capacity
+            return self.times[i], dict((chan, self.temperatures[i, chan-1])
+                                       for chan in range(1, NUM_CHANNELS+1))
+
+    def nearest(self, t):
+        """
+        Dict of channel temperatures from the sample nearest to
+        time(s) t. t can be a scalar or an array.
+        """
+        times, temps = self.history()
+        t = numpy.asarray(t, dtype=float)
+        if len(times) == 1:
+            idx = numpy.zeros(t.shape, dtype=int)
+        else:
+            idx = numpy.clip(numpy.searchsorted(times, t), 1, len(times) - 1)
+            before = idx - 1
+            idx = numpy.where(t - times[before] <= times[idx] - t, before, idx)
+        return dict((chan, temps[idx, chan-1]) for chan in range(1, NUM_CHANNELS+1))
+
+    def interpolate(self, t):
+        """
+        Dict of channel temperatures linearly interpolated at
+        time(s) t. Times outside the buffer get the first or last
+        sample.
+        """
+        times, temps = self.history()
+        return dict((chan, numpy.interp(t, times, temps[:, chan-1]))
+                    for chan in range(1, NUM_CHANNELS+1))
+
+    def to_dataframe(self):
+        """The buffered samples, with unix time column t"""
+        times, temps = self.history()
+        df = pd.DataFrame(temps, columns=['T%d' % chan for chan in range(1, NUM_CHANNELS+1)])
+        df.insert(0, 't', times)
+        return df
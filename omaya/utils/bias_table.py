@@ -0,0 +1,86 @@
+"""
+Measured DAC code to junction voltage tables, so that a
+junction voltage can be set in one DAC write instead of
+servoing on the open loop set_vbias model.
+"""
+import os
+import numpy
+import pandas as pd
+from omaya.utils.sweep_test import BiasCalibration, pack_dac_codes
+
+DEFAULT_DIRECTORY = os.path.join('~', '.omaya', 'bias_tables')
+
+
+class BiasTable(object):
+    """
+    DAC code vs measured Vs (mV) of one mixer channel. Vs is made
+    monotone in code (running maximum) so that it can be inverted;
+    voltages inside the gap jump are interpolated across.
+    """
+    def __init__(self, codes, Vs):
+        codes = numpy.asarray(codes, dtype=float)
+        Vs = numpy.asarray(Vs, dtype=float)
+        good = numpy.isfinite(codes) & numpy.isfinite(Vs)
+        order = numpy.argsort(codes[good], kind='stable')
+        self.codes = codes[good][order]
+        self.Vs = Vs[good][order]
+        envelope = numpy.maximum.accumulate(self.Vs)
+        rising = numpy.concatenate(([True], numpy.diff(envelope) > 0))
+        self._codes = self.codes[rising]
+        self._Vs = envelope[rising]
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def from_sweep(cls, df, calibration=None):
+        """
+        Builds the table from a sweep dataframe with Vsis and Vs
+        columns, like the ones returned by dc_iv_sweep. The codes are
+        recomputed from Vsis with calibration (default BiasCalibration(),
+        the same model as set_vbias).
+        """
+        if calibration is None:
+            calibration = BiasCalibration()
+        return cls(calibration.dac_codes(df.Vsis.values), df.Vs.values)
+
+    @classmethod
+    def load(cls, filename):
+        df = pd.read_csv(filename)
+        return cls(df.code.values, df.Vs.values)
+
+    def save(self, filename):
+        directory = os.path.dirname(filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        pd.DataFrame({'code': self.codes.astype(int), 'Vs': self.Vs}).to_csv(filename, index=False)
+
+    @property
+    def vmin(self):
+        return self._Vs[0]
+
+    @property
+    def vmax(self):
+        return self._Vs[-1]
+
+    def covers(self, Vs):
+        return len(self._Vs) > 1 and self.vmin <= Vs <= self.vmax
+
+    def code(self, Vs):
+        """DAC code expected to give junction voltage Vs in mV"""
+        if not self.covers(Vs):
+            raise ValueError("%s mV outside the bias table range %.3f to %.3f mV" %
+                             (Vs, self.vmin, self.vmax))
+        return int(round(numpy.interp(Vs, self._Vs, self._codes)))
+
+    def voltage_bytes(self, Vs):
+        """[msb, lsb] voltage bytes for set_dac, like set_vbias"""
+        vbytes = pack_dac_codes(self.code(Vs))
+        return [int(vbytes[0]), int(vbytes[1])]
+
+
+def table_filename(card, channel, directory=None):
+    if directory is None:
+        directory = DEFAULT_DIRECTORY
+    return os.path.join(os.path.expanduser(directory),
+                        'card%d_channel%d.csv' % (card, channel))
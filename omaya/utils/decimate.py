@@ -0,0 +1,156 @@
+"""
+Incremental filters for streamed data. Each keeps its state across
+blocks, so a long acquisition can be reduced block by block as it is
+read instead of being buffered.
+
+Blocks are arrays of samples x channels (a 1-d block is one channel).
+"""
+import numpy as np
+
+
+def _as_block(block):
+    block = np.asarray(block, dtype=float)
+    if block.ndim == 1:
+        block = block[:, np.newaxis]
+    return block
+
+
+class RunningMean(object):
+    """
+    Mean and standard deviation per channel over everything seen so
+    far, ignoring NaN samples. Blocks are combined with Chan's
+    parallel update, so the result does not depend on block size.
+    """
+    def __init__(self):
+        self.n = None
+        self._mean = None
+        self._m2 = None
+
+    def update(self, block):
+        block = _as_block(block)
+        good = np.isfinite(block)
+        n = good.sum(axis=0)
+        x = np.where(good, block, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(n > 0, x.sum(axis=0) / n, 0.0)
+        m2 = (np.where(good, block - mean, 0.0)**2).sum(axis=0)
+        if self.n is None:
+            self.n, self._mean, self._m2 = n, mean, m2
+            return
+        total = self.n + n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = mean - self._mean
+            w = np.where(total > 0, n / np.maximum(total, 1), 0.0)
+            self._mean = self._mean + delta * w
+            self._m2 = self._m2 + m2 + delta**2 * self.n * w
+        self.n = total
+
+    @property
+    def mean(self):
+        if self.n is None:
+            return None
+        return np.where(self.n > 0, self._mean, np.nan)
+
+    @property
+    def std(self):
+        if self.n is None:
+            return None
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.n > 1, np.sqrt(self._m2 / np.maximum(self.n - 1, 1)), np.nan)
+
+
+class BoxcarDecimator(object):
+    """
+    Averages consecutive groups of factor samples (a first order
+    CIC filter), carrying the partial group over to the next block.
+    NaN samples are left out of their group's average.
+    """
+    def __init__(self, factor):
+        self.factor = int(factor)
+        self._sum = None
+        self._count = None
+        self._fill = 0  # samples in the partial group
+
+    def process(self, block):
+        """Returns the completed group averages, groups x channels"""
+        block = _as_block(block)
+        nch = block.shape[1]
+        if self._sum is None:
+            self._sum = np.zeros(nch)
+            self._count = np.zeros(nch)
+        good = np.isfinite(block)
+        x = np.where(good, block, 0.0)
+        # complete the partial group first
+        head = min(self.factor - self._fill, len(block))
+        self._sum += x[:head].sum(axis=0)
+        self._count += good[:head].sum(axis=0)
+        self._fill += head
+        sums, counts = [], []
+        if self._fill == self.factor:
+            sums.append(self._sum[np.newaxis])
+            counts.append(self._count[np.newaxis])
+            self._sum = np.zeros(nch)
+            self._count = np.zeros(nch)
+            self._fill = 0
+        rest = len(block) - head
+        nfull = rest // self.factor
+        if nfull:
+            end = head + nfull * self.factor
+            sums.append(x[head:end].reshape(nfull, self.factor, nch).sum(axis=1))
+            counts.append(good[head:end].reshape(nfull, self.factor, nch).sum(axis=1))
+        tail = head + nfull * self.factor
+        if tail < len(block):
+            self._sum += x[tail:].sum(axis=0)
+            self._count += good[tail:].sum(axis=0)
+            self._fill = len(block) - tail
+        if not sums:
+            return np.empty((0, nch))
+        sums = np.concatenate(sums)
+        counts = np.concatenate(counts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+class FIRDecimator(object):
+    """
+    Filters with taps and keeps every factor-th output, only
+    computing the outputs that are kept. The last len(taps)-1 input
+    samples are carried over so that outputs across block boundaries
+    are the same as for one long block. Output k is the window ending
+    at input sample (len(taps)-1) + k*factor.
+    """
+    def __init__(self, taps, factor):
+        self.taps = np.asarray(taps, dtype=float)
+        self.factor = int(factor)
+        self._history = None
+        self._offset = 0  # start in history+block of the next window
+
+    @classmethod
+    def lowpass(cls, factor, ntaps=None):
+        """Hamming windowed sinc low pass with cutoff at the new Nyquist"""
+        if ntaps is None:
+            ntaps = 4 * factor + 1
+        n = np.arange(ntaps) - (ntaps - 1) / 2.0
+        taps = np.sinc(n / factor) * np.hamming(ntaps)
+        return cls(taps / taps.sum(), factor)
+
+    def process(self, block):
+        block = _as_block(block)
+        if self._history is None:
+            self._history = np.empty((0, block.shape[1]))
+        x = np.concatenate((self._history, block))
+        ntaps = len(self.taps)
+        navail = len(x) - self._offset - ntaps + 1
+        nout = max(0, (navail + self.factor - 1) // self.factor)
+        out = np.zeros((nout, x.shape[1]))
+        if nout:
+            # np.convolve flips the kernel, so do the same here
+            for j, tap in enumerate(self.taps[::-1]):
+                start = self._offset + j
+                out += tap * x[start:start + (nout - 1) * self.factor + 1:self.factor]
+        next_start = self._offset + nout * self.factor
+        keep = max(len(x) - ntaps + 1, 0)
+        keep = min(keep, next_start)
+        self._history = x[keep:]
+        self._offset = next_start - keep
+        return out
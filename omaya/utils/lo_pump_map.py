@@ -0,0 +1,109 @@
+"""
+Persistent map of LO frequency and ferrite voltage to LO power
+and SIS pump current, used to warm start the LO power servos.
+"""
+import os
+import time
+import numpy
+import pandas as pd
+
+DEFAULT_FILENAME = os.path.join('~', '.omaya', 'lo_pump_map.csv')
+COLUMNS = ['device', 'lofreq', 'ferr', 'Vs', 'lopower', 'Is', 't']
+
+
+class LOPumpMap(object):
+    """
+    Table of converged LO servo points per SIS device, kept in a
+    csv file. The pump current depends on the junction bias, so each
+    point keeps the measured Vs (mV) it was taken at and lookups only
+    use points within max_dv of the bias asked for. Points at the
+    same device, LO frequency, ferrite voltage and bias replace each
+    other.
+    """
+    def __init__(self, filename=None):
+        if filename is None:
+            filename = DEFAULT_FILENAME
+        self.filename = os.path.expanduser(filename)
+        if os.path.exists(self.filename):
+            self.df = pd.read_csv(self.filename, dtype={'device': str})
+            if 'Vs' not in self.df:
+                # maps written before the bias was recorded
+                self.df.insert(COLUMNS.index('Vs'), 'Vs', numpy.nan)
+        else:
+            self.df = pd.DataFrame(columns=COLUMNS)
+
+    def __len__(self):
+        return len(self.df)
+
+    def save(self):
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.df.to_csv(self.filename, index=False)
+
+    def add(self, device, lofreq, ferr, Vs, lopower, Is, save=True, vtol=0.1):
+        """
+        Adds a converged point, pump current Is (uA) at junction
+        voltage Vs (mV), and saves the map. A point within vtol mV of
+        Vs at the same device, LO frequency and ferrite is replaced.
+        """
+        device = str(device)
+        df = self.df
+        same = (df.device == device) & numpy.isclose(df.lofreq.astype(float), lofreq) & \
+            numpy.isclose(df.ferr.astype(float), ferr, atol=1e-3) & \
+            (numpy.abs(df.Vs.astype(float) - Vs) <= vtol)
+        row = pd.DataFrame([[device, float(lofreq), float(ferr), float(Vs),
+                             float(lopower), float(Is), time.time()]], columns=COLUMNS)
+        self.df = pd.concat([df[~same], row], ignore_index=True) if len(df) else row
+        if save:
+            self.save()
+
+    def _device_points(self, device, Vs, max_dv):
+        """Points of device taken within max_dv mV of bias Vs"""
+        df = self.df[self.df.device == str(device)]
+        df = df.astype({'lofreq': float, 'ferr': float, 'Vs': float,
+                        'lopower': float, 'Is': float})
+        return df[numpy.abs(df.Vs - Vs) <= max_dv]
+
+    def _at_frequency(self, df, lofreq, x, y, xval, max_df):
+        """
+        Interpolates y(x) at xval separately at the measured LO
+        frequencies either side of lofreq (within max_df GHz) and
+        then linearly in frequency. Returns None without data.
+        """
+        freqs = numpy.unique(df.lofreq)
+        lower = freqs[(freqs <= lofreq) & (freqs >= lofreq - max_df)]
+        upper = freqs[(freqs >= lofreq) & (freqs <= lofreq + max_df)]
+        neighbours = [f for f in (lower.max() if len(lower) else None,
+                                  upper.min() if len(upper) else None)
+                      if f is not None]
+        if not neighbours:
+            return None
+        values = []
+        for f in neighbours:
+            points = df[df.lofreq == f].sort_values(x)
+            values.append(numpy.interp(xval, points[x], points[y]))
+        if len(neighbours) == 1 or neighbours[0] == neighbours[1]:
+            return values[0]
+        return numpy.interp(lofreq, neighbours, values)
+
+    def estimate_ferr(self, device, lofreq, target_Is, Vs, max_df=3.0, max_dv=0.5):
+        """
+        Ferrite voltage expected to give pump current target_Is (uA)
+        at junction voltage Vs (mV) on device at lofreq (GHz), or None
+        if the map has no points within max_df GHz and max_dv mV
+        """
+        if lofreq is None:
+            return None
+        return self._at_frequency(self._device_points(device, Vs, max_dv), lofreq,
+                                  'Is', 'ferr', target_Is, max_df)
+
+    def predict(self, device, lofreq, ferr, Vs, max_df=3.0, max_dv=0.5):
+        """Expected (lopower, Is) at ferrite voltage ferr and bias Vs, or None"""
+        if lofreq is None:
+            return None
+        df = self._device_points(device, Vs, max_dv)
+        lopower = self._at_frequency(df, lofreq, 'ferr', 'lopower', ferr, max_df)
+        if lopower is None:
+            return None
+        return lopower, self._at_frequency(df, lofreq, 'ferr', 'Is', ferr, max_df)
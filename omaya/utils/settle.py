@@ -0,0 +1,61 @@
+"""
+Settle detection for slow observables (pump current, IF
+power, LO power), used instead of fixed worst-case sleeps.
+"""
+import time
+import logging
+import numpy
+
+logger = logging.getLogger(__name__)
+
+
+def is_settled(values, atol=0.0, rtol=0.01):
+    """
+    True when the peak to peak spread of values, and the drift
+    of a straight line fit across them, are both within
+    atol + rtol*|mean|
+    """
+    values = numpy.asarray(values, dtype=float)
+    if len(values) < 2 or not numpy.all(numpy.isfinite(values)):
+        return False
+    tol = atol + rtol * abs(values.mean())
+    if values.max() - values.min() > tol:
+        return False
+    slope = numpy.polyfit(numpy.arange(len(values)), values, 1)[0]
+    return abs(slope) * (len(values) - 1) <= tol
+
+
+def wait_to_settle(measure, timeout=10.0, interval=0.2, window=5,
+                   atol=0.0, rtol=0.01, name='value', min_wait=0.0,
+                   fresh=False):
+    """
+    Calls measure() every interval seconds until the last window
+    readings are settled (see is_settled) or timeout seconds have
+    passed. Returns the last reading and the time waited, and logs
+    the time it took.
+
+    Readings are not accepted as settled before min_wait seconds,
+    and only readings taken after min_wait/2 count towards the
+    window, so the observable has time to respond first. With
+    fresh=True a reading equal to the one before it is taken to be
+    a cached value (an instrument that has not updated yet) and is
+    not counted.
+    """
+    t0 = time.time()
+    values = []
+    last = None
+    while True:
+        value = measure()
+        elapsed = time.time() - t0
+        if elapsed >= min_wait/2. and not (fresh and value == last):
+            values.append(value)
+            values = values[-window:]
+        last = value
+        if elapsed >= min_wait and len(values) == window and \
+                is_settled(values, atol=atol, rtol=rtol):
+            logger.info("%s settled at %s in %.2f s" % (name, values[-1], elapsed))
+            return values[-1], elapsed
+        if elapsed >= timeout:
+            logger.warning("%s not settled after %.2f s, last %s" % (name, elapsed, value))
+            return value, elapsed
+        time.sleep(min(interval, max(timeout - elapsed, 0)))
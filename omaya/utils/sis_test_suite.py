@@ -1,4 +1,5 @@
 from omaya.bias.labjackt7 import LabJackT7
+from omaya.bias.offset_tracker import OffsetTracker
 import time
 import pandas as pd
 import numpy
@@ -7,16 +8,21 @@ import logging
 import sys
 import datetime
 import numpy as np
-from omaya.prologix.prologix_all import Prologix
+from omaya.prologix.prologix_all import get_prologix
 from omaya.losystem.microlambda_class import MicroLambda
 from omaya.utils.sweep_test import get_swept_IF, Vsense, Isense, sweep_IF, \
-    sweep, set_vbias, RIsense_real, Rsafety_real, IVcurveTest, \
-    loPowerTest
+    sweep, set_vbias, set_vbias_array, adaptive_sweep, RIsense_real, Rsafety_real, IVcurveTest, \
+    loPowerTest, BiasCalibration, parabolic_minimum, SweepRecord, TEMPERATURE_COLUMNS, \
+    record_temperatures, fill_temperatures
+from omaya.prologix.temperature_sampler import TemperatureSampler
+from omaya.utils.settle import wait_to_settle
+from omaya.utils.lo_pump_map import LOPumpMap
+from omaya.utils.bias_table import BiasTable, table_filename
 import matplotlib.pyplot as plt
 
 class SISTestSuite(object):
     def __init__(self, directory, if_freq=6, oldBoard=True, card=2,
-                 debug=True):
+                 debug=True, pump_map_file=None, bias_table_dir=None):
         self.debug = debug
         logfile = datetime.datetime.now().strftime('sistest_%Y_%m_%d_%H%M.log')
         logging.basicConfig(filename=logfile,
@@ -34,33 +40,93 @@ class SISTestSuite(object):
         # Startup motor
         self.t7.setup_motor(0)
         self.t7.select_Load('hot')
-        self.pro = Prologix()
+        self.pro = get_prologix()
         self.pro.e3631a_output_on()
         self.ml = MicroLambda()
         self.if_freq = if_freq
         self.if_frequencies = np.arange(3, 9.2, 0.2) 
         self.offsets = {}
+        self.offset_tracker = OffsetTracker(self.t7, card=self.card, offsets=self.offsets)
+        self.sampler = None
+        self.last_servo = None
+        self.lofreq = None
+        self.pump_map = LOPumpMap(pump_map_file)
+        self.bias_table_dir = bias_table_dir
+        self.bias_tables = {}
+        self.last_optimal_bias = None
         self._get_offsets()
         plt.ion() # this command allows to show the plot inside a loop
 
+    def start_temperature_sampler(self, interval=10.0):
+        """
+        Starts reading the Lakeshore in the background every interval
+        seconds. While it runs the IF sweeps interpolate temperatures
+        from it instead of querying the Lakeshore at every point.
+        """
+        if self.sampler is None:
+            self.sampler = TemperatureSampler(self.pro, interval=interval)
+        self.sampler.interval = interval
+        self.sampler.start()
+        return self.sampler
+
+    def stop_temperature_sampler(self):
+        if self.sampler is not None:
+            self.sampler.stop()
+
+    def settle_pump_current(self, channel, timeout=10.0, gain_Is=200,
+                            atol=0.5, rtol=0.005, min_wait=1.0):
+        """
+        Waits at least min_wait and up to timeout seconds for the SIS
+        pump current on channel to settle after an LO change. Returns
+        the settled current in uA.
+        """
+        measure = lambda: Isense(self.t7.adc_read(channel, 1, card=self.card),
+                                 gain=gain_Is, off=self.offsets[channel])/1e-6
+        Is, elapsed = wait_to_settle(measure, timeout=timeout, interval=0.2,
+                                     window=5, atol=atol, rtol=rtol,
+                                     min_wait=min_wait,
+                                     name='Channel %d pump current' % channel)
+        return Is
+
+    def settle_if_power(self, ifchannel=0, timeout=1.0, rtol=0.01, min_wait=0.3):
+        """
+        Waits at least min_wait and up to timeout seconds for the IF
+        power on ifchannel to settle after a load or synthesizer
+        change. Repeated identical readings are the power meter
+        returning its last value and do not count as settled.
+        """
+        measure = lambda: self.pro.get_linear_power(IF=ifchannel)
+        power, elapsed = wait_to_settle(measure, timeout=timeout, interval=0.05,
+                                        window=3, rtol=rtol, min_wait=min_wait,
+                                        fresh=True, name='IF%d power' % ifchannel)
+        return power
+
     def _print(self, msg, loglevel=logging.INFO, ):
         if self.debug:
             print(msg)
         logging.log(level=loglevel, msg=msg)
         
     def _get_offsets(self):
-        for channel in range(8):
-            self.offsets[channel] = self.t7.adc_read(channel, 6, card=self.card) * 2.0
+        self.offset_tracker.refresh(range(8))
         self._print('Offsets: {}'.format(str(self.offsets)))  
         
     def dc_iv_sweep(self, channel=0, device='3',
                     vmin=-2, vmax=16, step=0.1,
                     gain_Vs=80, gain_Is=200,
                     timeout=0.010, off=None,
-                    makeplot=True, save=True, xlim=(0,25), ylim=(-10,200)):
+                    makeplot=True, save=True, xlim=(0,25), ylim=(-10,200),
+                    lua=False, calibrate=False, adaptive=False, max_points=None):
         """
         Function to get the IV sweep with no LO. 
+        With lua=True the sweep runs on the T7 as a Lua script.
+        With adaptive=True points are concentrated where the IV bends,
+        up to max_points (see sweep_test.adaptive_sweep). lua and
+        adaptive cannot be combined.
+        With calibrate=True the sweep also becomes the bias table
+        of the channel (see calibrate_bias_table).
         """
+        if lua and adaptive:
+            raise ValueError("lua=True runs a fixed grid and cannot be adaptive")
         self._print('Performing DC IV Sweep on channel %d device %s' % (channel, device))
         if off is None:
             #off = self.t7.adc_read(channel, 6) * 2.0
@@ -68,25 +134,34 @@ class SISTestSuite(object):
             self._print("Offset : %s" % off)
         old_bias = Vsense(self.t7.adc_read(channel, 0, card=self.card), gain=gain_Vs, off=off)/1e-3
         vlist = numpy.arange(vmin, vmax+step, step)
-        lisdic = []
-        for Vsis in vlist:
-            dic = {}
-            dic['Vsis'] = Vsis
-            voltage_bytes =  set_vbias(Vsis)
-            self.t7.set_dac([channel], voltage_bytes, card=self.card)
-            time.sleep(timeout)
-            # off = t7.adc_read(channel, 6) * 2.0
-            # dic['Off'] = off
-            Vs = Vsense(self.t7.adc_read(channel, 0, card=self.card), gain=gain_Vs, off=off)/1e-3
-            Is = Isense(self.t7.adc_read(channel, 1, card=self.card), gain=gain_Is, off=off)/1e-6
-            dic['Vs'] = Vs
-            dic['Is'] = Is
-            lisdic.append(dic)
+        if lua:
+            vs_adc, is_adc = self.t7.lua_sweep(channel, set_vbias_array(vlist),
+                                               settle=timeout, card=self.card)
+            df = pd.DataFrame({'Vsis': vlist,
+                               'Vs': Vsense(vs_adc, gain=gain_Vs, off=off)/1e-3,
+                               'Is': Isense(is_adc, gain=gain_Is, off=off)/1e-6})
+        else:
+            record = SweepRecord(['Vsis', 'Vs', 'Is'], len(vlist))
+            def measure(Vsis):
+                voltage_bytes =  set_vbias(Vsis)
+                self.t7.set_dac([channel], voltage_bytes, card=self.card)
+                time.sleep(timeout)
+                # off = t7.adc_read(channel, 6) * 2.0
+                Vs = Vsense(self.t7.adc_read(channel, 0, card=self.card), gain=gain_Vs, off=off)/1e-3
+                Is = Isense(self.t7.adc_read(channel, 1, card=self.card), gain=gain_Is, off=off)/1e-6
+                record.append(Vsis=Vsis, Vs=Vs, Is=Is)
+            if adaptive:
+                adaptive_sweep(measure, record, vmin, vmax, step, columns=('Vs', 'Is'),
+                               max_points=max_points)
+                df = record.to_dataframe(sort_by='Vsis')
+            else:
+                for Vsis in vlist:
+                    measure(Vsis)
+                df = record.to_dataframe()
         vbytes = set_vbias(old_bias)
         self.t7.set_dac([channel], vbytes, card=self.card)
         # off = t7.adc_read(channel, 6) * 2.0
         self._print("Setting and reading channel %d to voltage: %.3f" % (channel, Vsense(self.t7.adc_read(channel, 0, card=self.card), gain=gain_Vs, off=off)/1e-3))
-        df = pd.DataFrame(lisdic)
         if makeplot:
             figIV, axIV = plt.subplots(1,1,figsize=(8,6))
             axIV.plot(df.Vs, df.Is, 'o-', label='SIS%s cold' % device)
@@ -98,11 +173,22 @@ class SISTestSuite(object):
             fname = os.path.join(self.directory, 'sis%s_cold.csv' % device)
             df.to_csv(fname)
             self._print('Saving DC IV sweep to %s' % fname)
+        if calibrate:
+            self.calibrate_bias_table(channel, df)
         return df
 
     def sweep_IF_both(self, vmin=-2, vmax=16, step=0.1,
                       timeout=0.010, gain_Vs=80, gain_Is=200,
-                      channel=0, if_freq=None, off=None,):
+                      channel=0, if_freq=None, off=None, trigger=False,
+                      adaptive=False, max_points=None):
+        """
+        Sweeps channel while reading both IF powers. The
+        temperatures and both power meters are read in one
+        pipelined GPIB batch per point; trigger=True group
+        triggers the two power meters so they sample together.
+        With adaptive=True points are concentrated where Is or the
+        IF powers bend, and the result is sorted by Vsis.
+        """
         if if_freq is None:
             if_freq = self.if_freq
         self._print('Setting IF frequency to %s GHz' % if_freq)
@@ -111,31 +197,116 @@ class SISTestSuite(object):
             off = self.offsets[channel]
         old_bias = Vsense(self.t7.adc_read(channel, 0, card=self.card), gain=gain_Vs, off=off)/1e-3
         vlist = numpy.arange(vmin, vmax+step, step)
-        lisdic = []
-        for Vsis in vlist:
-            dic = {}
-            dic['Vsis'] = Vsis
+        record = SweepRecord(['Vsis', 'Vs', 'Is'] + TEMPERATURE_COLUMNS +
+                             ['IFPower_0', 'IFPower_1'], len(vlist))
+        use_sampler = self.sampler is not None and self.sampler.running
+        times = numpy.zeros(len(vlist))
+        def measure(Vsis):
             voltage_bytes =  set_vbias(Vsis)
             self.t7.set_dac([channel], voltage_bytes, card=self.card)
             time.sleep(timeout)
-            off = self.t7.adc_read(channel, 6, card=self.card) * 2.0
+            off = self.offset_tracker.offset(channel)
             Vs = Vsense(self.t7.adc_read(channel, 0, card=self.card), gain=gain_Vs, off=off)/1e-3
             Is = Isense(self.t7.adc_read(channel, 1, card=self.card), gain=gain_Is, off=off)/1e-6
-            dic['Vs'] = Vs
-            dic['Is'] = Is
-            tempdic = self.pro.read_temperature()
-            time.sleep(0.025)
-            for i in (1, 2, 3, 5, 6, 7):
-                dic['T%d' % i ] = tempdic[i]
+            row = record.append(Vsis=Vsis, Vs=Vs, Is=Is)
+            powers, tempdic = self.pro.read_powers_and_temperature(IF=(0, 1),
+                                                                   temperature=not use_sampler,
+                                                                   trigger=trigger)
+            if use_sampler:
+                times[row] = time.time()
+            else:
+                record_temperatures(record, row, tempdic)
             for ifchannel in range(2):
-                power = self.pro.get_linear_power(IF=ifchannel)
-                dic['IFPower_%d' % ifchannel] = power
-            lisdic.append(dic)
+                record['IFPower_%d' % ifchannel][row] = powers[ifchannel]
+        if adaptive:
+            adaptive_sweep(measure, record, vmin, vmax, step,
+                           columns=('Is', 'IFPower_0', 'IFPower_1'),
+                           max_points=max_points)
+        else:
+            for Vsis in vlist:
+                measure(Vsis)
+        if use_sampler:
+            fill_temperatures(record, times, self.sampler)
         vbytes = set_vbias(old_bias)
         self.t7.set_dac([channel], vbytes, card=self.card)
-        off = self.t7.adc_read(channel, 6, card=self.card) * 2.0
+        off = self.offset_tracker.offset(channel)
         self._print("Setting and reading channel %d to voltage: %.3f" % (channel, Vsense(self.t7.adc_read(channel, 0, card=self.card), gain=gain_Vs, off=off)/1e-3))
-        return pd.DataFrame(lisdic)
+        return record.to_dataframe(sort_by='Vsis' if adaptive else None)
+
+    def sweep_IF_multi(self, channels=[0, 1], vmin=-2, vmax=16, step=0.1,
+                       timeout=0.010, gain_Vs=80, gain_Is=200,
+                       if_freq=None, trigger=False, nsamples=1):
+        """
+        Sweeps several mixer channels in lockstep while reading both
+        IF powers. vmin and vmax are either common or lists with one
+        value per channel, and every channel gets its own
+        numpy.arange(vmin, vmax+step, step) grid. The first channel
+        sets the number of points: longer grids are cut at that
+        length and shorter ones hold their last value (a channel with
+        vmin == vmax is simply parked there).
+        Each point is one set_dacs packet (one software LDAC update
+        per MixerDAC), then one adc_read_burst of nsamples Vsense and
+        Isense conversions per channel.
+        Columns are Vsis_n, Vs_n and Is_n for each channel n, the
+        temperatures and IFPower_0, IFPower_1.
+        """
+        if if_freq is None:
+            if_freq = self.if_freq
+        self._print('Setting IF frequency to %s GHz' % if_freq)
+        self.pro.set_freq(if_freq*1e9)
+        vmins = numpy.broadcast_to(vmin, (len(channels),))
+        vmaxs = numpy.broadcast_to(vmax, (len(channels),))
+        grids = {}
+        for i, chan in enumerate(channels):
+            if vmins[i] == vmaxs[i]:
+                grid = numpy.array([vmins[i]])
+            else:
+                grid = numpy.arange(vmins[i], vmaxs[i]+step, step)
+            if i == 0:
+                npoints = len(grid)
+            elif len(grid) < npoints:
+                grid = numpy.concatenate((grid, numpy.repeat(grid[-1], npoints - len(grid))))
+            grids[chan] = grid[:npoints]
+        old_bias = {}
+        for chan in channels:
+            old_bias[chan] = Vsense(self.t7.adc_read(chan, 0, card=self.card), gain=gain_Vs,
+                                    off=self.offsets[chan])/1e-3
+        columns = []
+        for chan in channels:
+            columns += ['Vsis_%d' % chan, 'Vs_%d' % chan, 'Is_%d' % chan]
+        record = SweepRecord(columns + TEMPERATURE_COLUMNS + ['IFPower_0', 'IFPower_1'],
+                             npoints)
+        use_sampler = self.sampler is not None and self.sampler.running
+        times = numpy.zeros(npoints)
+        for point in range(npoints):
+            self.t7.set_dacs(dict((chan, set_vbias(grids[chan][point])) for chan in channels),
+                             card=self.card)
+            time.sleep(timeout)
+            values = {}
+            for chan in channels:
+                off = self.offset_tracker.offset(chan)
+                mean, std, counts = self.t7.adc_read_burst(chan, (0, 1), nsamples=nsamples,
+                                                           card=self.card)
+                values['Vsis_%d' % chan] = grids[chan][point]
+                values['Vs_%d' % chan] = Vsense(mean[0], gain=gain_Vs, off=off)/1e-3
+                values['Is_%d' % chan] = Isense(mean[1], gain=gain_Is, off=off)/1e-6
+            row = record.append(**values)
+            powers, tempdic = self.pro.read_powers_and_temperature(IF=(0, 1),
+                                                                   temperature=not use_sampler,
+                                                                   trigger=trigger)
+            if use_sampler:
+                times[row] = time.time()
+            else:
+                record_temperatures(record, row, tempdic)
+            for ifchannel in range(2):
+                record['IFPower_%d' % ifchannel][row] = powers[ifchannel]
+        if use_sampler:
+            fill_temperatures(record, times, self.sampler)
+        self.t7.set_dacs(dict((chan, set_vbias(old_bias[chan])) for chan in channels),
+                         card=self.card)
+        for chan in channels:
+            self._print("Setting and reading channel %d to voltage: %.3f" % (chan, Vsense(self.t7.adc_read(chan, 0, card=self.card), gain=gain_Vs, off=self.offsets[chan])/1e-3))
+        return record.to_dataframe()
 
     def sweep_IF(self, vmin=-2, vmax=16, step=0.1,
                  timeout=0.010, gain_Vs=80, gain_Is=200,
@@ -146,30 +317,31 @@ class SISTestSuite(object):
             off = self.offsets[channel]
         old_bias = Vsense(self.t7.adc_read(channel, 0, card=self.card), gain=gain_Vs, off=off)/1e-3
         vlist = numpy.arange(vmin, vmax+step, step)
-        lisdic = []
+        record = SweepRecord(['Vsis', 'Vs', 'Is'] + TEMPERATURE_COLUMNS + ['IFPower'],
+                             len(vlist))
+        use_sampler = self.sampler is not None and self.sampler.running
+        times = numpy.zeros(len(vlist))
         for Vsis in vlist:
-            dic = {}
-            dic['Vsis'] = Vsis
             voltage_bytes =  set_vbias(Vsis)
             self.t7.set_dac([channel], voltage_bytes, card=self.card)
             time.sleep(timeout)
-            off = self.t7.adc_read(channel, 6, card=self.card) * 2.0
+            off = self.offset_tracker.offset(channel)
             Vs = Vsense(self.t7.adc_read(channel, 0, card=self.card), gain=gain_Vs, off=off)/1e-3
             Is = Isense(self.t7.adc_read(channel, 1, card=self.card), gain=gain_Is, off=off)/1e-6
-            dic['Vs'] = Vs
-            dic['Is'] = Is
-            tempdic = self.pro.read_temperature()
-            time.sleep(0.025)
-            for i in (1, 2, 3, 5, 6, 7):
-                dic['T%d' % i ] = tempdic[i]
-            power = self.pro.get_linear_power(IF=ifchannel)
-            dic['IFPower'] = power
-            lisdic.append(dic)
+            powers, tempdic = self.pro.read_powers_and_temperature(IF=(ifchannel,),
+                                                                   temperature=not use_sampler)
+            row = record.append(Vsis=Vsis, Vs=Vs, Is=Is, IFPower=powers[ifchannel])
+            if use_sampler:
+                times[row] = time.time()
+            else:
+                record_temperatures(record, row, tempdic)
+        if use_sampler:
+            fill_temperatures(record, times, self.sampler)
         vbytes = set_vbias(old_bias)
         self.t7.set_dac([channel], vbytes, card=self.card)
-        off = self.t7.adc_read(channel, 6, card=self.card) * 2.0
+        off = self.offset_tracker.offset(channel)
         self._print("Setting and reading channel %d to voltage: %.3f" % (channel, Vsense(self.t7.adc_read(channel, 0, card=self.card), gain=gain_Vs, off=off)/1e-3))
-        return pd.DataFrame(lisdic)
+        return record.to_dataframe()
     
     def PIV_Curves(self, channel=0, device='3',
                    ifchannel=0,
@@ -182,12 +354,12 @@ class SISTestSuite(object):
 
         self._print("Moving to Hot Load")
         self.t7.select_Load('hot')
-        time.sleep(.5)
+        self.settle_if_power(ifchannel, timeout=0.5)
         df1_hot = self.sweep_IF(vmin=vmin, vmax=vmax, step=step,
                                 gain_Vs=gain_Vs, gain_Is=gain_Is,
                                 channel=channel, ifchannel=ifchannel) 
         self.t7.select_Load('cold')
-        time.sleep(.5)
+        self.settle_if_power(ifchannel, timeout=0.5)
         self._print("Moving to Cold Load")
         df1_cold = self.sweep_IF(vmin=vmin, vmax=vmax, step=step,
                                  gain_Vs=gain_Vs, gain_Is=gain_Is,
@@ -232,8 +404,23 @@ class SISTestSuite(object):
                                  df_noLO=None, lofreq=216,
                                  vmin=-2, vmax=16, step=0.1,
                                  gain_Vs=80, gain_Is=200,
-                                 makeplot=True, save=True, stepvmin=9, stepvmax=12):
-        
+                                 makeplot=True, save=True, stepvmin=9, stepvmax=12,
+                                 fast=False, **kwargs):
+        """
+        Finds the bias of minimum receiver temperature between
+        stepvmin and stepvmax and sets it. With fast=True only the
+        photon step is scanned (see fast_optimal_bias, which gets
+        kwargs) instead of full hot and cold PIV curves.
+        """
+        if fast:
+            if device=='4':
+                stepvmin = 11.0
+            opt_voltage, error = self.fast_optimal_bias(channel=channel, device=device,
+                                                        ifchannel=ifchannel,
+                                                        stepvmin=stepvmin, stepvmax=stepvmax,
+                                                        gain_Vs=gain_Vs, gain_Is=gain_Is,
+                                                        **kwargs)
+            return opt_voltage
         df_hot, df_cold, figIV, axIV = self.PIV_Curves(channel=channel, device=device,
                                                        ifchannel=ifchannel,
                                                        df_noLO=df_noLO, lofreq=lofreq,
@@ -257,21 +444,231 @@ class SISTestSuite(object):
         Vs = Vsense(self.t7.adc_read(channel, 0, card=self.card), gain=gain_Vs, off=self.offsets[channel])/1e-3
         self._print('Voltage read back %s mV' % Vs)
         return(opt_voltage)
+
+    def get_and_set_optimal_biases(self, channels=[0, 1], sis=['1', '2'],
+                                   ifchannels=[0, 1], df_noLO=None, lofreq=216,
+                                   vmin=-2, vmax=16, step=0.1,
+                                   gain_Vs=80, gain_Is=200,
+                                   makeplot=True, save=True, stepvmin=9, stepvmax=12):
+        """
+        get_and_set_optimal_bias for several channels at once: one
+        hot and one cold sweep_IF_multi step all the channels in
+        lockstep, so the load only moves twice. The optimal bias of
+        channel n is taken from IF power ifchannels[n] and all of them
+        are set together. Returns the optimal Vsis, one per channel.
+        """
+        self._print("Moving to Hot Load")
+        self.t7.select_Load('hot')
+        self.settle_if_power(ifchannels[0], timeout=0.5)
+        df_hot = self.sweep_IF_multi(channels=channels, vmin=vmin, vmax=vmax, step=step,
+                                     gain_Vs=gain_Vs, gain_Is=gain_Is)
+        self._print("Moving to Cold Load")
+        self.t7.select_Load('cold')
+        self.settle_if_power(ifchannels[0], timeout=0.5)
+        df_cold = self.sweep_IF_multi(channels=channels, vmin=vmin, vmax=vmax, step=step,
+                                      gain_Vs=gain_Vs, gain_Is=gain_Is)
+        power = float(self.pro.get_lo_power())/1e-3
+        Th = df_hot.T3.mean()
+        Tc = df_cold.T7.mean()
+        opt_voltages = []
+        for chan, device, ifchannel in zip(channels, sis, ifchannels):
+            vlo = 11.0 if device == '4' else stepvmin
+            Vs = df_hot['Vs_%d' % chan]
+            inside = (Vs > vlo) & (Vs < stepvmax)
+            TR = self.calcTR(df_hot['IFPower_%d' % ifchannel][inside],
+                             df_cold['IFPower_%d' % ifchannel][inside], Thot=Th, Tcold=Tc)
+            opt_voltage = df_hot['Vsis_%d' % chan][TR[TR>0].idxmin()]
+            self._print('Optimum Voltage for channel %d ifchannel %d SIS %s is %s V' % (chan, ifchannel, device, opt_voltage))
+            opt_voltages.append(opt_voltage)
+        self.t7.set_dacs(dict((chan, set_vbias(v)) for chan, v in zip(channels, opt_voltages)),
+                         card=self.card)
+        time.sleep(0.010)
+        for chan in channels:
+            Vs = Vsense(self.t7.adc_read(chan, 0, card=self.card), gain=gain_Vs, off=self.offsets[chan])/1e-3
+            self._print('Voltage read back on channel %d %s mV' % (chan, Vs))
+        devices = '_'.join(sis)
+        if makeplot:
+            figIV, axIV = plt.subplots(1, 1, figsize=(8,6))
+            for i, (chan, device, ifchannel) in enumerate(zip(channels, sis, ifchannels)):
+                if df_noLO is not None and len(df_noLO) > i:
+                    axIV.plot(df_noLO[i].Vs, df_noLO[i].Is, 'o-', label='SIS%s noLO' % device)
+                axIV.plot(df_hot['Vs_%d' % chan], df_hot['Is_%d' % chan], 'o-',
+                          label='SIS{:s} {:.0f}GHz {:.0f}mW'.format(device, lofreq, power))
+                axIV.plot(df_hot['Vs_%d' % chan], df_hot['IFPower_%d' % ifchannel]/5e-8, 's-',
+                          label='SIS{:s} IF{:d} Hot'.format(device, ifchannel))
+                axIV.plot(df_hot['Vs_%d' % chan], df_cold['IFPower_%d' % ifchannel]/5e-8, 's-',
+                          label='SIS{:s} IF{:d} Cold'.format(device, ifchannel))
+            axIV.set_xlim(0, 25)
+            axIV.set_xlabel('mV')
+            axIV.set_ylim(-10,200)
+            axIV.set_ylabel('uA')
+            axIV.legend()
+            axIV.grid()
+            axIV.set_title('{:s} SIS{:s} {:.0f}GHz'.format(self.directory, devices, lofreq))
+            plt.draw()
+            plt.show()
+            plt.pause(0.001)
+            if save:
+                figname = os.path.join(self.directory, '{:s}_sis{:s}_{:.0f}GHz_ivcurves.png'.format(self.directory, devices, lofreq))
+                figIV.savefig(figname, dpi=150)
+                self._print("Saving figure for PIV Curve to %s" % figname)
+        if save:
+            fname_hot = os.path.join(self.directory,
+                                     'sis{:s}_{:s}_{:.0f}GHz_{:.0f}mW_IF6_hot.txt'.format(devices, self.directory, lofreq, power))
+            df_hot.to_csv(fname_hot)
+            df_cold.to_csv(fname_hot.replace('_hot.txt', '_cold.txt'))
+            self._print("Saving hot and cold PIV csv files to %s" % fname_hot)
+        return opt_voltages
+
+    def _chopped_TR(self, channel, points, ifchannel, load, Th, Tc):
+        """
+        Receiver temperatures at the biases in points from one hot/cold
+        chop: the IF power at every bias is read at the load the motor
+        is at, then in reverse order at the other load, so that all
+        the points are centred on the same time. Returns {Vsis: TR}
+        and the load the motor ends up at.
+        """
+        powers = {}
+        for order in (points, points[::-1]):
+            if powers:
+                load = 'cold' if load == 'hot' else 'hot'
+                self.t7.select_Load(load)
+            for Vsis in order:
+                self.t7.set_dac([channel], set_vbias(Vsis), card=self.card)
+                powers[(load, Vsis)] = self.settle_if_power(ifchannel, timeout=0.5)
+        return dict((Vsis, self.calcTR(powers[('hot', Vsis)], powers[('cold', Vsis)],
+                                       Thot=Th, Tcold=Tc)) for Vsis in points), load
+
+    def _commanded_range(self, channel, vmin, vmax, timeout=0.010, gain_Vs=80):
+        """
+        Commanded Vsis range that gives measured Vs from vmin to vmax
+        (mV) on channel, from one Vs reading at each end. The current
+        bias is put back afterwards.
+        """
+        old_Vs = Vsense(self.t7.adc_read(channel, 0, card=self.card), gain=gain_Vs,
+                        off=self.offsets[channel])/1e-3
+        ends = []
+        for Vsis in (vmin, vmax):
+            self.t7.set_dac([channel], set_vbias(Vsis), card=self.card)
+            time.sleep(timeout)
+            Vs = Vsense(self.t7.adc_read(channel, 0, card=self.card), gain=gain_Vs,
+                        off=self.offsets[channel])/1e-3
+            # shift the end by the difference between commanded and measured
+            ends.append(Vsis + (Vsis - Vs))
+        self.t7.set_dac([channel], set_vbias(old_Vs), card=self.card)
+        return min(ends[0], vmin), max(ends[1], vmax)
+
+    def fast_optimal_bias(self, channel=0, device='3', ifchannel=0,
+                          stepvmin=9, stepvmax=12, coarse_step=0.25,
+                          refine='golden', tol=0.05, timeout=0.010,
+                          gain_Vs=80, gain_Is=200):
+        """
+        Optimal bias from a coarse hot and a coarse cold sweep over the
+        photon step only (stepvmin to stepvmax in measured Vs), with a
+        parabola through the TR points around the minimum as the first
+        estimate. refine='golden' (the default) then runs a golden
+        section search down to tol mV with hot/cold chops, so that gain
+        drifts between the two coarse sweeps do not bias the result.
+        Each chop reads the new point together with both points the
+        following step could need, so one load move decides two steps.
+        refine='parabolic' skips the chops and only suits a stable
+        receiver.
+        Sets the bias and returns the optimal Vsis and its error estimate.
+        """
+        t0 = time.time()
+        # the step is given in measured Vs, the sweep runs in commanded Vsis
+        vlo, vhi = self._commanded_range(channel, stepvmin, stepvmax,
+                                         timeout=timeout, gain_Vs=gain_Vs)
+        sweep = dict(vmin=vlo - coarse_step, vmax=vhi + coarse_step,
+                     step=coarse_step, timeout=timeout, gain_Vs=gain_Vs,
+                     gain_Is=gain_Is, channel=channel, ifchannel=ifchannel)
+        self.t7.select_Load('hot')
+        self.settle_if_power(ifchannel, timeout=0.5)
+        df_hot = self.sweep_IF(**sweep)
+        self.t7.select_Load('cold')
+        self.settle_if_power(ifchannel, timeout=0.5)
+        df_cold = self.sweep_IF(**sweep)
+        load, moves = 'cold', 2
+        Th = df_hot.T3.mean()
+        Tc = df_cold.T7.mean()
+        inside = (df_hot.Vs > stepvmin) & (df_hot.Vs < stepvmax)
+        Vsis = df_hot.Vsis[inside].values
+        TR = self.calcTR(df_hot.IFPower[inside].values, df_cold.IFPower[inside].values,
+                         Thot=Th, Tcold=Tc)
+        good = numpy.where(TR > 0)[0]
+        if len(good) == 0:
+            raise ValueError("No positive receiver temperature between %s and %s mV" % (stepvmin, stepvmax))
+        imin = good[numpy.argmin(TR[good])]
+        fit = slice(max(imin - 2, 0), imin + 3)
+        opt_voltage, error = parabolic_minimum(Vsis[fit], TR[fit])
+        if opt_voltage is None or not Vsis[fit][0] <= opt_voltage <= Vsis[fit][-1]:
+            opt_voltage, error = Vsis[imin], coarse_step/2.
+        elif not numpy.isfinite(error):
+            error = coarse_step/2.
+        npoints = 2*len(df_hot)
+        if refine == 'golden':
+            invphi = (numpy.sqrt(5) - 1)/2
+            def golden_step(a, b, c, d, left):
+                """the next bracket and the new point in it"""
+                if left:
+                    b, d = d, c
+                    c = b - invphi*(b - a)
+                    return (a, b, c, d), c
+                a, c = c, d
+                d = a + invphi*(b - a)
+                return (a, b, c, d), d
+            a = max(opt_voltage - coarse_step, Vsis[0])
+            b = min(opt_voltage + coarse_step, Vsis[-1])
+            bracket = (a, b)
+            state = (a, b, b - invphi*(b - a), a + invphi*(b - a))
+            TRs, load = self._chopped_TR(channel, list(state[2:]), ifchannel, load, Th, Tc)
+            npoints += 4
+            moves += 1
+            while state[1] - state[0] > tol:
+                state, x = golden_step(*state, left=TRs[state[2]] < TRs[state[3]])
+                points = [x]
+                if state[1] - state[0] > tol:
+                    # both possible points of the step after this one,
+                    # so that every chop decides two steps
+                    points += [golden_step(*state, left=left)[1] for left in (True, False)]
+                TR, load = self._chopped_TR(channel, points, ifchannel, load, Th, Tc)
+                TRs.update(TR)
+                npoints += 2*len(points)
+                moves += 1
+                if len(points) > 1:
+                    state, x = golden_step(*state, left=TRs[state[2]] < TRs[state[3]])
+            a, b = state[:2]
+            # a parabola through all the chopped points is less
+            # sensitive to noise than the final bracket alone
+            x, y = numpy.array(sorted(TRs.items())).T
+            opt_voltage, error = parabolic_minimum(x, y)
+            if opt_voltage is None or not bracket[0] <= opt_voltage <= bracket[1] \
+               or not error < 0.5*(b - a):
+                opt_voltage, error = 0.5*(a + b), 0.5*(b - a)
+        self.t7.set_dac([channel], set_vbias(opt_voltage), card=self.card)
+        time.sleep(timeout)
+        Vs = Vsense(self.t7.adc_read(channel, 0, card=self.card), gain=gain_Vs, off=self.offsets[channel])/1e-3
+        self.last_optimal_bias = {'opt_voltage': opt_voltage, 'error': error,
+                                  'Vs': Vs, 'points': npoints, 'moves': moves,
+                                  'time': time.time() - t0}
+        self._print('Optimum Voltage for channel %d ifchannel %d SIS %s is %.3f +/- %.3f mV (%d points, %d load moves, %.1f s)' %
+                    (channel, ifchannel, device, opt_voltage, error, npoints, moves,
+                     self.last_optimal_bias['time']))
+        self._print('Voltage read back %s mV' % Vs)
+        return opt_voltage, error
     
     def get_swept_IF(self, freqs, ifchannels=[0,1]):
-        lisdic = []
+        record = SweepRecord(['Frequency'] + ['Power_{}'.format(IFchan) for IFchan in ifchannels],
+                             len(freqs))
         for freq in freqs:
-
-            dic = {}
             self.pro.set_freq(freq*1e9)
-            time.sleep(1.0)
-            dic['Frequency'] = freq
+            self.settle_if_power(ifchannels[0], timeout=1.0)
+            row = record.append(Frequency=freq)
             for IFchan in ifchannels:
                 power = self.pro.get_linear_power(IF=IFchan)
-                dic['Power_{}'.format(IFchan)] = power
+                record['Power_{}'.format(IFchan)][row] = power
                 self._print("%s:  %s IF_%s" % (freq, power,IFchan))
-            lisdic.append(dic)
-        return pd.DataFrame(lisdic)
+        return record.to_dataframe()
 
     def calcTR(self, phot, pcold, Thot=47.6, Tcold=3.8):
         y = phot/pcold
@@ -294,12 +691,12 @@ class SISTestSuite(object):
             self.lo_current = []
 
         self.t7.select_Load('cold')
-        time.sleep(.6)
+        self.settle_if_power(ifchannels[0], timeout=0.6)
         if_cold = self.get_swept_IF(self.if_frequencies, ifchannels)
         # if_cold = self.get_swept_IF(self.if_frequencies, ifchan)
 
         self.t7.select_Load('hot')
-        time.sleep(.6)
+        self.settle_if_power(ifchannels[0], timeout=0.6)
         if_hot = self.get_swept_IF(self.if_frequencies, ifchannels)
         #if_hot = self.get_swept_IF(self.if_frequencies, ifchan)
 
@@ -352,13 +749,29 @@ class SISTestSuite(object):
             frequency = 285
         self._print('Setting LO Frequency to %s GHz' % frequency)
         self.ml.set_frequency(frequency/12.0)
+        self.lofreq = frequency
 
     def get_lo_power(self):
         return self.pro.get_lo_power()
 
-    def set_lo_power_voltage(self, voltage):
+    def set_lo_power_voltage(self, voltage=None, target_Is=None, device='1', Vs=None):
+        """
+        Sets the ferrite voltage. With voltage=None it is looked up
+        in the LO pump map for target_Is (uA) at junction voltage Vs
+        (mV) on device at the current LO frequency. Returns the
+        voltage set.
+        """
+        if voltage is None:
+            if target_Is is None or Vs is None:
+                raise ValueError("target_Is and Vs are needed to look up the ferrite voltage")
+            voltage = self.pump_map.estimate_ferr(device, self.lofreq, target_Is, Vs)
+            if voltage is None:
+                raise ValueError("No LO pump map points for SIS %s near %s GHz at %s mV" %
+                                 (device, self.lofreq, Vs))
+            self._print("LO pump map: ferrite %.3f V for %s uA on SIS %s" % (voltage, target_Is, device))
         #self.pro.e3631a_dual_set_voltage(voltage)
         self.ml.set_lo_power_voltage(voltage)
+        return voltage
         
     # def full_loPowerTest(self, fmin=216, fmax=279, optPow=30):
     #     lopowlist = np.arrange(.7, -8, .2) 
@@ -388,11 +801,133 @@ class SISTestSuite(object):
             check = 1
         return check
     
+    def _step_lopower_servo(self, channel, ferr, gain_Is=200,
+                            imin=50.0, imax=70.0, ferr_min=-1.0, ferr_max=0.7,
+                            ferr_step=0.1):
+        """
+        Walks the ferrite voltage in ferr_step steps from ferr until
+        the pump current is inside [imin, imax].
+        Returns ferr, Is, number of iterations and whether it converged.
+        """
+        iterations = 0
+        while True:
+            self.set_lo_power_voltage(ferr)
+            self.settle_pump_current(channel, gain_Is=gain_Is)
+            iterations += 1
+            lopower = self.get_lo_power()
+            Is = Isense(self.t7.adc_read(channel, 1, card=self.card), gain=gain_Is,
+                        off=self.offsets[channel])/1e-6
+            check = self._check_current(Is, imin=imin, imax=imax)
+            self._print("Check: %s" % check)
+            if check == 0:
+                return ferr, Is, iterations, True
+            if (check == -1 and ferr < ferr_min) or (check == 1 and ferr > ferr_max):
+                print("No more range available in ferrite. Already at %s" % ferr)
+                return ferr, Is, iterations, False
+            ferr += check * ferr_step
+
+    def _secant_lopower_servo(self, channel, ferr, gain_Is=200,
+                              imin=50.0, imax=70.0, ferr_min=-1.0, ferr_max=0.7,
+                              ferr_step=0.1, max_iter=10):
+        """
+        Servos the ferrite voltage onto the middle of [imin, imax]
+        using the measured Is(ferrite) curve; pump current rises with
+        ferrite voltage. Until the target is bracketed it takes secant
+        steps, capped at a step size that doubles every iteration.
+        Once bracketed it uses false position, bisecting when the
+        same side of the bracket moves twice in a row.
+        Returns ferr, Is, number of iterations and whether it converged.
+        """
+        target = 0.5 * (imin + imax)
+        below = above = prev = None  # (ferr, Is) points
+        last_side = None
+        cap = ferr_step
+        ferr = min(max(ferr, ferr_min), ferr_max)
+        for iteration in range(1, max_iter + 1):
+            self.set_lo_power_voltage(ferr)
+            Is = self.settle_pump_current(channel, gain_Is=gain_Is)
+            check = self._check_current(Is, imin=imin, imax=imax)
+            self._print("Check: %s" % check)
+            if check == 0:
+                return ferr, Is, iteration, True
+            if (check == 1 and ferr >= ferr_max) or (check == -1 and ferr <= ferr_min):
+                print("No more range available in ferrite. Already at %s" % ferr)
+                return ferr, Is, iteration, False
+            if check == 1:
+                below = (ferr, Is)
+            else:
+                above = (ferr, Is)
+            if below is not None and above is not None:
+                if check == last_side or above[1] == below[1]:
+                    new = 0.5 * (below[0] + above[0])
+                else:
+                    new = below[0] + (target - below[1]) * \
+                        (above[0] - below[0]) / (above[1] - below[1])
+            else:
+                step = check * cap
+                if prev is not None and prev[0] != ferr:
+                    slope = (Is - prev[1]) / (ferr - prev[0])
+                    if slope > 0:
+                        step = max(min((target - Is) / slope, cap), -cap)
+                new = ferr + step
+                cap *= 2
+            last_side = check
+            prev = (ferr, Is)
+            ferr = min(max(new, ferr_min), ferr_max)
+        return prev[0], prev[1], max_iter, False
+
+    def _warm_start_ferr(self, device, start_ferr, imin, imax, ferr_min, ferr_max, Vs):
+        """Start point for the servo from the LO pump map, if it has one"""
+        ferr = self.pump_map.estimate_ferr(device, self.lofreq, 0.5*(imin+imax), Vs)
+        if ferr is None:
+            return start_ferr
+        ferr = min(max(ferr, ferr_min), ferr_max)
+        self._print("Warm starting LO servo for SIS %s at %s GHz from ferrite %.3f V" %
+                    (device, self.lofreq, ferr))
+        return ferr
+
+    def _lopower_servo(self, channel, device, start_ferr, gain_Is, imin, imax,
+                       ferr_min, ferr_max, ferr_step, mode, warm_start, gain_Vs=80):
+        t0 = time.time()
+        # the pump current depends on the bias, so the map is keyed on it
+        Vs = Vsense(self.t7.adc_read(channel, 0, card=self.card), gain=gain_Vs,
+                    off=self.offsets[channel])/1e-3
+        if warm_start:
+            start_ferr = self._warm_start_ferr(device, start_ferr, imin, imax,
+                                               ferr_min, ferr_max, Vs)
+        if mode == 'step':
+            servo = self._step_lopower_servo
+        elif mode == 'secant':
+            servo = self._secant_lopower_servo
+        else:
+            raise ValueError("Unknown servo mode %s" % mode)
+        ferr, Is, iterations, converged = servo(channel, start_ferr, gain_Is=gain_Is,
+                                                imin=imin, imax=imax,
+                                                ferr_min=ferr_min, ferr_max=ferr_max,
+                                                ferr_step=ferr_step)
+        self.last_servo = {'mode': mode, 'iterations': iterations,
+                           'time': time.time() - t0, 'ferr': ferr, 'Is': Is,
+                           'converged': converged}
+        self._print("LO servo (%s): %s after %d iterations in %.1f s, ferrite %.3f V, Is %.2f uA" %
+                    (mode, 'converged' if converged else 'stopped', iterations,
+                     self.last_servo['time'], ferr, Is))
+        if converged and self.lofreq is not None:
+            self.pump_map.add(device, self.lofreq, ferr, Vs, self.get_lo_power(), Is)
+        return ferr, converged
+
     def lopower_servo_loop(self, channel=1, device='1',
                            start_ferr=0.7, gain_Is=200,
                            imin=50.0, imax=70.0, vbias=5.0,
                            ferr_min=-1.0, ferr_max=0.7,
-                           ferr_step=0.1):
+                           ferr_step=0.1, mode='step', warm_start=True):
+        """
+        Sets the ferrite voltage so that the pump current at vbias is
+        within [imin, imax]. mode='step' walks in ferr_step steps,
+        mode='secant' uses secant/bisection steps. Iteration count and
+        wall time of the last servo are kept in self.last_servo.
+        With warm_start the servo starts from the LO pump map estimate
+        instead of start_ferr, and converged points are added to the map.
+        """
         vb = set_vbias(vbias)
         self.t7.set_dac([channel], vb, card=self.card)
         time.sleep(0.050)
@@ -402,38 +937,19 @@ class SISTestSuite(object):
         if check == 0:
             self._print("Current at %s. Done" % Is)
             return 
-        ferr = start_ferr
-        self.set_lo_power_voltage(ferr)
-        time.sleep(10.0)
-        lopower = self.get_lo_power()
-        Is = Isense(self.t7.adc_read(channel, 1, card=self.card), gain=gain_Is, off=self.offsets[channel])/1e-6
-        check = self._check_current(Is, imin=imin, imax=imax)
-        self._print("Check: %s" % check)        
-        while check != 0:
-            if check == -1:
-                if ferr >= ferr_min:
-                    ferr -= ferr_step
-                else:
-                    print("No more range available in ferrite. Already at %s" % ferr)
-                    return
-            if check == 1:
-                if ferr <= ferr_max:
-                    ferr += ferr_step
-                else:
-                    print("No more range available in ferrite. Already at %s" % ferr)
-                    return
-            self.set_lo_power_voltage(ferr)
-            time.sleep(10.0)
-            lopower = self.get_lo_power()
-            Is = Isense(self.t7.adc_read(channel, 1, card=self.card), gain=gain_Is, off=self.offsets[channel])/1e-6
-            check = self._check_current(Is, imin=imin, imax=imax)            
-            self._print("Check: %s" % check)
+        self._lopower_servo(channel, device, start_ferr, gain_Is, imin, imax,
+                            ferr_min, ferr_max, ferr_step, mode, warm_start)
 
     def lopower_servo_loop_at_set_voltage(self, channel=1, device='1',
                                           start_ferr=0.7, gain_Is=200,
                                           imin=50.0, imax=70.0, 
                                           ferr_min=-1.0, ferr_max=0.7,
-                                          ferr_step=0.05):
+                                          ferr_step=0.05, mode='step',
+                                          warm_start=True):
+        """
+        Same as lopower_servo_loop at the bias already set on channel.
+        Returns the final ferrite voltage.
+        """
         Is = Isense(self.t7.adc_read(channel, 1, card=self.card),
                     gain=gain_Is, off=self.offsets[channel])/1e-6
         check = self._check_current(Is, imin=imin, imax=imax)
@@ -441,34 +957,11 @@ class SISTestSuite(object):
         if check == 0:
             self._print("Current at %s. Done" % Is)
             return start_ferr
-        ferr = start_ferr
-        self.set_lo_power_voltage(ferr)
-        time.sleep(10.0)
-        lopower = self.get_lo_power()
-        Is = Isense(self.t7.adc_read(channel, 1, card=self.card),
-                    gain=gain_Is, off=self.offsets[channel])/1e-6
-        check = self._check_current(Is, imin=imin, imax=imax)
-        self._print("Check: %s" % check)        
-        while check != 0:
-            if check == -1:
-                if ferr >= ferr_min:
-                    ferr -= ferr_step
-                else:
-                    print("No more range available in ferrite. Already at %s" % ferr)
-                    return ferr_min
-            if check == 1:
-                if ferr <= ferr_max:
-                    ferr += ferr_step
-                else:
-                    print("No more range available in ferrite. Already at %s" % ferr)
-                    return ferr_max
-            self.set_lo_power_voltage(ferr)
-            time.sleep(10.0)
-            lopower = self.get_lo_power()
-            Is = Isense(self.t7.adc_read(channel, 1, card=self.card), gain=gain_Is,
-                        off=self.offsets[channel])/1e-6
-            check = self._check_current(Is, imin=imin, imax=imax)            
-            self._print("Check: %s" % check)
+        ferr, converged = self._lopower_servo(channel, device, start_ferr, gain_Is,
+                                              imin, imax, ferr_min, ferr_max,
+                                              ferr_step, mode, warm_start)
+        if not converged and mode == 'step':
+            return ferr_min if ferr < ferr_min else ferr_max
         return ferr
     
     def full_test(self, lofreqs, channels=[0,1], sis=['1','2'],
@@ -476,7 +969,8 @@ class SISTestSuite(object):
                   df_noLO=[], ferrmax=0.7, ferrmin=-0.4,
                   ferrstep=-0.2, imin=40, imax=70, vbias=3.8,
                   vmin=3.0, vmax=5.0, gain_Vs=80, gain_Is=200,
-                  yig=True, stepvmin=9, stepvmax=12):
+                  yig=True, stepvmin=9, stepvmax=12, servo_mode='step',
+                  fast_bias=False, lockstep=True):
         #lofreqs = np.arrange(fmin, fmax+1, 3)
         nchans = len(ifchannels)
         for lofreq in lofreqs:
@@ -486,22 +980,31 @@ class SISTestSuite(object):
             time.sleep(0.5)
             self.lopower_servo_loop(channel=channels[0], device=sis[0],
                                     start_ferr=ferrmax, gain_Is=gain_Is,
-                                    imin=imin, imax=imax, vbias=vbias)
+                                    imin=imin, imax=imax, vbias=vbias,
+                                    mode=servo_mode)
             time.sleep(1.0)
-            for chan in range(nchans):
-                self.get_and_set_optimal_bias(channel=channels[chan], device=sis[chan],
-                                              ifchannel=ifchannels[chan],
-                                              df_noLO=df_noLO[chan],
-                                              lofreq=lofreq, vmin=vmin, vmax=vmax,
-                                              stepvmin=stepvmin, stepvmax=stepvmax,
-                                              gain_Vs=gain_Vs, gain_Is=gain_Is)
+            if lockstep and not fast_bias:
+                self.get_and_set_optimal_biases(channels=channels[:nchans], sis=sis[:nchans],
+                                                ifchannels=ifchannels, df_noLO=df_noLO,
+                                                lofreq=lofreq, vmin=vmin, vmax=vmax,
+                                                stepvmin=stepvmin, stepvmax=stepvmax,
+                                                gain_Vs=gain_Vs, gain_Is=gain_Is)
+            else:
+                for chan in range(nchans):
+                    self.get_and_set_optimal_bias(channel=channels[chan], device=sis[chan],
+                                                  ifchannel=ifchannels[chan],
+                                                  df_noLO=df_noLO[chan],
+                                                  lofreq=lofreq, vmin=vmin, vmax=vmax,
+                                                  stepvmin=stepvmin, stepvmax=stepvmax,
+                                                  gain_Vs=gain_Vs, gain_Is=gain_Is,
+                                                  fast=fast_bias)
             time.sleep(1.0)
             plt.draw()
             plt.show()
             plt.pause(0.001)
             for i, ferr in enumerate(np.arange(ferrmax, ferrmin, ferrstep)):
                 self.set_lo_power_voltage(ferr) 
-                time.sleep(10.0) 
+                self.settle_pump_current(channels[0], gain_Is=gain_Is)
                 if i == 0:
                     figLO = self.loPowerTest(channels=channels, sis=sis,
                                              ifchannels=ifchannels,
@@ -542,7 +1045,8 @@ class SISTestSuite(object):
                            df_noLO=[], ferrmax=0.7, ferrmin=-0.4,
                            ferrstep=-0.2, imin=40, imax=70, vbias=3.8,
                            vmin=3.0, vmax=5.0, gain_Vs=80, gain_Is=200,
-                           yig=True, stepvmin=9, stepvmax=12):
+                           yig=True, stepvmin=9, stepvmax=12, servo_mode='step',
+                           fast_bias=False, lockstep=True):
         #lofreqs = np.arrange(fmin, fmax+1, 3)
         nchans = len(ifchannels)
         for lofreq in lofreqs:
@@ -552,33 +1056,44 @@ class SISTestSuite(object):
             time.sleep(0.5)
             self.lopower_servo_loop(channel=channels[0], device=sis[0],
                                     start_ferr=ferrmax, gain_Is=gain_Is,
-                                    imin=imin, imax=imax, vbias=vbias)
+                                    imin=imin, imax=imax, vbias=vbias,
+                                    mode=servo_mode)
             time.sleep(1.0)
-            chan_opt_bias = {}
-            for chan in range(nchans):
-                for chan2 in range(nchans):
-                    vb = set_vbias(0.0)
-                    self.t7.set_dac([chan2], vb, card=self.card)
-                    time.sleep(0.050)                
-                opt_bias = self.get_and_set_optimal_bias(channel=channels[chan], device=sis[chan],
-                                                         ifchannel=ifchannels[chan],
-                                                         df_noLO=df_noLO[chan],
-                                                         lofreq=lofreq, vmin=vmin, vmax=vmax,
-                                                         stepvmin=stepvmin, stepvmax=stepvmax,
-                                                         gain_Vs=gain_Vs, gain_Is=gain_Is)
-                chan_opt_bias[channels[chan]] = opt_bias
-
-            for chan in range(nchans):
-                vb = chan_opt_bias[channels[chan]]
-                self.t7.set_dac([chan], set_vbias(vb), card=self.card)
-                time.sleep(0.050)
+            if lockstep and not fast_bias:
+                # both mixers are swept together instead of one at a time
+                # with the other parked
+                self.get_and_set_optimal_biases(channels=channels[:nchans], sis=sis[:nchans],
+                                                ifchannels=ifchannels, df_noLO=df_noLO,
+                                                lofreq=lofreq, vmin=vmin, vmax=vmax,
+                                                stepvmin=stepvmin, stepvmax=stepvmax,
+                                                gain_Vs=gain_Vs, gain_Is=gain_Is)
+            else:
+                chan_opt_bias = {}
+                for chan in range(nchans):
+                    for chan2 in range(nchans):
+                        vb = set_vbias(0.0)
+                        self.t7.set_dac([chan2], vb, card=self.card)
+                        time.sleep(0.050)                
+                    opt_bias = self.get_and_set_optimal_bias(channel=channels[chan], device=sis[chan],
+                                                             ifchannel=ifchannels[chan],
+                                                             df_noLO=df_noLO[chan],
+                                                             lofreq=lofreq, vmin=vmin, vmax=vmax,
+                                                             stepvmin=stepvmin, stepvmax=stepvmax,
+                                                             gain_Vs=gain_Vs, gain_Is=gain_Is,
+                                                             fast=fast_bias)
+                    chan_opt_bias[channels[chan]] = opt_bias
+
+                for chan in range(nchans):
+                    vb = chan_opt_bias[channels[chan]]
+                    self.t7.set_dac([chan], set_vbias(vb), card=self.card)
+                    time.sleep(0.050)
             time.sleep(1.0)
             plt.draw()
             plt.show()
             plt.pause(0.001)
             for i, ferr in enumerate(np.arange(ferrmax, ferrmin, ferrstep)):
                 self.set_lo_power_voltage(ferr) 
-                time.sleep(10.0) 
+                self.settle_pump_current(channels[0], gain_Is=gain_Is)
                 if i == 0:
                     figLO = self.loPowerTest(channels=channels, sis=sis,
                                              ifchannels=ifchannels,
@@ -622,7 +1137,8 @@ class SISTestSuite(object):
                        isstep=-5, imin=40, imax=70, vbias=3.8,
                        vmin=3.0, vmax=5.0, gain_Vs=80, gain_Is=200,
                        yig=True, stepvmin=9, stepvmax=12,
-                       current_servo=True):
+                       current_servo=True, servo_mode='step',
+                       fast_bias=False, lockstep=True):
         #lofreqs = np.arrange(fmin, fmax+1, 3)
         nchans = len(ifchannels)
         for lofreq in lofreqs:
@@ -632,26 +1148,37 @@ class SISTestSuite(object):
             time.sleep(0.5)
             self.lopower_servo_loop(channel=channels[0], device=sis[0],
                                     start_ferr=ferrmax, gain_Is=gain_Is,
-                                    imin=imin, imax=imax, vbias=vbias)
+                                    imin=imin, imax=imax, vbias=vbias,
+                                    mode=servo_mode)
             time.sleep(1.0)
-            chan_opt_bias = {}
-            for chan in range(nchans):
-                for chan2 in range(nchans):
-                    vb = set_vbias(25.0)
-                    self.t7.set_dac([chan2], vb, card=self.card)
-                    time.sleep(0.050)                
-                opt_bias = self.get_and_set_optimal_bias(channel=channels[chan], device=sis[chan],
-                                                         ifchannel=ifchannels[chan],
-                                                         df_noLO=df_noLO[chan],
-                                                         lofreq=lofreq, vmin=vmin, vmax=vmax,
-                                                         stepvmin=stepvmin, stepvmax=stepvmax,
-                                                         gain_Vs=gain_Vs, gain_Is=gain_Is)
-                chan_opt_bias[channels[chan]] = opt_bias
-
-            for chan in range(nchans):
-                vb = chan_opt_bias[channels[chan]]
-                self.t7.set_dac([chan], set_vbias(vb), card=self.card)
-                time.sleep(0.050)
+            if lockstep and not fast_bias:
+                # both mixers are swept together instead of one at a time
+                # with the other parked
+                self.get_and_set_optimal_biases(channels=channels[:nchans], sis=sis[:nchans],
+                                                ifchannels=ifchannels, df_noLO=df_noLO,
+                                                lofreq=lofreq, vmin=vmin, vmax=vmax,
+                                                stepvmin=stepvmin, stepvmax=stepvmax,
+                                                gain_Vs=gain_Vs, gain_Is=gain_Is)
+            else:
+                chan_opt_bias = {}
+                for chan in range(nchans):
+                    for chan2 in range(nchans):
+                        vb = set_vbias(25.0)
+                        self.t7.set_dac([chan2], vb, card=self.card)
+                        time.sleep(0.050)                
+                    opt_bias = self.get_and_set_optimal_bias(channel=channels[chan], device=sis[chan],
+                                                             ifchannel=ifchannels[chan],
+                                                             df_noLO=df_noLO[chan],
+                                                             lofreq=lofreq, vmin=vmin, vmax=vmax,
+                                                             stepvmin=stepvmin, stepvmax=stepvmax,
+                                                             gain_Vs=gain_Vs, gain_Is=gain_Is,
+                                                             fast=fast_bias)
+                    chan_opt_bias[channels[chan]] = opt_bias
+
+                for chan in range(nchans):
+                    vb = chan_opt_bias[channels[chan]]
+                    self.t7.set_dac([chan], set_vbias(vb), card=self.card)
+                    time.sleep(0.050)
             time.sleep(1.0)
             plt.draw()
             plt.show()
@@ -665,8 +1192,9 @@ class SISTestSuite(object):
                                                                   gain_Is=gain_Is,
                                                                   imin=is_current-(abs(isstep)*0.5),
                                                                   imax=is_current+(abs(isstep)*0.5),
-                                                                  ferr_step=0.05)
-                    time.sleep(10.0) 
+                                                                  ferr_step=0.05,
+                                                                  mode=servo_mode)
+                    self.settle_pump_current(channels[0], gain_Is=gain_Is)
                     if i == 0:
                         figLO = self.loPowerTest(channels=channels, sis=sis,
                                                  ifchannels=ifchannels,
@@ -703,7 +1231,7 @@ class SISTestSuite(object):
             else:
                 for i, ferr in enumerate(np.arange(ferrmax, ferrmin, ferrstep)):
                     self.set_lo_power_voltage(ferr) 
-                    time.sleep(10.0) 
+                    self.settle_pump_current(channels[0], gain_Is=gain_Is)
                     if i == 0:
                         figLO = self.loPowerTest(channels=channels, sis=sis,
                                                  ifchannels=ifchannels,
@@ -781,6 +1309,57 @@ class SISTestSuite(object):
             self._print("Check: %s" % check)
         return 
             
+    def get_bias_table(self, channel):
+        """Bias table of channel, from memory or the cache directory"""
+        if channel not in self.bias_tables:
+            filename = table_filename(self.card, channel, self.bias_table_dir)
+            if not os.path.exists(filename):
+                return None
+            self.bias_tables[channel] = BiasTable.load(filename)
+        return self.bias_tables[channel]
+
+    def calibrate_bias_table(self, channel, df=None, save=True, **kwargs):
+        """
+        Builds the DAC code to measured Vs table of channel from the
+        sweep df (a dc_iv_sweep with kwargs is run if not given) and
+        caches it per card and channel
+        """
+        if df is None:
+            df = self.dc_iv_sweep(channel=channel, makeplot=False, save=False, **kwargs)
+        table = BiasTable.from_sweep(df)
+        self.bias_tables[channel] = table
+        if save:
+            filename = table_filename(self.card, channel, self.bias_table_dir)
+            table.save(filename)
+            self._print("Saving bias table for card %d channel %d to %s" % (self.card, channel, filename))
+        return table
+
+    def set_junction_voltage(self, channel, Vs, device='1', tol=0.1,
+                             gain_Vs=80, settle=0.005):
+        """
+        Sets the junction voltage of channel to Vs (mV) with one DAC
+        write from the bias table and one read back. Falls back to
+        voltage_servo_loop without a table, outside its range or if
+        the read back is off by more than tol. Returns the measured Vs.
+        """
+        start_vb = Vs
+        table = self.get_bias_table(channel)
+        if table is not None and table.covers(Vs):
+            code = table.code(Vs)
+            self.t7.set_dac([channel], table.voltage_bytes(Vs), card=self.card)
+            time.sleep(settle)
+            Vs_read = Vsense(self.t7.adc_read(channel, 0, card=self.card),
+                             gain=gain_Vs, off=self.offsets[channel])/1e-3
+            if abs(Vs_read - Vs) <= tol:
+                self._print("Voltage for device %s (channel %d) at %s from bias table. Done" % (device, channel, Vs_read))
+                return Vs_read
+            self._print("Bias table gave %s mV instead of %s mV on channel %d" % (Vs_read, Vs, channel))
+            start_vb = float(BiasCalibration().Vsis(code))
+        self.voltage_servo_loop(channel=channel, device=device, gain_Vs=gain_Vs,
+                                vsmin=Vs-tol, vsmax=Vs+tol, start_vb=start_vb)
+        return Vsense(self.t7.adc_read(channel, 0, card=self.card),
+                      gain=gain_Vs, off=self.offsets[channel])/1e-3
+
     def sideband_test(self, lofreq, channels=[1, 0],
                       sis=['3', '4'], ifchannels=[0, 1],
                       opt_Vs=[10.5, 10.5],
@@ -794,69 +1373,33 @@ class SISTestSuite(object):
         power_s = "%.1f" % power
         ifs = "%.1f" % if_freq
         
-        # Turn 1 device on, other dev max - sweep for both IF powers hot and cold
-        ind = 0
-        channel1 = channels[ind]
-        device1 = sis[ind]
-        channel2 = channels[ind+1]
-        device2 = sis[ind+1]
-        opt_voltage = opt_Vs[ind]
-        self._print("Setting device %s to it opt voltage %s mV" % (device1, opt_voltage))
-        self.voltage_servo_loop(channel=channel1, device=device1, vsmin=opt_voltage-0.1,
-                                vsmax=opt_voltage+0.1)
-        self._print("Setting device %s to it max voltage %s mV" % (device2, 25))
-        self.t7.set_dac([channel2], set_vbias(25, Rn=40.0), card=self.card)
-
-        #hot then cold
-        self.t7.select_Load('hot')
-        time.sleep(0.1)
-        df_hot = self.sweep_IF_both(vmin=vmin, vmax=vmax, gain_Vs=gain_Vs,
-                                    gain_Is=gain_Is, channel=channel1, if_freq=if_freq)
-        filename = os.path.join(self.directory, 'sis%s_on_sis%s_max_%s_%sGHz_%smW_IF%s_hot.csv' % (device1, device2, self.directory, lofreq, power_s, ifs))    
-        df_hot.to_csv(filename)
-        
-        self.t7.select_Load('cold')
-        time.sleep(0.1)
-        df_cold = self.sweep_IF_both(vmin=vmin, vmax=vmax, gain_Vs=gain_Vs,
-                                     gain_Is=gain_Is, channel=channel1, if_freq=if_freq)
-        df_cold.to_csv(filename.replace('hot', 'cold'))
-
-        axIV.plot(df_hot.Vs, (df_hot.IFPower_0 - df_cold.IFPower_0)/1e-6, 's-', label="SIS%s ON IF0" % device1)
-        axIV.plot(df_hot.Vs, (df_hot.IFPower_1 - df_cold.IFPower_1)/1e-6, 's-', label="SIS%s ON IF1" % device1)
-        plt.draw()
-        plt.show()
-        plt.pause(0.001)
+        # Each device on in turn with the other one at its max voltage,
+        # both swept by sweep_IF_multi (the parked one at 25 mV) for
+        # both IF powers. Both configurations are swept at each load,
+        # so the load only moves twice.
+        configs = [(channels[0], sis[0], channels[1], sis[1], opt_Vs[0]),
+                   (channels[1], sis[1], channels[0], sis[0], opt_Vs[1])]
+        dfs = {}
+        for load, order in (('hot', configs), ('cold', configs[::-1])):
+            self.t7.select_Load(load)
+            self.settle_if_power(ifchannels[0], timeout=0.6)
+            for channel1, device1, channel2, device2, opt_voltage in order:
+                self._print("Setting device %s to it opt voltage %s mV" % (device1, opt_voltage))
+                self.set_junction_voltage(channel1, opt_voltage, device=device1, tol=0.1,
+                                          gain_Vs=gain_Vs)
+                self._print("Setting device %s to it max voltage %s mV" % (device2, 25))
+                df = self.sweep_IF_multi(channels=[channel1, channel2], vmin=[vmin, 25],
+                                         vmax=[vmax, 25], gain_Vs=gain_Vs,
+                                         gain_Is=gain_Is, if_freq=if_freq)
+                filename = os.path.join(self.directory, 'sis%s_on_sis%s_max_%s_%sGHz_%smW_IF%s_%s.csv' % (device1, device2, self.directory, lofreq, power_s, ifs, load))
+                df.to_csv(filename)
+                dfs[(channel1, load)] = df
 
-        
-        # Turn 2 device on, other dev max - sweep for both IF powers hot and cold
-        ind = 1
-        channel1 = channels[ind]
-        device1 = sis[ind]
-        channel2 = channels[ind-1]
-        device2 = sis[ind-1]
-        opt_voltage = opt_Vs[ind]
-        self._print("Setting device %s to it opt voltage %s mV" % (device1, opt_voltage))
-        self.voltage_servo_loop(channel=channel1, device=device1, vsmin=opt_voltage-0.1,
-                                vsmax=opt_voltage+0.1)
-        self._print("Setting device %s to it max voltage %s mV" % (device2, 25))
-        self.t7.set_dac([channel2], set_vbias(25, Rn=40.0), card=self.card)
-
-        #hot then cold
-        self.t7.select_Load('hot')
-        time.sleep(0.1)
-        df_hot = self.sweep_IF_both(vmin=vmin, vmax=vmax, gain_Vs=gain_Vs,
-                                    gain_Is=gain_Is, channel=channel1, if_freq=if_freq)
-        filename = os.path.join(self.directory, 'sis%s_on_sis%s_max_%s_%sGHz_%smW_IF%s_hot.csv' % (device1, device2, self.directory, lofreq, power_s, ifs))    
-        df_hot.to_csv(filename)
-        
-        self.t7.select_Load('cold')
-        time.sleep(0.1)
-        df_cold = self.sweep_IF_both(vmin=vmin, vmax=vmax, gain_Vs=gain_Vs,
-                                     gain_Is=gain_Is, channel=channel1, if_freq=if_freq)
-        df_cold.to_csv(filename.replace('hot', 'cold'))        
-        
-        axIV.plot(df_hot.Vs, (df_hot.IFPower_0 - df_cold.IFPower_0)/1e-6, 's-', label="SIS%s ON IF0" % device1)
-        axIV.plot(df_hot.Vs, (df_hot.IFPower_1 - df_cold.IFPower_1)/1e-6, 's-', label="SIS%s ON IF1" % device1)
+        for channel1, device1, channel2, device2, opt_voltage in configs:
+            df_hot, df_cold = dfs[(channel1, 'hot')], dfs[(channel1, 'cold')]
+            Vs = df_hot['Vs_%d' % channel1]
+            axIV.plot(Vs, (df_hot.IFPower_0 - df_cold.IFPower_0)/1e-6, 's-', label="SIS%s ON IF0" % device1)
+            axIV.plot(Vs, (df_hot.IFPower_1 - df_cold.IFPower_1)/1e-6, 's-', label="SIS%s ON IF1" % device1)
         
             
         #axIV.set_xlim(0, 25)
@@ -0,0 +1,258 @@
+"""
+Incremental stability statistics (Allan deviation, power spectral
+density and drift) for long bias and IF power runs. Data is fed in
+blocks as it arrives and the memory used does not grow with the
+length of the run.
+
+Blocks are arrays of samples x channels (a 1-d block is one channel)
+taken at a fixed interval tau0. Samples with a NaN in any channel are
+dropped, which shortens the time axis by the dropped samples.
+"""
+import numpy as np
+import pandas as pd
+
+
+def _as_block(block):
+    block = np.asarray(block, dtype=float)
+    if block.ndim == 1:
+        block = block[:, np.newaxis]
+    return block[np.isfinite(block).all(axis=1)]
+
+
+class AllanDeviation(object):
+    """
+    Overlapping Allan deviation at tau = tau0 * 2**k for k below
+    octaves.
+
+    Each tau is averaged over windows that start every tau/overlap
+    (overlap a power of two), so the short taus are fully overlapping
+    and the long ones are overlapped overlap times. The windows are
+    computed from prefix sums of the data averaged down in pairs, one
+    level per octave beyond log2(overlap). Every level keeps
+    2*overlap+1 prefix sums, so memory goes with octaves and not with
+    the number of samples.
+    """
+    def __init__(self, tau0, octaves=16, overlap=8):
+        self.tau0 = float(tau0)
+        self.octaves = int(octaves)
+        self.overlap = int(overlap)
+        self._base = int(np.log2(self.overlap))
+        if 2**self._base != self.overlap:
+            raise ValueError("overlap must be a power of two")
+        self.nlevels = max(self.octaves - self._base, 1)
+        # the octaves computed at each averaging level, and their windows
+        self._level_octaves = [[] for i in range(self.nlevels)]
+        for k in range(self.octaves):
+            level = max(k - self._base, 0)
+            self._level_octaves[level].append((k, 2**k // 2**level))
+        self.nsamples = 0
+        self._reference = None
+        self._prefix = None
+        self._carry = None
+        self._sumsq = None
+        self._count = np.zeros(self.octaves, dtype=np.int64)
+
+    @property
+    def taus(self):
+        return self.tau0 * 2.0**np.arange(self.octaves)
+
+    def update(self, block):
+        block = _as_block(block)
+        if len(block) == 0:
+            return
+        nch = block.shape[1]
+        if self._reference is None:
+            # keeps the prefix sums near zero
+            self._reference = block[0].copy()
+            self._prefix = [np.zeros((1, nch)) for i in range(self.nlevels)]
+            self._carry = [None] * self.nlevels
+            self._sumsq = np.zeros((self.octaves, nch))
+        self.nsamples += len(block)
+        x = block - self._reference
+        for level in range(self.nlevels):
+            if len(x) == 0:
+                break
+            self._update_level(level, x)
+            if level + 1 < self.nlevels:
+                x = self._pairs(level, x)
+
+    def _update_level(self, level, x):
+        old = self._prefix[level]
+        prefix = np.concatenate((old, old[-1] + np.cumsum(x, axis=0)))
+        nold = len(old)
+        for k, m in self._level_octaves[level]:
+            # differences of the window means ending at each new sample
+            first = max(nold, 2*m)
+            if first >= len(prefix):
+                continue
+            n = np.arange(first, len(prefix))
+            d = (prefix[n] - 2*prefix[n-m] + prefix[n-2*m]) / m
+            self._sumsq[k] += (d**2).sum(axis=0)
+            self._count[k] += len(n)
+        self._prefix[level] = prefix[-(2*self.overlap + 1):]
+
+    def _pairs(self, level, x):
+        """Means of consecutive pairs, carrying an odd sample over"""
+        if self._carry[level] is not None:
+            x = np.concatenate((self._carry[level], x))
+        npairs = len(x) // 2
+        self._carry[level] = x[2*npairs:] if len(x) % 2 else None
+        return x[:2*npairs].reshape(npairs, 2, x.shape[1]).mean(axis=1)
+
+    @property
+    def counts(self):
+        return self._count.copy()
+
+    @property
+    def adev(self):
+        """Allan deviation, octaves x channels (NaN without data)"""
+        if self._sumsq is None:
+            return None
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.sqrt(self._sumsq / (2.0 * self._count[:, np.newaxis]))
+
+
+class WelchPSD(object):
+    """
+    One sided power spectral density (units**2/Hz) averaged over
+    Hann windowed segments of nperseg samples overlapping by half,
+    with the mean removed from each segment. Only the unfinished
+    segment is kept between blocks.
+    """
+    def __init__(self, fs, nperseg=1024):
+        self.fs = float(fs)
+        self.nperseg = int(nperseg)
+        self.step = self.nperseg // 2
+        self.window = np.hanning(self.nperseg)
+        self.scale = 1.0 / (self.fs * (self.window**2).sum())
+        self.nsegments = 0
+        self._buffer = None
+        self._sum = None
+
+    @property
+    def frequencies(self):
+        return np.fft.rfftfreq(self.nperseg, 1.0 / self.fs)
+
+    def update(self, block):
+        block = _as_block(block)
+        if self._buffer is None:
+            self._buffer = np.empty((0, block.shape[1]))
+            self._sum = np.zeros((len(self.frequencies), block.shape[1]))
+        x = np.concatenate((self._buffer, block))
+        nseg = (len(x) - self.nperseg) // self.step + 1 if len(x) >= self.nperseg else 0
+        for i in range(nseg):
+            seg = x[i*self.step:i*self.step + self.nperseg]
+            seg = (seg - seg.mean(axis=0)) * self.window[:, np.newaxis]
+            self._sum += np.abs(np.fft.rfft(seg, axis=0))**2
+        self.nsegments += nseg
+        self._buffer = x[nseg*self.step:]
+
+    @property
+    def psd(self):
+        """PSD, frequencies x channels (None before the first segment)"""
+        if not self.nsegments:
+            return None
+        psd = self._sum * self.scale / self.nsegments
+        # one sided: double all but DC (and Nyquist for even nperseg)
+        last = -1 if self.nperseg % 2 == 0 else None
+        psd[1:last] *= 2
+        return psd
+
+
+class DriftFit(object):
+    """
+    Running least squares straight line through (t, x) per channel,
+    kept as sums with t measured from the first sample.
+    """
+    def __init__(self):
+        self.n = 0
+        self.t0 = None
+        self._sums = None
+
+    def update(self, t, block):
+        t = np.asarray(t, dtype=float)
+        block = np.asarray(block, dtype=float)
+        if block.ndim == 1:
+            block = block[:, np.newaxis]
+        good = np.isfinite(block).all(axis=1) & np.isfinite(t)
+        t, x = t[good], block[good]
+        if len(t) == 0:
+            return
+        if self.t0 is None:
+            self.t0 = t[0]
+            self._x0 = x[0].copy()
+            self._sums = [0.0, 0.0, 0.0, 0.0, 0.0]
+        t = t - self.t0
+        x = x - self._x0
+        st, stt, sx, stx, sxx = self._sums
+        self._sums = [st + t.sum(), stt + (t**2).sum(), sx + x.sum(axis=0),
+                      stx + (t[:, np.newaxis]*x).sum(axis=0), sxx + (x**2).sum(axis=0)]
+        self.n += len(t)
+
+    def fit(self):
+        """slope (per second), intercept at t0, residual rms and slope error"""
+        if self.n < 3:
+            return None
+        st, stt, sx, stx, sxx = self._sums
+        n = self.n
+        det = n*stt - st**2
+        if det <= 0:
+            return None
+        slope = (n*stx - st*sx) / det
+        intercept = (sx - slope*st) / n
+        rss = sxx - 2*slope*stx - 2*intercept*sx + slope**2*stt + \
+            2*slope*intercept*st + n*intercept**2
+        rms = np.sqrt(np.maximum(rss, 0) / (n - 2))
+        slope_err = rms * np.sqrt(n / det)
+        return slope, intercept + self._x0, rms, slope_err
+
+
+class StabilityAnalysis(object):
+    """
+    Allan deviation, PSD and drift of named channels sampled every
+    tau0 seconds. Feed it blocks with update; the results are
+    available at any time.
+    """
+    def __init__(self, names, tau0, octaves=16, overlap=8, nperseg=256):
+        self.names = list(names)
+        self.tau0 = float(tau0)
+        self.allan = AllanDeviation(tau0, octaves=octaves, overlap=overlap)
+        self.welch = WelchPSD(1.0 / tau0, nperseg=nperseg)
+        self.drift = DriftFit()
+
+    def update(self, block, t=None):
+        """
+        Adds samples x channels. t are the sample times, by default
+        continuing at tau0 from the last sample.
+        """
+        block = np.asarray(block, dtype=float)
+        if block.ndim == 1:
+            block = block[:, np.newaxis]
+        if t is None:
+            t = (self.drift.n + np.arange(len(block))) * self.tau0
+        self.allan.update(block)
+        self.welch.update(block)
+        self.drift.update(t, block)
+
+    def adev_dataframe(self):
+        adev = self.allan.adev
+        df = pd.DataFrame({'tau': self.allan.taus, 'count': self.allan.counts})
+        for i, name in enumerate(self.names):
+            df[name] = adev[:, i] if adev is not None else np.nan
+        return df[df['count'] > 0]
+
+    def psd_dataframe(self):
+        psd = self.welch.psd
+        df = pd.DataFrame({'f': self.welch.frequencies})
+        for i, name in enumerate(self.names):
+            df[name] = psd[:, i] if psd is not None else np.nan
+        return df
+
+    def drift_dataframe(self):
+        """Per channel drift per hour with its error, mean and rms"""
+        fit = self.drift.fit()
+        if fit is None:
+            return pd.DataFrame(columns=['slope_per_hour', 'slope_err', 'intercept', 'rms'])
+        slope, intercept, rms, err = fit
+        return pd.DataFrame({'slope_per_hour': slope*3600, 'slope_err': err*3600,
+                             'intercept': intercept, 'rms': rms}, index=self.names)
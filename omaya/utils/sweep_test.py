@@ -4,7 +4,9 @@ import pandas as pd
 import numpy
 #from fluke import Fluke
 import datetime
-from omaya.prologix.prologix_all import Prologix
+from omaya.prologix.prologix_all import get_prologix
+from omaya.bias.offset_tracker import OffsetTracker
+from omaya.utils.stability import StabilityAnalysis
 import matplotlib.pyplot as plt
 
 #In real mixer block
@@ -51,6 +53,35 @@ def set_vbias(Vsis, Rsafety=Rsafety_real, RIsense=RIsense_real,
     voltage_bytes = [dac_scale_value >> 8 , dac_scale_value & 0xFF]
     return voltage_bytes
 
+def dac_codes(Vsis, Rsafety=Rsafety_real, RIsense=RIsense_real,
+              Rn=40.0, Rdiv=Rdiv_real, Rb1=0.0, Rb2=10.2e3):
+    """
+    Vectorized version of the DAC code computation in set_vbias.
+    Vsis can be a scalar or an array of junction voltages in mV.
+    Returns integer DAC codes clipped to the 16 bit range.
+    """
+    dac_scale_value = numpy.trunc(dac_voltage(numpy.asarray(Vsis, dtype=float),
+                                              Rsafety=Rsafety, RIsense=RIsense,
+                                              Rn=Rn, Rdiv=Rdiv, Rb1=Rb1, Rb2=Rb2))
+    return numpy.clip(dac_scale_value, 0, 2**16 - 1).astype(int)
+
+def pack_dac_codes(codes):
+    """
+    Splits DAC codes into [msb, lsb] voltage bytes. For an
+    array of N codes returns an (N, 2) array.
+    """
+    codes = numpy.asarray(codes, dtype=int)
+    return numpy.stack([codes >> 8, codes & 0xFF], axis=-1)
+
+def set_vbias_array(Vsis, Rsafety=Rsafety_real, RIsense=RIsense_real,
+                    Rn=40.0, Rdiv=Rdiv_real, Rb1=0.0, Rb2=10.2e3):
+    """
+    Vectorized set_vbias. Returns an (N, 2) array of voltage
+    bytes for an array of N junction voltages in mV.
+    """
+    return pack_dac_codes(dac_codes(Vsis, Rsafety=Rsafety, RIsense=RIsense,
+                                    Rn=Rn, Rdiv=Rdiv, Rb1=Rb1, Rb2=Rb2))
+
 def Vsense(adc_value, gain=133.33, offset=2.0, off=None):
     if off is None:
         return (adc_value - offset)/gain
@@ -64,8 +95,222 @@ def Isense(adc_value, gain=285.7, offset=2.0, off=None, RIsense=RIsense_real):
         V_Isense = (adc_value - off)/gain  # voltage across RIsense
     return (V_Isense/RIsense)
 
+class BiasCalibration(object):
+    """
+    Bias calibration of one mixer channel with the resistor
+    network and amplifier gains evaluated once. All methods
+    accept scalars or numpy arrays.
+    """
+    def __init__(self, Rsafety=Rsafety_real, RIsense=RIsense_real,
+                 Rn=40.0, Rdiv=Rdiv_real, Rb1=0.0, Rb2=10.2e3, Vref=4.05,
+                 gain_Vs=133.33, gain_Is=285.7, offset=2.0):
+        self.Rsafety = Rsafety
+        self.RIsense = RIsense
+        self.Rn = Rn
+        self.Rdiv = Rdiv
+        self.Rb1 = Rb1
+        self.Rb2 = Rb2
+        self.Vref = Vref
+        self.gain_Vs = gain_Vs
+        self.gain_Is = gain_Is
+        self.offset = offset
+        # same factors, and order of operations, as desired_Vbias
+        # and dac_voltage so that the codes are identical
+        Rsis = RSIS(Rsafety, RIsense, Rn)
+        self.voltage_div_factor = (Rsis/(Rdiv + Rsis)) * (Rn/(Rn + RIsense))
+        self.bias_voltage_div_factor = Rb2/(Rb2 + Rb1)
+
+    def dac_voltage(self, Vsis):
+        Vb = numpy.asarray(Vsis, dtype=float) * 1e-3/self.voltage_div_factor
+        dac_set_point_voltage = Vb/self.bias_voltage_div_factor
+        return (dac_set_point_voltage + self.Vref) * 2**16/(2*self.Vref)
+
+    def dac_codes(self, Vsis):
+        """DAC codes for junction voltages Vsis in mV"""
+        dac_scale_value = numpy.trunc(self.dac_voltage(Vsis))
+        return numpy.clip(dac_scale_value, 0, 2**16 - 1).astype(int)
+
+    def voltage_bytes(self, Vsis):
+        """
+        Voltage bytes for Vsis in mV. A scalar gives a [msb, lsb]
+        list like set_vbias, an array gives an (N, 2) array.
+        """
+        vbytes = pack_dac_codes(self.dac_codes(Vsis))
+        if vbytes.ndim == 1:
+            return [int(vbytes[0]), int(vbytes[1])]
+        return vbytes
+
+    def Vsis(self, codes):
+        """Nominal junction voltage in mV for DAC codes"""
+        dac_set_point_voltage = numpy.asarray(codes, dtype=float) * (2*self.Vref)/2**16 - self.Vref
+        return dac_set_point_voltage * self.bias_voltage_div_factor * self.voltage_div_factor/1e-3
+
+    def Vs(self, adc_value, off=None):
+        """Junction voltage in mV from the Vsense ADC voltage"""
+        if off is None:
+            off = self.offset
+        return (numpy.asarray(adc_value) - off)/self.gain_Vs/1e-3
+
+    def Is(self, adc_value, off=None):
+        """Junction current in uA from the Isense ADC voltage"""
+        if off is None:
+            off = self.offset
+        return (numpy.asarray(adc_value) - off)/self.gain_Is/self.RIsense/1e-6
+
+
+# Lakeshore channels recorded with IF sweeps
+TEMPERATURE_CHANNELS = (1, 2, 3, 5, 6, 7)
+TEMPERATURE_COLUMNS = ['T%d' % i for i in TEMPERATURE_CHANNELS]
+
+class SweepRecord(object):
+    """
+    Preallocated columnar storage for sweep results.
+    All columns are float64 and share one Fortran ordered
+    block, so each column is contiguous and to_dataframe()
+    wraps the block without copying it. Columns listed in
+    datetime_columns hold unix times and are converted to
+    local datetimes on export.
+    """
+    def __init__(self, columns, npoints, datetime_columns=()):
+        self.columns = list(columns)
+        self._index = dict((name, i) for i, name in enumerate(self.columns))
+        self.datetime_columns = list(datetime_columns)
+        self.data = numpy.full((max(int(npoints), 1), len(self.columns)),
+                               numpy.nan, order='F')
+        self.npoints = 0
+
+    def __len__(self):
+        return self.npoints
+
+    def __getitem__(self, name):
+        """View of the filled part of column name"""
+        return self.data[:self.npoints, self._index[name]]
+
+    def _grow(self):
+        data = numpy.full((2*self.data.shape[0], len(self.columns)),
+                          numpy.nan, order='F')
+        data[:self.npoints] = self.data[:self.npoints]
+        self.data = data
+
+    def append(self, **values):
+        """
+        Adds a point. Columns not given are left as NaN.
+        Returns the row index of the point.
+        """
+        if self.npoints == self.data.shape[0]:
+            self._grow()
+        row = self.npoints
+        for name, value in values.items():
+            self.data[row, self._index[name]] = value
+        self.npoints += 1
+        return row
+
+    def to_dataframe(self, sort_by=None):
+        df = pd.DataFrame(self.data[:self.npoints], columns=self.columns,
+                          copy=False)
+        if self.datetime_columns:
+            tz = datetime.datetime.now().astimezone().tzinfo
+            for name in self.datetime_columns:
+                df[name] = pd.to_datetime(df[name], unit='s', utc=True).dt.tz_convert(tz).dt.tz_localize(None)
+        if sort_by is not None:
+            df = df.sort_values(sort_by, kind='stable').reset_index(drop=True)
+        return df
+
+
+def record_temperatures(record, row, tempdic):
+    """Stores a read_temperature dictionary in row of record"""
+    for i, name in zip(TEMPERATURE_CHANNELS, TEMPERATURE_COLUMNS):
+        record[name][row] = tempdic[i]
+
+
+def fill_temperatures(record, times, sampler):
+    """
+    Fills the temperature columns of record by interpolating the
+    TemperatureSampler history at the unix times of each point
+    """
+    tempdic = sampler.interpolate(times[:len(record)])
+    for i, name in zip(TEMPERATURE_CHANNELS, TEMPERATURE_COLUMNS):
+        record[name][:] = tempdic[i]
+
+
+def refine_points(x, ys, min_step, tol=0.01):
+    """
+    New sweep points for an adaptive sweep. Every interval of x whose
+    ends bend away from the neighbouring slopes of any of ys by more
+    than tol (as a fraction of that column's range) and that is wider
+    than min_step gets its midpoint, largest bend first. Refined
+    intervals therefore end up no wider than min_step.
+    """
+    order = numpy.argsort(x, kind='stable')
+    x = numpy.asarray(x, dtype=float)[order]
+    dx = numpy.diff(x)
+    score = numpy.zeros(len(dx))
+    if len(dx) < 2:
+        return x[:0]
+    for y in ys:
+        y = numpy.asarray(y, dtype=float)[order]
+        span = numpy.nanmax(y) - numpy.nanmin(y)
+        if not span > 0:
+            continue
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            bend = numpy.abs(numpy.diff(numpy.diff(y)/dx))
+        bend = numpy.nan_to_num(bend)
+        edge = numpy.zeros(len(dx))
+        edge[1:] = bend
+        edge[:-1] = numpy.maximum(edge[:-1], bend)
+        score = numpy.maximum(score, edge*dx/span)
+    split = numpy.where((score > tol) & (dx > min_step*(1 + 1e-9)))[0]
+    split = split[numpy.argsort(-score[split], kind='stable')]
+    return x[split] + dx[split]/2
+
+
+def adaptive_sweep(measure, record, vmin, vmax, step, columns=('Is',),
+                   coarse_step=None, max_points=None, tol=0.01):
+    """
+    Runs measure(Vsis), which appends one point to record, on a coarse
+    grid (default 4*step) from vmin to vmax, then keeps adding
+    midpoints where columns bend (see refine_points) until the spacing
+    there is step or less, the same resolution as the uniform sweep.
+    max_points defaults to a third of the uniform grid of step and is
+    never more than that grid.
+    """
+    npoints = len(numpy.arange(vmin, vmax+step, step))
+    if max_points is None:
+        max_points = int(numpy.ceil(npoints/3.))
+    max_points = min(max_points, npoints)
+    if coarse_step is None:
+        coarse_step = 4*step
+    coarse = numpy.minimum(numpy.arange(vmin, vmax+coarse_step/2., coarse_step), vmax)
+    if vmax - coarse[-1] > 1e-6*step:
+        # the range is not a multiple of coarse_step
+        coarse = numpy.append(coarse, vmax)
+    else:
+        coarse[-1] = vmax
+    for Vsis in coarse:
+        measure(Vsis)
+    while len(record) < max_points:
+        new = refine_points(record['Vsis'], [record[name] for name in columns],
+                            step, tol=tol)
+        if len(new) == 0:
+            break
+        for Vsis in new[:max_points - len(record)]:
+            measure(Vsis)
+    return record
+
+
 def sweep(t7, vmin, vmax, step, channel=0, timeout=0.010, off=None, card=0, oldBoard=True,
-          gain_Vs=133.33, gain_Is=285.7):
+          gain_Vs=133.33, gain_Is=285.7, lua=False, adaptive=False,
+          max_points=None):
+    """
+    DC IV sweep of channel from vmin to vmax mV. With lua=True the
+    DAC steps and ADC reads run on the T7 as a Lua script and the
+    results are fetched in one go at the end. With adaptive=True
+    the points are concentrated where the IV bends (see
+    adaptive_sweep) and the result is sorted by Vsis. The Lua script
+    only runs a fixed grid, so lua and adaptive cannot be combined.
+    """
+    if lua and adaptive:
+        raise ValueError("lua=True runs a fixed grid and cannot be adaptive")
     if off is None:
         #if oldBoard:
         #    off = t7.adc_read(channel, 6, card=card) * 2.0
@@ -75,94 +320,105 @@ def sweep(t7, vmin, vmax, step, channel=0, timeout=0.010, off=None, card=0, oldB
         print("Offset : %s" % off)
     old_bias = Vsense(t7.adc_read(channel, 0, card=card), gain=gain_Vs, off=off)/1e-3
     vlist = numpy.arange(vmin, vmax+step, step)
-    lisdic = []
-    for Vsis in vlist:
-        dic = {}
-        dic['Vsis'] = Vsis
-        voltage_bytes =  set_vbias(Vsis)
-        t7.set_dac(channel, voltage_bytes, card=card)
-        time.sleep(timeout)
-        # off = t7.adc_read(channel, 6) * 2.0
-        # dic['Off'] = off
-        Vs = Vsense(t7.adc_read(channel, 0, card=card), gain=gain_Vs, off=off)/1e-3
-        Is = Isense(t7.adc_read(channel, 1, card=card), gain=gain_Is, off=off)/1e-6
-        dic['Vs'] = Vs
-        dic['Is'] = Is
-        lisdic.append(dic)
+    if lua:
+        vs_adc, is_adc = t7.lua_sweep(channel, set_vbias_array(vlist),
+                                      settle=timeout, card=card)
+        df = pd.DataFrame({'Vsis': vlist,
+                           'Vs': Vsense(vs_adc, gain=gain_Vs, off=off)/1e-3,
+                           'Is': Isense(is_adc, gain=gain_Is, off=off)/1e-6})
+    else:
+        record = SweepRecord(['Vsis', 'Vs', 'Is'], len(vlist))
+        def measure(Vsis):
+            voltage_bytes =  set_vbias(Vsis)
+            t7.set_dac(channel, voltage_bytes, card=card)
+            time.sleep(timeout)
+            # off = t7.adc_read(channel, 6) * 2.0
+            Vs = Vsense(t7.adc_read(channel, 0, card=card), gain=gain_Vs, off=off)/1e-3
+            Is = Isense(t7.adc_read(channel, 1, card=card), gain=gain_Is, off=off)/1e-6
+            record.append(Vsis=Vsis, Vs=Vs, Is=Is)
+        if adaptive:
+            adaptive_sweep(measure, record, vmin, vmax, step, columns=('Vs', 'Is'),
+                           max_points=max_points)
+            df = record.to_dataframe(sort_by='Vsis')
+        else:
+            for Vsis in vlist:
+                measure(Vsis)
+            df = record.to_dataframe()
     vbytes = set_vbias(old_bias)
     t7.set_dac(channel, vbytes, card=card)
     # off = t7.adc_read(channel, 6) * 2.0
     print("Setting and reading channel %d to voltage: %.3f" % (channel, Vsense(t7.adc_read(channel, 0, card=card), gain=gain_Vs, off=off)/1e-3))
-    return pd.DataFrame(lisdic)
+    return df
 
 
-def sweep_IF(t7, vmin, vmax, step, channel=0, timeout=0.010, if_freq=6e9, oldBoard=True, card=0):
-    pro = Prologix()
+def sweep_IF(t7, vmin, vmax, step, channel=0, timeout=0.010, if_freq=6e9, oldBoard=True, card=0,
+             pro=None, sampler=None, tracker=None):
+    """
+    If a running TemperatureSampler is given the Lakeshore is not
+    queried per point, temperatures are interpolated from the sampler.
+    The 2V reference is only re-read when the OffsetTracker tracker
+    (a new one for this sweep by default) schedules it.
+    """
+    if pro is None:
+        pro = get_prologix()
     pro.set_freq(if_freq)
-    if oldBoard:
-        off = t7.adc_read(channel, 6, card=card) * 2.0
-    else:
-        off = t7.adc_read(channel, 6, card=card)
+    if tracker is None:
+        tracker = OffsetTracker(t7, card=card, scale=2.0 if oldBoard else 1.0)
+        tracker.refresh([channel])
+    off = tracker.offset(channel)
     print("Offset : %s" % off)
     old_bias = Vsense(t7.adc_read(channel, 0, card=card), off=off)/1e-3
     vlist = numpy.arange(vmin, vmax+step, step)
-    lisdic = []
+    record = SweepRecord(['Vsis', 'Vs', 'Is'] + TEMPERATURE_COLUMNS + ['IFPower'],
+                         len(vlist))
+    use_sampler = sampler is not None and sampler.running
+    times = numpy.zeros(len(vlist))
     for Vsis in vlist:
-        dic = {}
-        dic['Vsis'] = Vsis
         voltage_bytes =  set_vbias(Vsis)
         t7.set_dac(channel, voltage_bytes)
         time.sleep(timeout)
-        off = t7.adc_read(channel, 6) * 2.0
+        off = tracker.offset(channel)
         Vs = Vsense(t7.adc_read(channel, 0), off=off)/1e-3
         Is = Isense(t7.adc_read(channel, 1), off=off)/1e-6
-        dic['Vs'] = Vs
-        dic['Is'] = Is
-        tempdic = pro.read_temperature()
-        time.sleep(0.025)
-        for i in (1, 2, 3, 5, 6, 7):
-            dic['T%d' % i ] = tempdic[i]
-        power = pro.get_linear_power()
-        dic['IFPower'] = power
-        lisdic.append(dic)
+        powers, tempdic = pro.read_powers_and_temperature(IF=(0,),
+                                                          temperature=not use_sampler)
+        row = record.append(Vsis=Vsis, Vs=Vs, Is=Is, IFPower=powers[0])
+        if use_sampler:
+            times[row] = time.time()
+        else:
+            record_temperatures(record, row, tempdic)
+    if use_sampler:
+        fill_temperatures(record, times, sampler)
     vbytes = set_vbias(old_bias)
     t7.set_dac(channel, vbytes)
-    off = t7.adc_read(channel, 6) * 2.0
+    off = tracker.offset(channel)
     print("Setting and reading channel %d to voltage: %.3f" % (channel, Vsense(t7.adc_read(channel, 0), off=off)/1e-3))
-    return pd.DataFrame(lisdic)
+    return record.to_dataframe()
 
-def get_swept_IF(freqs):
-    pro = Prologix()
-    lisdic = []
+def get_swept_IF(freqs, pro=None):
+    if pro is None:
+        pro = get_prologix()
+    record = SweepRecord(['Frequency', 'Power'], len(freqs))
     for freq in freqs:
-        dic = {}
         pro.set_freq(freq*1e9)
         time.sleep(1.0)
         power = pro.get_linear_power()
-        dic['Frequency'] = freq
-        dic['Power'] = power
-        lisdic.append(dic)
+        record.append(Frequency=freq, Power=power)
         print("%s: %s" % (freq, power))
-    pro.sock.close()
-    return pd.DataFrame(lisdic)
+    return record.to_dataframe()
 
 def sweep_fluke(t7, fl, vmin, vmax, step, channel=0, timeout=0.010):
     vlist = numpy.arange(vmin, vmax+step, step)
-    lisdic = []
+    record = SweepRecord(['Vsis', 'Vs', 'Is', 'Vs_fl'], len(vlist))
     for Vsis in vlist:
-        dic = {}
-        dic['Vsis'] = Vsis
         voltage_bytes =  set_vbias(Vsis)
         t7.set_dac(channel, voltage_bytes)
         time.sleep(timeout)
         Vs = Vsense(t7.adc_read(channel, 0))/1e-3
         Is = Isense(t7.adc_read(channel, 1))/1e-6
         Vs_fl = fl.measure()[0]/1e-3
-        dic['Vs'] = Vs
-        dic['Is'] = Is
-        dic['Vs_fl'] = Vs_fl
-        lisdic.append(dic)
-    return pd.DataFrame(lisdic)
+        record.append(Vsis=Vsis, Vs=Vs, Is=Is, Vs_fl=Vs_fl)
+    return record.to_dataframe()
 
 def time_test(t7, Vsis, duration=60, timestep=10, channel=0):
     """ Measure the vsense on a period of time.
@@ -171,18 +427,73 @@ def time_test(t7, Vsis, duration=60, timestep=10, channel=0):
     voltage_bytes =  set_vbias(Vsis)
     t7.set_dac(channel, voltage_bytes)
     #time = numpy.arange(0, time+timestep, timestep)
-    lisdic = []
-    for t in range(int(duration/timestep)+1):
-        dic = {}
-        dic['Vsis'] = Vsis
+    npoints = int(duration/timestep)+1
+    record = SweepRecord(['Vsis', 't', 'Vs'], npoints, datetime_columns=['t'])
+    for t in range(npoints):
         Vs = Vsense(t7.adc_read(channel, 0))/1e-3
         # Vs_fl = fl.measure()[0]/1e-3
-        dic['t'] = datetime.datetime.now()
-        dic['Vs'] = Vs
-        # dic['Vs_fl'] = Vs_fl
-        lisdic.append(dic)
+        record.append(Vsis=Vsis, t=time.time(), Vs=Vs)
         time.sleep(timestep)
-    return pd.DataFrame(lisdic)
+    return record.to_dataframe()
+
+
+def stability_test(t7, Vsis, duration=3600, tau0=0.1, channel=0, card=0, nsamples=16,
+                   oldBoard=True, pro=None, ifchannel=None, octaves=16, overlap=8,
+                   nperseg=256, block=50, report=600):
+    """
+    Bias stability run: sets Vsis and samples Vs and Is (and the IF
+    power of ifchannel if pro is given) every tau0 seconds for
+    duration seconds with burst reads of nsamples conversions.
+    Samples are fed to a StabilityAnalysis every block samples, so
+    Allan deviation, PSD and drift are available as the run goes
+    and nothing else is kept. The 2V offset is read once at the
+    start so that reference drift shows in the result. tau0 must
+    leave time for the reads; late samples are counted and the
+    schedule moves on without catching up.
+    Returns the StabilityAnalysis.
+    """
+    names = ['Vs', 'Is']
+    if pro is not None:
+        if ifchannel is None:
+            ifchannel = 0
+        names.append('IFPower')
+    tracker = OffsetTracker(t7, card=card, scale=2.0 if oldBoard else 1.0)
+    off = tracker.refresh([channel])[channel]
+    print("Offset : %s" % off)
+    t7.set_dac(channel, set_vbias(Vsis), card=card)
+    analysis = StabilityAnalysis(names, tau0, octaves=octaves, overlap=overlap,
+                                 nperseg=nperseg)
+    nsteps = int(duration/tau0)
+    samples = numpy.zeros((block, len(names)))
+    times = numpy.zeros(block)
+    late = 0
+    nfill = 0
+    start = time.time()
+    next_report = start + report
+    for i in range(nsteps):
+        wait = start + i*tau0 - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        elif wait < -tau0:
+            late += 1
+            start = time.time() - i*tau0
+        mean, std, counts = t7.adc_read_burst(channel, (0, 1), nsamples=nsamples, card=card)
+        samples[nfill, 0] = Vsense(mean[0], off=off)/1e-3
+        samples[nfill, 1] = Isense(mean[1], off=off)/1e-6
+        if pro is not None:
+            powers, tempdic = pro.read_powers_and_temperature(IF=(ifchannel,), temperature=False)
+            samples[nfill, 2] = powers[ifchannel]
+        times[nfill] = time.time()
+        nfill += 1
+        if nfill == block or i == nsteps - 1:
+            analysis.update(samples[:nfill], times[:nfill])
+            nfill = 0
+        if time.time() > next_report:
+            print("%.0f s, %d late samples" % (time.time() - start, late))
+            print(analysis.drift_dataframe())
+            next_report += report
+    print("%d samples, %d late" % (nsteps, late))
+    return analysis
 
 
 def IVcurveTest(sis, df_noLO, t7, freq, power, day, channel=0):
@@ -190,11 +501,9 @@ def IVcurveTest(sis, df_noLO, t7, freq, power, day, channel=0):
     axIV.plot(df_noLO.Vs, df_noLO.Is, 'o-', label='SIS%0.0f noLO'%sis)
 
     t7.select_Load('hot')
-    time.sleep(.5)
     df1_hot = sweep_IF(t7, -2, 16, 0.1, channel=channel) 
 
     t7.select_Load('cold')
-    time.sleep(.5)
     df1_cold = sweep_IF(t7, -2, 16, 0.1, channel=channel)
 
     # power = raw_input('What is the max power in mW?')
@@ -223,17 +532,38 @@ def calcTR(phot, pcold, Thot=46.3, Tcold=3.7):
     TR = (Thot - y*Tcold)/(y-1)
     return TR
 
+def parabolic_minimum(x, y):
+    """
+    Vertex of the least squares parabola through (x, y) and its
+    1 sigma error from the fit covariance (nan with only 3 points).
+    Returns None, None if the points do not curve upwards.
+    """
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    if len(x) < 3:
+        return None, None
+    if len(x) > 3:
+        coeffs, cov = numpy.polyfit(x, y, 2, cov=True)
+    else:
+        coeffs, cov = numpy.polyfit(x, y, 2), None
+    a, b = coeffs[0], coeffs[1]
+    if a <= 0:
+        return None, None
+    xmin = -b/(2*a)
+    if cov is None:
+        return xmin, numpy.nan
+    jac = numpy.array([b/(2*a**2), -1/(2*a)])
+    return xmin, numpy.sqrt(jac.dot(cov[:2, :2]).dot(jac))
+
 
 def loPowerTest(sis, t7, freqs, freq, power, day, ax):
     if freqs is None:
         freqs = np.arange(3, 9.2, 0.2) 
         
     t7.select_Load('cold')
-    time.sleep(.6)
     if_cold = get_swept_IF(freqs)
 
     t7.select_Load('hot')
-    time.sleep(.6)
     if_hot = get_swept_IF(freqs)
 
     phot, pcold = if_hot.Power, if_cold.Power
@@ -0,0 +1,61 @@
+import numpy
+import pandas as pd
+
+from omaya.utils.lo_pump_map import LOPumpMap
+
+
+def _filled_map(filename):
+    pump_map = LOPumpMap(str(filename))
+    for lofreq in (216.0, 222.0):
+        for ferr in (-0.4, 0.0, 0.4):
+            # more pump current at lower ferrite, less at the higher bias
+            Is = 60 - 50*ferr + (lofreq - 216.0)
+            pump_map.add('1', lofreq, ferr, 4.0, 1e-3, Is)
+            pump_map.add('1', lofreq, ferr, 10.0, 1e-3, Is - 30)
+    return pump_map
+
+
+def test_round_trip(tmp_path):
+    filename = tmp_path / 'pump_map.csv'
+    pump_map = _filled_map(filename)
+    loaded = LOPumpMap(str(filename))
+    assert len(loaded) == len(pump_map) == 12
+    assert loaded.df.device.tolist() == pump_map.df.device.tolist()
+    assert numpy.allclose(loaded.df.Is, pump_map.df.Is)
+
+
+def test_add_replaces_same_point_only_at_same_bias(tmp_path):
+    pump_map = _filled_map(tmp_path / 'pump_map.csv')
+    pump_map.add('1', 216.0, 0.0, 4.05, 1e-3, 65.0)
+    assert len(pump_map) == 12
+    points = pump_map.df[(pump_map.df.lofreq == 216.0) & (pump_map.df.ferr == 0.0)]
+    assert sorted(points.Is) == [30.0, 65.0]
+
+
+def test_estimate_ferr_uses_points_at_the_bias(tmp_path):
+    pump_map = _filled_map(tmp_path / 'pump_map.csv')
+    # at 216 GHz and 4 mV, Is = 60 - 50*ferr
+    assert numpy.isclose(pump_map.estimate_ferr('1', 216.0, 50.0, 4.0), 0.2)
+    # at 10 mV the same current needs less ferrite
+    assert numpy.isclose(pump_map.estimate_ferr('1', 216.0, 20.0, 10.0), 0.2)
+    # halfway in frequency the two estimates are interpolated
+    assert numpy.isclose(pump_map.estimate_ferr('1', 219.0, 50.0, 4.0), 0.26)
+    assert pump_map.estimate_ferr('1', 216.0, 50.0, 7.0) is None
+    assert pump_map.estimate_ferr('1', 240.0, 50.0, 4.0) is None
+    assert pump_map.estimate_ferr('2', 216.0, 50.0, 4.0) is None
+
+
+def test_predict(tmp_path):
+    pump_map = _filled_map(tmp_path / 'pump_map.csv')
+    lopower, Is = pump_map.predict('1', 216.0, 0.2, 4.0)
+    assert numpy.isclose(lopower, 1e-3)
+    assert numpy.isclose(Is, 50.0)
+
+
+def test_loads_maps_without_bias(tmp_path):
+    filename = tmp_path / 'old_map.csv'
+    pd.DataFrame([['1', 216.0, 0.0, 1e-3, 60.0, 0.0]],
+                 columns=['device', 'lofreq', 'ferr', 'lopower', 'Is', 't']).to_csv(filename, index=False)
+    pump_map = LOPumpMap(str(filename))
+    assert len(pump_map) == 1
+    assert pump_map.estimate_ferr('1', 216.0, 60.0, 4.0) is None
@@ -0,0 +1,59 @@
+from omaya.prologix import prologix_all
+from omaya.prologix.prologix_all import Prologix
+
+
+class FakeSocket(object):
+    """Records everything sent and answers each ++read with a line"""
+    def __init__(self, *args):
+        self.sent = b''
+
+    def settimeout(self, timeout):
+        pass
+
+    def connect(self, address):
+        pass
+
+    def send(self, data):
+        self.sent += data
+        return len(data)
+
+    def recv(self, size):
+        return b'1.0\n'
+
+    def close(self):
+        pass
+
+
+def _prologix(monkeypatch):
+    monkeypatch.setattr(prologix_all.socket, 'socket', FakeSocket)
+    return Prologix(host='localhost')
+
+
+def test_read_addresses_the_instrument(monkeypatch):
+    pro = _prologix(monkeypatch)
+    pro.set_gpib_address(13)
+    pro.ask('LN')
+    pro.set_gpib_address(12)
+    pro.read()
+    assert pro.sock.sent == (b'++addr 13\r\n++auto 0\r\nLN\r\n++read eoi\r\n'
+                             b'++addr 12\r\n++read eoi\r\n')
+
+
+def test_read_skips_unchanged_address(monkeypatch):
+    pro = _prologix(monkeypatch)
+    pro.set_gpib_address(13)
+    pro.read()
+    pro.read()
+    assert pro.sock.sent == b'++addr 13\r\n++auto 0\r\n++read eoi\r\n++read eoi\r\n'
+
+
+def test_reconnect_resends_the_controller_prefix(monkeypatch):
+    pro = _prologix(monkeypatch)
+    pro.set_gpib_address(13)
+    pro.ask('LN')
+
+    def broken(data):
+        raise OSError("connection reset")
+    pro.sock.send = broken
+    pro.ask('LN')
+    assert pro.sock.sent == b'++addr 13\r\n++auto 0\r\nLN\r\n++read eoi\r\n'
@@ -0,0 +1,79 @@
+import numpy
+import pytest
+
+pytest.importorskip('labjack')
+from omaya.bias import stream
+from omaya.bias.stream import StreamAcquisition, SKIPPED_SAMPLE
+
+
+def _acquisition(capacity=50, scans_per_read=10):
+    acq = StreamAcquisition(None, ['AIN0', 'AIN1'], scan_rate=100,
+                            scans_per_read=scans_per_read, capacity=capacity)
+    acq.t0 = 0.0
+    return acq
+
+
+def _feed(acq, start, stop):
+    """Writes scans start..stop-1, each holding its own index"""
+    index = numpy.arange(start, stop, dtype=float)
+    acq._write(numpy.column_stack((index, -index)))
+
+
+def test_write_wraps_the_ring():
+    acq = _acquisition()
+    for start in range(0, 60, 15):
+        _feed(acq, start, start + 15)
+    assert acq.count == 60
+    t, data = acq.latest(5)
+    numpy.testing.assert_allclose(t, numpy.arange(55, 60)/100.0)
+    numpy.testing.assert_array_equal(data[:, 0], numpy.arange(55, 60))
+    numpy.testing.assert_array_equal(data[:, 1], -numpy.arange(55, 60))
+
+
+def test_window_drops_overwritten_scans():
+    acq = _acquisition()
+    for start in range(0, 60, 15):
+        _feed(acq, start, start + 15)
+    t, data = acq.window(0.25, 0.40)
+    numpy.testing.assert_array_equal(data[:, 0], numpy.arange(25, 41))
+    # scans 0..19 are gone or about to be overwritten by the next read
+    t, data = acq.window(0.0)
+    numpy.testing.assert_array_equal(data[:, 0], numpy.arange(20, 60))
+
+
+def test_block_longer_than_capacity():
+    acq = _acquisition()
+    _feed(acq, 0, 7)
+    _feed(acq, 7, 127)
+    assert acq.count == 127
+    t, data = acq.latest(40)
+    numpy.testing.assert_array_equal(data[:, 0], numpy.arange(87, 127))
+
+
+def test_decimated_is_aligned_and_skips_nan():
+    acq = _acquisition()
+    for start in range(0, 60, 15):
+        _feed(acq, start, start + 15)
+    t, data = acq.decimated(4)
+    # blocks start on multiples of 4 from scan 20
+    numpy.testing.assert_allclose(t, (numpy.arange(20, 60, 4) + 1.5)/100.0)
+    numpy.testing.assert_allclose(data[:, 0], numpy.arange(20, 60, 4) + 1.5)
+    block = numpy.column_stack((numpy.arange(60, 64, dtype=float), numpy.zeros(4)))
+    block[1, 0] = SKIPPED_SAMPLE
+    acq._write(block)
+    assert acq.skipped == 1
+    t, data = acq.decimated(4, nscans=4)
+    numpy.testing.assert_allclose(data[0], [(60 + 62 + 63)/3.0, 0.0])
+
+
+def test_read_error_stops_the_stream(monkeypatch):
+    calls = []
+
+    def fail(handle):
+        raise stream.ljm.LJMError(errorString='device disconnected')
+    monkeypatch.setattr(stream.ljm, 'eStreamRead', fail)
+    monkeypatch.setattr(stream.ljm, 'eStreamStop', lambda handle: calls.append(handle))
+    acq = _acquisition()
+    acq._run()
+    assert acq.error is not None
+    assert calls == [None]
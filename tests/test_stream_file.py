@@ -0,0 +1,90 @@
+import numpy
+import pytest
+
+from omaya.bias.stream_file import StreamWriter, StreamReader, SKIPPED_SAMPLE
+
+
+def _scans(nscans, nchannels=2):
+    return numpy.arange(nscans*nchannels, dtype=float).reshape(nscans, nchannels)
+
+
+def _write(filename, data, **kwargs):
+    with StreamWriter(str(filename), ['AIN0', 'AIN1'], scan_rate=100.0,
+                      start_time=1000.0, chunk_scans=32, **kwargs) as writer:
+        # blocks that do not line up with the chunks
+        for i in range(0, len(data), 45):
+            writer.write(data[i:i+45].ravel())
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_round_trip(tmp_path, compress):
+    data = _scans(250)
+    data[7, 1] = SKIPPED_SAMPLE
+    filename = tmp_path / 'run.stream'
+    _write(filename, data, compress=compress)
+    reader = StreamReader(str(filename))
+    assert reader.compressed == compress
+    assert len(reader) == 250
+    if not compress:
+        assert isinstance(reader.data, numpy.memmap)
+    expected = data.copy()
+    expected[7, 1] = numpy.nan
+    numpy.testing.assert_array_equal(reader.read(), expected)
+    # reads that start and stop inside chunks
+    numpy.testing.assert_array_equal(reader.read(30, 97), expected[30:97])
+    numpy.testing.assert_array_equal(reader.read(249), expected[249:])
+    assert reader.read(120, 120).shape == (0, 2)
+
+
+def test_chunk_index(tmp_path):
+    filename = tmp_path / 'run.stream'
+    _write(filename, _scans(250), compress=True)
+    reader = StreamReader(str(filename))
+    # 7 full chunks of 32 and the 26 scans flushed on close
+    assert list(reader._first) == [0, 32, 64, 96, 128, 160, 192, 224, 250]
+    assert len(reader._offsets) == 8
+    assert numpy.all(numpy.diff(reader._offsets) > 0)
+
+
+def test_truncated_last_chunk(tmp_path):
+    data = _scans(250)
+    filename = tmp_path / 'run.stream'
+    _write(filename, data, compress=True)
+    size = filename.stat().st_size
+    with open(str(filename), 'r+b') as fp:
+        fp.truncate(size - 5)
+    reader = StreamReader(str(filename))
+    assert len(reader) == 224
+    numpy.testing.assert_array_equal(reader.read(), data[:224])
+
+
+def test_truncated_uncompressed_file(tmp_path):
+    data = _scans(250)
+    filename = tmp_path / 'run.stream'
+    _write(filename, data)
+    size = filename.stat().st_size
+    with open(str(filename), 'r+b') as fp:
+        # half a scan
+        fp.truncate(size - 4)
+    reader = StreamReader(str(filename))
+    assert len(reader) == 249
+    numpy.testing.assert_array_equal(reader.read(), data[:249])
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_window(tmp_path, compress):
+    data = _scans(250)
+    filename = tmp_path / 'run.stream'
+    _write(filename, data, compress=compress)
+    reader = StreamReader(str(filename))
+    # scans at 1000.00, 1000.01, ... ; 1000.105 to 1000.5 is scans 11..50
+    t, window = reader.window(1000.105, 1000.5)
+    numpy.testing.assert_allclose(t, 1000.0 + numpy.arange(11, 51)/100.0)
+    numpy.testing.assert_array_equal(window, data[11:51])
+    t, window = reader.window(None, 999.0)
+    assert len(t) == 0 and window.shape == (0, 2)
+    t, window = reader.window(1002.0, None)
+    numpy.testing.assert_array_equal(window, data[200:])
+    df = reader.to_dataframe(1000.0, 1000.025)
+    assert list(df.columns) == ['t', 'AIN0', 'AIN1']
+    assert len(df) == 3
@@ -0,0 +1,43 @@
+import numpy
+import pytest
+
+from omaya.utils.sweep_test import SweepRecord, adaptive_sweep, sweep
+
+
+def _run_adaptive(vmin, vmax, step, **kwargs):
+    record = SweepRecord(['Vsis', 'Is'], 1000)
+
+    def measure(Vsis):
+        # sharp gap step at 9 mV on a linear background
+        record.append(Vsis=Vsis, Is=Vsis + 50*numpy.tanh((Vsis - 9.0)/0.05))
+
+    return adaptive_sweep(measure, record, vmin, vmax, step, **kwargs)
+
+
+def test_adaptive_sweep_resolves_features_at_step():
+    step = 0.1
+    record = _run_adaptive(-2, 16, step)
+    x = numpy.sort(record['Vsis'])
+    dx = numpy.diff(x)
+    assert dx.min() <= step + 1e-9
+    # the gap is sampled at least as finely as the uniform grid
+    near = (x[:-1] > 8.8) & (x[1:] < 9.2)
+    assert near.any()
+    assert dx[near].max() <= step + 1e-9
+
+
+def test_adaptive_sweep_respects_max_points():
+    record = _run_adaptive(-2, 16, 0.1)
+    assert len(record) <= int(numpy.ceil(181/3.))
+
+
+def test_adaptive_sweep_reaches_vmax():
+    # 17.7 mV is not a multiple of the 0.4 mV coarse step
+    record = _run_adaptive(-2, 15.7, 0.1)
+    assert record['Vsis'].min() == -2
+    assert record['Vsis'].max() == 15.7
+
+
+def test_sweep_rejects_lua_with_adaptive():
+    with pytest.raises(ValueError):
+        sweep(None, -2, 16, 0.1, lua=True, adaptive=True)